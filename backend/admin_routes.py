@@ -1,50 +1,22 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify
 from models import db, User, Sponsor, Campaign, AdRequest, Influencer, UserFlag, CampaignFlag
-from functools import wraps
 from flask_cors import cross_origin
-import jwt
-from datetime import datetime, timedelta
 from config import cache
+from caching import principal_cache_key, cache_stats
+from pagination import keyset_page, with_next_cursor, InvalidCursor, page_size
+from mailer import mail_stats
+import auth
+import changelog
+import login_dates
+import helper
+import rollups
 
 # Create Blueprint for admin routes
 admin = Blueprint("admin_bp", __name__)
 
-# Secret key for JWT
-# SECRET_KEY = current_app.config["SECRET_KEY"]
-
-# Decorators
-def token_required(f):
-    """
-    Decorator to check for a valid JWT token in the Authorization header.
-    """
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        token = request.headers.get('Authorization')
-        if not token:
-            return jsonify({"error": "Token is missing!"}), 403
-        try:
-            token = token.split(" ")[1]  # Extract token from Bearer <Token>
-            SECRET_KEY = current_app.config["SECRET_KEY"]
-            data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-            request.user = data
-        except jwt.ExpiredSignatureError:
-            return jsonify({"error": "Token has expired!"}), 403
-        except jwt.InvalidTokenError:
-            return jsonify({"error": "Invalid token!"}), 403
-        return f(*args, **kwargs)
-    return decorated_function
-
-
-def admin_required(f):
-    """
-    Decorator to restrict access to admin routes only.
-    """
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if request.user.get('role') != 'admin':
-            return jsonify({"error": "Unauthorized"}), 403
-        return f(*args, **kwargs)
-    return decorated_function
+# Decorators (errors are reported under "error" on this blueprint)
+token_required = auth.token_guard("error")
+admin_required = auth.role_guard("admin", "error")
 
 
 # Routes
@@ -60,17 +32,11 @@ def login():
     username = data["username"]
     password = data["password"]
     user = User.query.filter_by(username=username).first()
-    SECRET_KEY = current_app.config["SECRET_KEY"]
     if user and user.check_password(password):
-        token = jwt.encode({
-            'user_id': user.user_id,
-            'username': user.username,
-            'role': user.role,
-            'exp': datetime.utcnow() + timedelta(hours=1)
-        }, SECRET_KEY, algorithm='HS256')
-
-        user.login_date = datetime.utcnow()
-        db.session.commit()
+        token = auth.issue_token(user)
+
+        login_dates.record_login(user.user_id)
+        db.session.commit()  # Saves the password if check_password rehashed it
 
         return jsonify({"token": token, "role": user.role}), 200
 
@@ -109,24 +75,23 @@ def register():
 @cross_origin()
 @token_required
 @admin_required
-@cache.cached(key_prefix='dashboard_data')
 def dashboard_data():
     try:
+        stats = helper.get_platform_stats()
         data = {
-            "total_users": User.query.count(),
-            "total_sponsors": Sponsor.query.count(),
-            "total_campaigns_public": Campaign.query.filter_by(visibility="public").count(),
-            "total_campaigns_private": Campaign.query.filter_by(visibility="private").count(),
-            "total_ad_requests_pending": AdRequest.query.filter_by(status="pending").count(),
-            "total_ad_requests_rejected": AdRequest.query.filter_by(status="rejected").count(),
-            "total_ad_requests_negotiation": AdRequest.query.filter_by(status="negotiation").count(),
-            "total_ad_requests_accepted": AdRequest.query.filter_by(status="accepted").count(),
-            "total_influencers": Influencer.query.count(),
-            "flagged_users": UserFlag.query.count(),
-            "flagged_campaigns": CampaignFlag.query.count(),
-            "pending_sponsors": Sponsor.query.filter_by(is_approved=False).count()  # Count pending sponsors
+            "total_users": stats["total_users"],
+            "total_sponsors": stats["total_sponsors"],
+            "total_campaigns_public": stats["campaigns_public"],
+            "total_campaigns_private": stats["campaigns_private"],
+            "total_ad_requests_pending": stats["ad_requests_pending"],
+            "total_ad_requests_rejected": stats["ad_requests_rejected"],
+            "total_ad_requests_negotiation": stats["ad_requests_negotiation"],
+            "total_ad_requests_accepted": stats["ad_requests_accepted"],
+            "total_influencers": stats["total_influencers"],
+            "flagged_users": stats["flagged_users"],
+            "flagged_campaigns": stats["flagged_campaigns"],
+            "pending_sponsors": stats["pending_sponsors"]  # Count pending sponsors
         }
-        # print(data)
         return jsonify(data)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -138,27 +103,41 @@ def dashboard_data():
 @admin_required
 def dashboard_graph_data():
     """
-    Fetch graph data for admin dashboard.
+    Fetch graph data for admin dashboard. With ?from= and/or ?to=
+    (YYYY-MM-DD) the data also holds "daily" series read from the rollups
+    (rollups.py), for the platform or for ?sponsor_id=.
     """
     try:
+        daily = None
+        if request.args.get("from") or request.args.get("to"):
+            start, end = rollups.date_range(request.args)
+            sponsor_id = request.args.get("sponsor_id", rollups.PLATFORM, type=int)
+            daily = {"from": start.isoformat(), "to": end.isoformat(), "sponsor_id": sponsor_id,
+                     **rollups.series(start, end, sponsor_id)}
+
+        stats = helper.get_platform_stats()
         graph_data = {
             "campaign_visibility": {
-                "public": Campaign.query.filter_by(visibility="public").count(),
-                "private": Campaign.query.filter_by(visibility="private").count()
+                "public": stats["campaigns_public"],
+                "private": stats["campaigns_private"]
             },
             "ad_request_statuses": {
-                "pending": AdRequest.query.filter_by(status="pending").count(),
-                "rejected": AdRequest.query.filter_by(status="rejected").count(),
-                "negotiation": AdRequest.query.filter_by(status="negotiation").count(),
-                "accepted": AdRequest.query.filter_by(status="accepted").count()
+                "pending": stats["ad_requests_pending"],
+                "rejected": stats["ad_requests_rejected"],
+                "negotiation": stats["ad_requests_negotiation"],
+                "accepted": stats["ad_requests_accepted"]
             },
             "user_roles": {
-                "admins": User.query.filter_by(role="admin").count(),
-                "sponsors": User.query.filter_by(role="sponsor").count(),
-                "influencers": User.query.filter_by(role="influencer").count()
+                "admins": stats["admins"],
+                "sponsors": stats["sponsors"],
+                "influencers": stats["influencers"]
             }
         }
+        if daily is not None:
+            graph_data["daily"] = daily
         return jsonify({"data": graph_data}), 200
+    except rollups.RangeError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"Error fetching graph data: {str(e)}"}), 500
 
@@ -166,7 +145,7 @@ def dashboard_graph_data():
 @admin.route("/pending_sponsors", methods=["GET"])
 @token_required
 @admin_required
-@cache.cached()
+@cache.cached(key_prefix=principal_cache_key('pending_sponsors', per_principal=False, tags=['sponsors']))
 def pending_sponsors():
     try:
         sponsors = Sponsor.query.filter_by(is_approved=False).all()
@@ -185,8 +164,6 @@ def approve_sponsor(sponsor_id):
             return jsonify({"message": "Sponsor not found"}), 404
         sponsor.is_approved = True
         db.session.commit()
-
-        cache.delete('dashboard_data')
         return jsonify({"message": "Sponsor approved successfully"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -216,11 +193,13 @@ def reject_sponsor(sponsor_id):
 @admin_required
 def user_flags():
     """
-    Get all flagged users.
+    Get one page of flagged users.
     """
     try:
-        flags = UserFlag.query.all()
-        return jsonify([flag.to_dict() for flag in flags]), 200
+        flags, next_cursor = keyset_page(UserFlag.query, UserFlag.flag_id)
+        return with_next_cursor(jsonify([flag.to_dict() for flag in flags]), next_cursor), 200
+    except InvalidCursor as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"Error fetching user flags: {str(e)}"}), 500
 
@@ -230,10 +209,61 @@ def user_flags():
 @admin_required
 def campaign_flags():
     """
-    Get all flagged campaigns.
+    Get one page of flagged campaigns.
     """
     try:
-        flags = CampaignFlag.query.all()
-        return jsonify([flag.to_dict() for flag in flags]), 200
+        flags, next_cursor = keyset_page(CampaignFlag.query, CampaignFlag.flag_id)
+        return with_next_cursor(jsonify([flag.to_dict() for flag in flags]), next_cursor), 200
+    except InvalidCursor as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"Error fetching campaign flags: {str(e)}"}), 500
+
+
+@admin.route("/cache_stats", methods=["GET"])
+@token_required
+@admin_required
+def swr_cache_stats():
+    """
+    Hit/miss/refresh counters of the stale-while-revalidate cached endpoints.
+    """
+    try:
+        return jsonify(cache_stats()), 200
+    except Exception as e:
+        return jsonify({"error": f"Error fetching cache stats: {str(e)}"}), 500
+
+
+@admin.route("/mail_stats", methods=["GET"])
+@token_required
+@admin_required
+def bulk_mail_stats():
+    """
+    Sent/failed/retried totals, failure rate and last-batch throughput of the bulk mailer.
+    """
+    try:
+        return jsonify(mail_stats()), 200
+    except Exception as e:
+        return jsonify({"error": f"Error fetching mail stats: {str(e)}"}), 500
+
+
+@admin.route("/changes", methods=["GET"])
+@token_required
+@admin_required
+def change_log():
+    """
+    One batch of the change log (changelog.py) after ?after=<seq>, oldest
+    first, optionally only ?table=<name>. Pass next_after back as ?after= to
+    continue; it moves past filtered-out changes too.
+    """
+    try:
+        after = request.args.get("after", 0, type=int)
+        table = request.args.get("table")
+        batch = changelog.read(after, page_size())
+        changes = [change._asdict() for change in batch if table is None or change.table == table]
+        return jsonify({
+            "changes": changes,
+            "next_after": batch[-1].seq if batch else after,
+            "latest_seq": changelog.latest_seq(),
+        }), 200
+    except Exception as e:
+        return jsonify({"error": f"Error fetching changes: {str(e)}"}), 500
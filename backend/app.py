@@ -5,6 +5,12 @@ from flask_jwt_extended import JWTManager
 from celery import Celery
 from flask_mail import Mail
 from config import cache, AppConfig
+from caching import principal_cache_key, swr_cached
+from pagination import keyset_page, with_next_cursor, InvalidCursor
+from projections import Projection, FieldsError
+from passwords import PasswordPoolBusy
+from serializers import FastJSONProvider
+from search import search, SearchError
 from redis import Redis
 import random
 from flask_cors import cross_origin
@@ -12,6 +18,7 @@ from flask_cors import cross_origin
 # Initialize Flask app instance
 application = Flask(__name__)
 application.config.from_object(AppConfig)
+application.json = FastJSONProvider(application)  # orjson-backed jsonify (serializers.py)
 
 # Flask-Mail configuration
 application.config['MAIL_SERVER'] = 'smtp://localhost:1025'  # Mailhog SMTP server
@@ -51,13 +58,18 @@ cache.init_app(application)  # Set up caching
 # Configure third-party libraries
 jwt_manager = JWTManager(application)  # Enable JWT for secure authentication
 mail_service = Mail(application)       # Configure email notifications
-CORS(application, resources={r"/*": {"origins": "*"}})  # Allow cross-origin requests
+CORS(application, resources={r"/*": {"origins": "*"}}, expose_headers=["X-Next-Cursor", "Link"])  # Allow cross-origin requests
 
 # Register route blueprints for better organization
 application.register_blueprint(admin, url_prefix="/admin")
 application.register_blueprint(sponsor, url_prefix="/sponsor")
 application.register_blueprint(influencer, url_prefix="/influencer")
 
+# Login/registration bursts beyond the password hashing queue (passwords.py)
+@application.errorhandler(PasswordPoolBusy)
+def password_pool_busy(error):
+    return jsonify({"message": str(error)}), 503
+
 # Set up Redis for caching purposes
 redis_connection = Redis(host='localhost', port=6379, db=1)
 try:
@@ -78,56 +90,73 @@ def welcome():
 @application.route("/signout", methods=["POST", "GET"])
 def signout():
     """
-    Signs the user out by clearing authentication cookies and cache.
+    Signs the user out by clearing the authentication cookie.
+    Cached views are keyed per principal and invalidated by tag on commit,
+    so there is nothing to flush here.
     """
     response = make_response(redirect(url_for("welcome")))
 
     response.set_cookie('auth_token', '', expires=0, path="/")  # Remove the auth cookie
 
-    # Clear Redis cache if active
-    if application.config.get('CACHE_TYPE') == 'redis':
-        cache_prefix = application.config.get('CACHE_KEY_PREFIX', '')
-        for key in redis_connection.scan_iter(f"{cache_prefix}*"):
-            redis_connection.delete(key)
-
     flash("Successfully signed out", "info")
     return response
 
+# Columns returned by the read-only list endpoints; ?fields=a,b narrows them
+# (see projections.py). The defaults leave out password hashes and the large
+# Text columns that the list views do not render.
+ALL_USERS_FIELDS = Projection(User, hidden=["password"], required=["role"])
+# List defaults leave out the free-text columns (descriptions, goals,
+# requirements); views that show them ask for them with ?fields=
+CREATORS_FIELDS = Projection(Influencer, default=["influencer_id", "name", "category", "niche", "reach"])
+CAMPAIGNS_LIST_FIELDS = Projection(
+    Campaign, default=["campaign_id", "sponsor_id", "name", "start_date", "end_date", "budget", "visibility", "niche"]
+)
+AVAILABLE_CAMPAIGNS_FIELDS = Projection(
+    Campaign, default=["campaign_id", "sponsor_id", "name", "start_date", "end_date", "budget", "visibility", "niche"]
+)
+ADVERT_REQUESTS_FIELDS = Projection(
+    AdRequest, default=["ad_request_id", "campaign_id", "influencer_id", "payment_amount", "status"]
+)
+
 # API endpoint for retrieving all users
 @application.route("/api/all-users", methods=["GET"])
-@cache.cached()
+@swr_cached(principal_cache_key('all_users', per_principal=False, tags=['users']))
 @cross_origin()
 def get_all_user():
-    data = dict()
+    try:
+        fields = ALL_USERS_FIELDS.fields()
+        users, next_cursor = keyset_page(ALL_USERS_FIELDS.select(fields), User.user_id)
+    except (InvalidCursor, FieldsError) as ex:
+        return jsonify({"error": str(ex), "success": False}), 400
 
-    data["admin"] = [
-        user.to_dict() for user in User.query.filter_by(role="admin").all()
-    ]
-    data["sponsor"] = [
-        user.to_dict() for user in User.query.filter_by(role="sponsor").all()
-    ]
-    data["influencer"] = [
-        user.to_dict() for user in User.query.filter_by(role="influencer").all()
-    ]
+    # One page of users, grouped by role
+    serialize = ALL_USERS_FIELDS.serializer(fields)
+    data = {"admin": [], "sponsor": [], "influencer": []}
+    for user in users:
+        data[user.role].append(serialize(user))
 
-    return data
+    return with_next_cursor(jsonify(data), next_cursor)
 
 # API endpoint for fetching all influencers
 @application.route("/api/creators", methods=["GET"])
-@cache.cached()
+@swr_cached(principal_cache_key('creators', per_principal=False, tags=['influencers']))
 def fetch_influencers():
     """
-    Retrieves all influencers from the database.
+    Retrieves one page of influencers from the database.
     """
     try:
-        creators = Influencer.query.all()
-        return jsonify([creator.to_dict() for creator in creators])
+        fields = CREATORS_FIELDS.fields()
+        creators, next_cursor = keyset_page(CREATORS_FIELDS.select(fields), Influencer.influencer_id)
+        serialize = CREATORS_FIELDS.serializer(fields)
+        return with_next_cursor(jsonify([serialize(creator) for creator in creators]), next_cursor)
+    except (InvalidCursor, FieldsError) as ex:
+        return jsonify({"error": str(ex), "success": False}), 400
     except Exception as ex:
         return jsonify({"error": str(ex), "success": False}), 500
 
 # Endpoint to fetch a specific influencer by ID
 @application.route("/api/creator/<int:creator_id>", methods=["GET"])
-@cache.cached()
+@cache.cached(key_prefix=principal_cache_key('creator', per_principal=False, tags=['influencer_id:{creator_id}']))
 def fetch_creator_by_id(creator_id):
     """
     Retrieves details of a specific influencer using their unique ID.
@@ -142,26 +171,30 @@ def fetch_creator_by_id(creator_id):
 
 # API for retrieving campaigns
 @application.route("/api/campaigns-list", methods=["GET"])
-@cache.cached()
+@swr_cached(principal_cache_key('campaigns_list', per_principal=False, tags=['campaigns']))
 @cross_origin()
 def list_campaigns():
     """
-    Retrieves all campaigns with necessary details.
+    Retrieves one page of campaigns with necessary details.
     """
     try:
-        campaigns = Campaign.query.all()
+        fields = CAMPAIGNS_LIST_FIELDS.fields()
+        campaigns, next_cursor = keyset_page(CAMPAIGNS_LIST_FIELDS.select(fields), Campaign.campaign_id)
         if not campaigns:
             return jsonify({"message": "No campaigns found", "success": False}), 404
-        return jsonify({
+        serialize = CAMPAIGNS_LIST_FIELDS.serializer(fields)
+        return with_next_cursor(jsonify({
             "success": True,
-            "campaigns": [campaign.to_dict() for campaign in campaigns]
-        })
+            "campaigns": [serialize(campaign) for campaign in campaigns]
+        }), next_cursor)
+    except (InvalidCursor, FieldsError) as ex:
+        return jsonify({"error": str(ex), "success": False}), 400
     except Exception as ex:
         return jsonify({"error": str(ex), "success": False}), 500
 
 # Fetch details of a specific campaign by ID
 @application.route("/api/campaign-detail/<int:campaign_id>", methods=["GET"])
-@cache.cached()
+@cache.cached(key_prefix=principal_cache_key('campaign_detail', per_principal=False, tags=['campaign_id:{campaign_id}']))
 def campaign_details(campaign_id):
     """
     Retrieves information about a specific campaign by its ID.
@@ -176,30 +209,58 @@ def campaign_details(campaign_id):
 
 # Endpoint for public campaigns
 @application.route("/api/available-campaigns", methods=["GET"])
-@cache.cached()
+@swr_cached(principal_cache_key('available_campaigns', per_principal=False, tags=['campaigns']))
 def public_campaigns():
     """
-    Lists all publicly visible campaigns.
+    Lists one page of publicly visible campaigns.
     """
-    public_campaigns = db.session.query(Campaign).filter(Campaign.visibility == "public").all()
-    return jsonify([campaign.to_dict() for campaign in public_campaigns])
+    try:
+        fields = AVAILABLE_CAMPAIGNS_FIELDS.fields()
+        public_campaigns, next_cursor = keyset_page(
+            AVAILABLE_CAMPAIGNS_FIELDS.select(fields).where(Campaign.visibility == "public"), Campaign.campaign_id
+        )
+    except (InvalidCursor, FieldsError) as ex:
+        return jsonify({"error": str(ex), "success": False}), 400
+    serialize = AVAILABLE_CAMPAIGNS_FIELDS.serializer(fields)
+    return with_next_cursor(jsonify([serialize(campaign) for campaign in public_campaigns]), next_cursor)
+
+# Full-text search over campaigns or influencers (search.py)
+@application.route("/api/search", methods=["GET"])
+@swr_cached(principal_cache_key('search', per_principal=False, tags=['campaigns', 'influencers']))
+def search_listings():
+    """
+    Ranked search: ?type=campaigns|influencers&q=words, filtered by niche
+    and budget/reach range, one page at a time. Only public campaigns are
+    searched.
+    """
+    try:
+        results, next_cursor = search()
+        return with_next_cursor(jsonify(results), next_cursor)
+    except (InvalidCursor, SearchError) as ex:
+        return jsonify({"error": str(ex), "success": False}), 400
+    except Exception as ex:
+        return jsonify({"error": str(ex), "success": False}), 500
 
 # API for retrieving all ad requests
 @application.route("/api/advert-requests", methods=["GET"])
-@cache.cached()
+@swr_cached(principal_cache_key('advert_requests', per_principal=False, tags=['ad_requests']))
 def fetch_ad_requests():
     """
-    Retrieves all ad requests made in the system.
+    Retrieves one page of the ad requests made in the system.
     """
     try:
-        ad_requests = AdRequest.query.all()
-        return jsonify([ad_request.to_dict() for ad_request in ad_requests])
+        fields = ADVERT_REQUESTS_FIELDS.fields()
+        ad_requests, next_cursor = keyset_page(ADVERT_REQUESTS_FIELDS.select(fields), AdRequest.ad_request_id)
+        serialize = ADVERT_REQUESTS_FIELDS.serializer(fields)
+        return with_next_cursor(jsonify([serialize(ad_request) for ad_request in ad_requests]), next_cursor)
+    except (InvalidCursor, FieldsError) as ex:
+        return jsonify({"error": str(ex), "success": False}), 400
     except Exception as ex:
         return jsonify({"error": str(ex), "success": False}), 500
 
 # Fetch specific ad request by ID
 @application.route("/api/advert-request/<int:request_id>", methods=["GET"])
-@cache.cached(key_prefix='advert_request_data')
+@cache.cached(key_prefix=principal_cache_key('advert_request_data', per_principal=False, tags=['ad_request_id:{request_id}']))
 def ad_request_by_id(request_id):
     """
     Retrieves the details of a specific ad request by ID.
@@ -0,0 +1,206 @@
+# auth.py
+# JWT issuing and verification shared by every blueprint.
+#
+# Tokens are signed with the app's SECRET_KEY. Verifying the HMAC on every
+# request is wasted work for clients that poll the dashboards, so each process
+# keeps a bounded LRU of tokens it has already verified, keyed by a hash of the
+# token. A cached token is still rejected once its `exp` has passed.
+#
+# Sponsor and influencer tokens also carry the role's profile id (sponsor_id /
+# influencer_id), so the role guards can hand routes a resolved Principal
+# (request.principal) without looking the profile up by user_id. Tokens issued
+# without the claim fall back to a short-lived cached lookup.
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from functools import wraps
+
+import jwt
+from flask import current_app, jsonify, request
+
+from config import cache
+from models import db, Sponsor, Influencer
+
+ALGORITHM = "HS256"
+
+
+class VerifiedTokenCache:
+    """
+    A thread-safe LRU of {token hash: claims} holding at most `size` entries.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            claims = self._entries.get(key)
+            if claims is not None:
+                self._entries.move_to_end(key)
+            return claims
+
+    def put(self, key, claims):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = claims
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_verified = None
+
+
+def verified_tokens():
+    global _verified
+    if _verified is None:
+        _verified = VerifiedTokenCache(current_app.config["AUTH_TOKEN_CACHE_SIZE"])
+    return _verified
+
+
+def _token_hash(secret, token):
+    # Include the secret so rotating it invalidates every cached token
+    return hashlib.sha256(f"{secret}.{token}".encode("utf-8")).digest()
+
+
+# role -> (profile model, id claim) for roles that have a profile row
+PROFILE_MODELS = {
+    "sponsor": (Sponsor, "sponsor_id"),
+    "influencer": (Influencer, "influencer_id"),
+}
+
+Principal = namedtuple("Principal", "user_id username role sponsor_id influencer_id")
+
+
+def profile_id(role, user_id):
+    """
+    The sponsor_id/influencer_id of `user_id`, cached for
+    PRINCIPAL_CACHE_TIMEOUT seconds. None if the user has no profile (not
+    cached, so a profile created afterwards is found).
+    """
+    model, id_claim = PROFILE_MODELS[role]
+    key = f"principal:{role}:{user_id}"
+    value = cache.get(key)
+    if value is None:
+        value = db.session.query(getattr(model, id_claim)).filter(model.user_id == user_id).scalar()
+        if value is not None:
+            cache.set(key, value, timeout=current_app.config["PRINCIPAL_CACHE_TIMEOUT"])
+    return value
+
+
+def resolve_principal(claims):
+    ids = {"sponsor_id": None, "influencer_id": None}
+    role = claims.get("role")
+    if role in PROFILE_MODELS:
+        id_claim = PROFILE_MODELS[role][1]
+        ids[id_claim] = claims.get(id_claim)
+        if ids[id_claim] is None:
+            ids[id_claim] = profile_id(role, claims.get("user_id"))
+    return Principal(claims.get("user_id"), claims.get("username"), role, **ids)
+
+
+def current_principal():
+    """
+    The request's Principal, resolved once per request from request.user.
+    """
+    principal = getattr(request, "principal", None)
+    if principal is None:
+        principal = request.principal = resolve_principal(request.user)
+    return principal
+
+
+def issue_token(user, **claims):
+    """
+    Sign a token for `user`; extra `claims` are added to the payload.
+    """
+    payload = {
+        "user_id": user.user_id,
+        "username": user.username,
+        "role": user.role,
+        "exp": datetime.utcnow() + current_app.config["JWT_EXPIRATION"],
+        **claims,
+    }
+    return jwt.encode(payload, current_app.config["SECRET_KEY"], algorithm=ALGORITHM)
+
+
+def decode_token(token):
+    """
+    Return the claims of `token`, raising jwt.ExpiredSignatureError or
+    jwt.InvalidTokenError like jwt.decode does.
+    """
+    secret = current_app.config["SECRET_KEY"]
+    key = _token_hash(secret, token)
+    cache = verified_tokens()
+    claims = cache.get(key)
+    if claims is None:
+        claims = jwt.decode(token, secret, algorithms=[ALGORITHM])
+        cache.put(key, claims)
+    elif "exp" in claims and claims["exp"] <= time.time():
+        cache.discard(key)
+        raise jwt.ExpiredSignatureError("Signature has expired")
+    return claims
+
+
+def token_guard(error_key="message", query_token=False):
+    """
+    Build a decorator that requires a valid "Bearer <token>" Authorization
+    header and stores its claims on request.user. Errors are reported under
+    `error_key` so each blueprint keeps its response shape. With
+    `query_token`, ?token=<token> is accepted too (EventSource cannot send
+    headers).
+    """
+    def token_required(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            token = request.headers.get('Authorization')
+            if not token and query_token and request.args.get('token'):
+                token = f"Bearer {request.args['token']}"
+            if not token:
+                return jsonify({error_key: "Token is missing!"}), 403
+            try:
+                request.user = decode_token(token.split(" ")[1])  # Get token from "Bearer <token>"
+            except IndexError:
+                return jsonify({error_key: "Invalid token!"}), 403
+            except jwt.ExpiredSignatureError:
+                return jsonify({error_key: "Token has expired!"}), 403
+            except jwt.InvalidTokenError:
+                return jsonify({error_key: "Invalid token!"}), 403
+            return f(*args, **kwargs)
+        return decorated_function
+    return token_required
+
+
+def role_guard(role, error_key="message"):
+    """
+    Build a decorator that only lets principals with `role` through and sets
+    request.principal. Roles with a profile must have one (404 otherwise).
+    Must be applied below a token_guard decorator.
+    """
+    def role_required(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.user.get('role') != role:
+                return jsonify({error_key: "Unauthorized"}), 403
+            principal = current_principal()
+            if role in PROFILE_MODELS and getattr(principal, PROFILE_MODELS[role][1]) is None:
+                return jsonify({error_key: f"{role.capitalize()} not found"}), 404
+            return f(*args, **kwargs)
+        return decorated_function
+    return role_required
+
+
+token_required = token_guard()
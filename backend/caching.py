@@ -0,0 +1,384 @@
+# caching.py
+# Cache keys and tag-based invalidation for cached views.
+#
+# A fixed key_prefix shares one cache entry between every caller, so views
+# whose response depends on the authenticated user or on route arguments must
+# build their key from those instead.
+#
+# Invalidation is tag based. A cached view declares the tags it depends on,
+# e.g. "campaigns" (any campaign) or "sponsor_id:4" (rows owned by sponsor 4).
+# Every tag has a version counter in the cache and the current versions are
+# part of the cache key. When a transaction commits, the tags of every row it
+# inserted, updated or deleted are bumped in one pipelined call, so the next
+# read misses and the stale entries simply expire.
+#
+# Hot public endpoints use swr_cached instead of cache.cached: entries are kept
+# past their expiry and served stale while exactly one worker, holding a lock,
+# recomputes them. Refreshes start early with a probability that grows as the
+# expiry approaches (XFetch), so an entry rarely expires under load at all.
+# Their key leaves the tag versions out and the entry records them instead: a
+# bumped tag makes the entry stale rather than unreachable, so a write does
+# not send every worker down the cold-miss path at once.
+
+import logging
+import math
+import random
+import secrets
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import Response, current_app, make_response, request
+from redis.exceptions import WatchError
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from config import cache
+
+logger = logging.getLogger(__name__)
+
+# For each table, the columns whose values become "<column>:<value>" tags when
+# a row changes, in addition to the table-wide tag (the table name).
+ENTITY_TAG_COLUMNS = {
+    "users": ("user_id",),
+    "sponsors": ("sponsor_id", "user_id"),
+    "influencers": ("influencer_id", "user_id"),
+    "campaigns": ("campaign_id", "sponsor_id"),
+    "ad_requests": ("ad_request_id", "campaign_id", "influencer_id"),
+    "negotiations": ("ad_request_id", "influencer_id"),
+    "user_flags": ("user_id",),
+    "campaign_flags": ("campaign_id",),
+}
+
+
+def tag_version_key(tag):
+    return f"tag:{tag}"
+
+
+def tag_versions(tags):
+    """
+    Return the current version of each tag, in order. Unknown tags are 0.
+    """
+    if not tags:
+        return []
+    return [version or 0 for version in cache.get_many(*[tag_version_key(tag) for tag in tags])]
+
+
+def tagged_key(key, tags):
+    """
+    Suffix `key` with the current versions of `tags`, so that bumping any of
+    them makes the previously stored entry unreachable.
+    """
+    tags = sorted(set(tags))
+    if not tags:
+        return key
+    return f"{key}#" + ".".join(str(version) for version in tag_versions(tags))
+
+
+def invalidate_tags(tags):
+    """
+    Bump the version of every tag in one pipelined Redis call (one cache call
+    per tag on backends without pipelines).
+    """
+    tags = sorted(set(tags))
+    if not tags:
+        return
+    try:
+        backend = cache.cache
+        client = getattr(backend, "_write_client", None)
+        if client is not None:
+            pipe = client.pipeline(transaction=False)
+            for tag in tags:
+                pipe.incr(backend.key_prefix + tag_version_key(tag))
+            pipe.execute()
+        else:
+            for tag in tags:
+                backend.inc(tag_version_key(tag))
+    except Exception:
+        # A failed bump must never fail the request whose data already committed
+        logger.exception("Cache tag invalidation failed for %s", tags)
+
+
+def entity_tags(obj):
+    """
+    Tags describing one ORM object, including the previous values of any
+    tagged column that changed in this flush (e.g. an ad request moved to
+    another influencer invalidates both influencers).
+    """
+    state = inspect(obj)
+    table = state.mapper.local_table.name
+    tags = {table}
+    for column in ENTITY_TAG_COLUMNS.get(table, ()):
+        history = state.attrs[column].history
+        for value in (*history.sum(), state.dict.get(column)):
+            if value is not None:
+                tags.add(f"{column}:{value}")
+    return tags
+
+
+def mark_changed(session, tags):
+    """
+    Record extra tags to invalidate when `session` commits. Use this for
+    writes that bypass the unit of work, e.g. bulk query.update() calls.
+    """
+    session.info.setdefault("cache_tags", set()).update(tags)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_cache_tags(session, flush_context):
+    tags = set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        tags |= entity_tags(obj)
+    if tags:
+        mark_changed(session, tags)
+
+
+_commit_listeners = []
+
+
+def on_commit(listener):
+    """
+    Call listener(tags) with the tags of every committed transaction, for
+    in-process state derived from the database (e.g. matching.py's arrays).
+    Usable as a decorator.
+    """
+    _commit_listeners.append(listener)
+    return listener
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_cache_tags(session):
+    tags = session.info.pop("cache_tags", ())
+    invalidate_tags(tags)
+    for listener in _commit_listeners:
+        try:
+            listener(tags)
+        except Exception:
+            logger.exception("Commit listener %r failed", listener)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_cache_tags(session):
+    session.info.pop("cache_tags", None)
+
+
+def principal_key(prefix, role=None, user_id=None, view_args=None, query_args=None):
+    """
+    Build the cache key for one principal's view of `prefix`.
+    """
+    parts = [prefix]
+    if role is not None or user_id is not None:
+        parts.append(f"{role}:{user_id}")
+    if view_args:
+        parts.append(",".join(f"{name}={view_args[name]}" for name in sorted(view_args)))
+    key = ":".join(parts)
+    if query_args:
+        key += "?" + urlencode(sorted(query_args))
+    return key
+
+
+def principal_cache_key(prefix, per_principal=True, tags=()):
+    """
+    Return a key_prefix callable for @cache.cached that keys the entry on the
+    authenticated principal (request.user, set by token_required), the route
+    arguments, the query string and the versions of the view's tags. Must be
+    applied below token_required.
+
+    `tags` is a list of tag templates formatted with the route arguments, the
+    principal's claims and, below a role guard, the resolved principal (e.g.
+    "sponsor_id:{sponsor_id}"), or a callable returning the list of tags.
+
+    The callable's key_and_tags() returns the key without the versions and
+    the view's tags, for swr_cached.
+    """
+    def key_and_tags():
+        user = (getattr(request, "user", None) or {}) if per_principal else {}
+        key = principal_key(
+            prefix,
+            role=user.get("role"),
+            user_id=user.get("user_id"),
+            view_args=request.view_args,
+            query_args=list(request.args.items(multi=True)),
+        )
+        if callable(tags):
+            view_tags = tags()
+        else:
+            fields = {**user, **(request.view_args or {})}
+            principal = getattr(request, "principal", None) if per_principal else None
+            if principal is not None:
+                fields.update(principal._asdict())
+            view_tags = [tag.format(**fields) for tag in tags]
+        return key, view_tags
+
+    def make_key():
+        return tagged_key(*key_and_tags())
+
+    make_key.key_and_tags = key_and_tags
+    return make_key
+
+
+# Events counted per endpoint by swr_cached
+SWR_EVENTS = ("hit", "stale", "miss", "refresh", "wait")
+_swr_endpoints = set()
+
+
+def _stats_key(name, event_name):
+    return f"cache_stats:{name}:{event_name}"
+
+
+def record_cache_event(name, event_name):
+    try:
+        cache.cache.inc(_stats_key(name, event_name))
+    except Exception:
+        logger.exception("Could not record cache %s for %s", event_name, name)
+
+
+def cache_stats():
+    """
+    Return {endpoint: {event: count}} for every swr_cached endpoint,
+    aggregated across workers.
+    """
+    names = sorted(_swr_endpoints)
+    keys = [_stats_key(name, event_name) for name in names for event_name in SWR_EVENTS]
+    counts = iter(cache.get_many(*keys) if keys else [])
+    return {
+        name: {event_name: next(counts) or 0 for event_name in SWR_EVENTS}
+        for name in names
+    }
+
+
+def _store_response(key, response, versions, delta, timeout, stale_timeout):
+    entry = {
+        "data": response.get_data(),
+        "status": response.status_code,
+        # Keeps the pagination headers (X-Next-Cursor / Link) with the page
+        "headers": [(name, value) for name, value in response.headers if name != "Content-Length"],
+        "versions": versions,  # of the view's tags when the response was computed
+        "delta": delta,
+        "expires": time.time() + timeout,
+    }
+    cache.set(key, entry, timeout=timeout + stale_timeout)
+    return entry
+
+
+def _restore_response(entry):
+    return Response(entry["data"], status=entry["status"], headers=entry["headers"])
+
+
+def acquire_lock(key, timeout):
+    """
+    Take lock `key` for at most `timeout` seconds. Returns the token that
+    owns it, or None if another worker holds it.
+    """
+    token = secrets.token_hex(16)
+    backend = cache.cache
+    client = getattr(backend, "_write_client", None)
+    if client is not None:
+        acquired = client.set(backend.key_prefix + key, token, nx=True, ex=timeout)
+    else:
+        acquired = cache.add(key, token, timeout=timeout)
+    return token if acquired else None
+
+
+def release_lock(key, token):
+    """
+    Release lock `key` if `token` still owns it. A lock that expired while
+    its holder was still working may have been taken by another worker since,
+    and must be left alone.
+    """
+    try:
+        backend = cache.cache
+        client = getattr(backend, "_write_client", None)
+        if client is None:
+            # Single-process backends: nothing can run between the get and the delete
+            if cache.get(key) == token:
+                cache.delete(key)
+            return
+        # Compare-and-delete in a WATCH/MULTI transaction, so the lock cannot
+        # change hands between the comparison and the delete
+        with client.pipeline() as pipe:
+            pipe.watch(backend.key_prefix + key)
+            if pipe.get(backend.key_prefix + key) == token.encode():
+                pipe.multi()
+                pipe.delete(backend.key_prefix + key)
+                pipe.execute()
+    except WatchError:
+        pass  # Changed hands meanwhile, so it is not ours any more
+    except Exception:
+        # The lock expires by itself; failing to release it must not fail the request
+        logger.exception("Could not release cache lock %s", key)
+
+
+def swr_cached(key_prefix, timeout=None, stale_timeout=None, beta=1.0, lock_timeout=30, wait_timeout=2.0):
+    """
+    Cache a view with stampede protection and stale-while-revalidate.
+
+    `key_prefix` is a cache key, a callable returning one, or the result of
+    principal_cache_key, whose tags are then checked on every read: an entry
+    computed before a tag was bumped counts as expired. Entries are fresh for
+    `timeout` seconds and may be served stale for another `stale_timeout`
+    seconds while one worker refreshes them. `beta` > 1 favours earlier
+    refreshes. On a cold miss, workers that lose the lock wait up to
+    `wait_timeout` seconds for the winner's result before computing it
+    themselves. Only 200 responses are cached.
+    """
+    def decorator(f):
+        name = f.__name__
+        _swr_endpoints.add(name)
+
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if hasattr(key_prefix, "key_and_tags"):
+                key, tags = key_prefix.key_and_tags()
+            else:
+                key, tags = (key_prefix() if callable(key_prefix) else key_prefix), []
+            # Read before computing, so a write committed meanwhile leaves the new entry stale
+            versions = tag_versions(sorted(set(tags)))
+            lock_key = f"lock:{key}"
+            fresh_for = timeout if timeout is not None else current_app.config["CACHE_DEFAULT_TIMEOUT"]
+            stale_for = stale_timeout if stale_timeout is not None else current_app.config["CACHE_STALE_TIMEOUT"]
+
+            def compute():
+                started = time.time()
+                response = make_response(f(*args, **kwargs))
+                if response.status_code == 200:
+                    _store_response(key, response, versions, time.time() - started, fresh_for, stale_for)
+                return response
+
+            def compute_locked(token):
+                try:
+                    return compute()
+                finally:
+                    release_lock(lock_key, token)
+
+            entry = cache.get(key)
+            if entry is not None:
+                # XFetch: -log(u) is exponentially distributed, so expensive
+                # entries (large delta) start refreshing further ahead of expiry
+                early_by = -entry["delta"] * beta * math.log(1.0 - random.random())
+                if entry["versions"] == versions and time.time() + early_by < entry["expires"]:
+                    record_cache_event(name, "hit")
+                    return _restore_response(entry)
+                token = acquire_lock(lock_key, lock_timeout)
+                if token is not None:
+                    record_cache_event(name, "refresh")
+                    return compute_locked(token)
+                record_cache_event(name, "stale")
+                return _restore_response(entry)
+
+            record_cache_event(name, "miss")
+            token = acquire_lock(lock_key, lock_timeout)
+            if token is not None:
+                return compute_locked(token)
+
+            # Another worker is computing this entry; wait for its result
+            deadline = time.time() + wait_timeout
+            while time.time() < deadline:
+                time.sleep(0.05)
+                entry = cache.get(key)
+                if entry is not None:
+                    record_cache_event(name, "wait")
+                    return _restore_response(entry)
+            return compute()
+        return decorated_function
+    return decorator
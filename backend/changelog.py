@@ -0,0 +1,123 @@
+# changelog.py
+# Append-only change log of the core tables, read in batches from a checkpoint.
+#
+# Triggers (migration 4 in migrations.py) append one change_log row for every
+# insert, update and delete on users, sponsors, influencers, campaigns,
+# ad_requests, negotiations and the flag tables, inside the transaction that
+# made the change, so a change is logged if and only if it commits. Bulk
+# UPDATEs (transitions.py, login_dates.py) are logged like ORM writes.
+#
+# seq is an AUTOINCREMENT key, so it only grows, and SQLite's single writer
+# commits changes in seq order: a consumer that has processed everything up
+# to seq N will never see a change with a smaller seq appear later. Each
+# consumer stores the last seq it processed under its name in
+# change_log_checkpoints and resumes from there:
+#
+#   def handle(changes):
+#       for change in changes:
+#           ...  # change.table, change.row_id, change.op, change.data
+#
+#   changelog.consume("report_builder", handle, tables={"ad_requests", "negotiations"})
+#
+# tasks.prune_change_log deletes entries older than CHANGE_LOG_RETENTION that
+# every consumer has processed.
+
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import text
+
+from models import db
+
+Change = namedtuple("Change", "seq table row_id op data changed_at")
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def latest_seq():
+    """
+    The seq of the newest change, 0 if the log is empty.
+    """
+    return db.session.execute(text("SELECT coalesce(max(seq), 0) FROM change_log")).scalar()
+
+
+def read(after=0, limit=DEFAULT_BATCH_SIZE):
+    """
+    Up to `limit` changes with a seq greater than `after`, oldest first.
+    """
+    rows = db.session.execute(text(
+        "SELECT seq, table_name, row_id, op, data, changed_at FROM change_log"
+        " WHERE seq > :after ORDER BY seq LIMIT :limit"
+    ), {"after": after, "limit": limit})
+    return [
+        Change(seq, table_name, row_id, op, json.loads(data), changed_at)
+        for seq, table_name, row_id, op, data, changed_at in rows
+    ]
+
+
+def checkpoint(consumer):
+    """
+    The last seq `consumer` acknowledged, 0 for a new consumer.
+    """
+    seq = db.session.execute(
+        text("SELECT seq FROM change_log_checkpoints WHERE consumer = :consumer"), {"consumer": consumer}
+    ).scalar()
+    return seq or 0
+
+
+def acknowledge(consumer, seq):
+    """
+    Record that `consumer` has processed every change up to `seq` (a
+    checkpoint never moves backwards) and commit.
+    """
+    try:
+        db.session.execute(text(
+            "INSERT INTO change_log_checkpoints (consumer, seq) VALUES (:consumer, :seq)"
+            " ON CONFLICT (consumer) DO UPDATE SET seq = max(seq, excluded.seq)"
+        ), {"consumer": consumer, "seq": seq})
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def consume(consumer, handler, batch_size=DEFAULT_BATCH_SIZE, tables=None):
+    """
+    Call handler(changes) with every change past `consumer`'s checkpoint, in
+    batches of at most `batch_size`, acknowledging each batch once the
+    handler returns; if it raises, the batch is delivered again next time.
+    With `tables`, only changes to those tables are handed over (the
+    checkpoint still moves past the others). Returns the number of changes
+    handed over. Must be called inside an application context.
+    """
+    handled = 0
+    after = checkpoint(consumer)
+    while True:
+        batch = read(after, batch_size)
+        if not batch:
+            return handled
+        changes = [change for change in batch if tables is None or change.table in tables]
+        if changes:
+            handler(changes)
+            handled += len(changes)
+        after = batch[-1].seq
+        acknowledge(consumer, after)
+
+
+def prune(retention):
+    """
+    Delete the changes older than `retention` (a timedelta) that every
+    registered consumer has acknowledged and return how many were deleted.
+    """
+    cutoff = datetime.utcnow() - retention
+    try:
+        deleted = db.session.execute(text(
+            "DELETE FROM change_log WHERE changed_at < :cutoff"
+            " AND seq <= coalesce((SELECT min(seq) FROM change_log_checkpoints), seq)"
+        ), {"cutoff": cutoff.strftime("%Y-%m-%d %H:%M:%S")}).rowcount
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return deleted
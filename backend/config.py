@@ -1,10 +1,24 @@
+import os
 from flask_caching import Cache
 from datetime import timedelta
 from celery.schedules import crontab
 
 class AppConfig:
     # Secret Key for Flask
-    SECRET_KEY = "your_secret_key_here"
+    SECRET_KEY = "your_secret_key_here"  # Also signs the JWTs issued by every blueprint's /login
+    JWT_EXPIRATION = timedelta(hours=1)
+    AUTH_TOKEN_CACHE_SIZE = 4096  # Verified tokens remembered per process (auth.py), 0 to disable
+    PRINCIPAL_CACHE_TIMEOUT = 60  # Seconds a user_id -> sponsor_id/influencer_id lookup is cached
+
+    # Password hashing (passwords.py). Hashes stored with another cost are
+    # rehashed on the next successful login.
+    BCRYPT_LOG_ROUNDS = 12
+    PASSWORD_HASH_WORKERS = max(1, (os.cpu_count() or 2) // 2)  # Concurrent hashes per process, 0 = on the request thread
+    PASSWORD_HASH_QUEUE = 32  # Logins that may wait for a worker before getting a 503
+    PASSWORD_HASH_TIMEOUT = 10  # Seconds a login waits for a queue slot
+
+    # Login timestamps are buffered (login_dates.py) and written in one batch this often
+    LOGIN_FLUSH_INTERVAL = 60
 
     # SQLAlchemy configuration for SQLite
     SQLALCHEMY_DATABASE_URI = "sqlite:///test.db"  # Update as per your database URI
@@ -15,6 +29,30 @@ class AppConfig:
     CACHE_DEFAULT_TIMEOUT = 100
     CACHE_KEY_PREFIX = 'myprefix'
     CACHE_REDIS_URL = "redis://localhost:6379/1"  # Redis server URL
+    CACHE_STALE_TIMEOUT = 300  # How long swr_cached may serve an expired entry while it is refreshed
+
+    # Keyset pagination for list endpoints (?limit= is clamped to the maximum)
+    API_PAGE_SIZE = 100
+    API_MAX_PAGE_SIZE = 500
+
+    # Analytics events are folded into the daily rollups (rollups.py) this often
+    ROLLUP_INTERVAL = 300
+
+    # Change log entries (changelog.py) older than this are pruned once every consumer has processed them
+    CHANGE_LOG_RETENTION = timedelta(days=7)
+
+    # Dashboard event streams (realtime.py)
+    SSE_HEARTBEAT = 15  # Seconds between keepalive comments on an idle stream
+    SSE_MAX_DURATION = 300  # Seconds before a stream is closed (the browser reconnects)
+
+    # Influencer recommendations (matching.py)
+    MATCHING_REBUILD_INTERVAL = 600  # Seconds between full rebuilds of each process's feature arrays
+    MATCHING_COST_PER_1000_REACH = 20.0  # Budget assumed to buy 1000 followers of reach
+
+    # Background export jobs: output files are spooled here and kept (with
+    # their job status) for EXPORT_JOB_TTL seconds
+    EXPORT_SPOOL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "exports")
+    EXPORT_JOB_TTL = 24 * 60 * 60
 
     # Flask-Mail configuration for email sending (update with real credentials)
     MAIL_SERVER = 'smtp://localhost:1025'  # Use Mailhog for testing emails
@@ -26,6 +64,13 @@ class AppConfig:
 
     MAIL_DEFAULT_SENDER = 'mankojp23@example.com'  # Default sender email address (optional)
 
+    # Bulk mail dispatcher (mailer.py) used by the Celery tasks
+    MAIL_POOL_SIZE = 4  # Persistent SMTP connections (and sending threads) per worker process
+    MAIL_RATE_LIMIT = 50  # Messages per second across all workers, 0 for no limit
+    MAIL_MAX_RETRIES = 3  # Retries for transient failures (disconnects, 4xx replies)
+    MAIL_RETRY_BACKOFF = 1.0  # Seconds before the first retry, doubled on each attempt
+    MAIL_BATCH_SIZE = 500  # Messages per send_mail_batch task
+
     # Celery configuration for background tasks
     CELERY_BROKER_URL = 'redis://localhost:6379/0'  # Redis as the message broker
     CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'  # Redis for storing task results
@@ -39,6 +84,22 @@ class AppConfig:
             'task': 'tasks.send_monthly_report',  # Task function to call
             'schedule': crontab(day_of_month=1, hour=0, minute=0),  # Run on the 1st of each month at midnight
         },
+        'purge-export-spool': {
+            'task': 'tasks.purge_export_spool',
+            'schedule': crontab(minute=30),  # Hourly
+        },
+        'flush-login-dates': {
+            'task': 'tasks.flush_login_dates',
+            'schedule': timedelta(seconds=LOGIN_FLUSH_INTERVAL),
+        },
+        'update-rollups': {
+            'task': 'tasks.update_rollups',
+            'schedule': timedelta(seconds=ROLLUP_INTERVAL),
+        },
+        'prune-change-log': {
+            'task': 'tasks.prune_change_log',
+            'schedule': crontab(minute=15, hour=4),  # Daily
+        },
     }
 
     CELERY_INCLUDE = ['tasks']  # Task module import for Celery to discover tasks
@@ -0,0 +1,60 @@
+# conftest.py
+# Fixtures for tests that need the whole app (routes, blueprints, listeners).
+#
+# app.py builds its database and cache when it is imported, so the config is
+# pointed at a temporary SQLite file and SimpleCache here, before any test
+# imports it: tests never touch instance/test.db or Redis.
+
+import os
+import tempfile
+
+import pytest
+
+import config
+
+config.AppConfig.SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+config.AppConfig.CACHE_TYPE = "SimpleCache"
+config.AppConfig.BCRYPT_LOG_ROUNDS = 4  # bcrypt's minimum; seeding and logins are hashed per test
+
+
+@pytest.fixture
+def web_app():
+    """
+    The app over a freshly migrated database with init_db's seed data
+    (admin/sponsor/influencer users, password "password"; campaign 1, ad
+    request 1 with negotiation 1) and an empty cache.
+    """
+    import migrations
+    from app import application
+    from models import db, init_db, Sponsor
+
+    with application.app_context():
+        db.session.remove()
+        db.drop_all()
+        migrations.reset()
+        db.create_all()
+        migrations.upgrade()
+        config.cache.clear()
+    init_db(application)
+    with application.app_context():
+        for sponsor in Sponsor.query.all():
+            sponsor.is_approved = True
+        db.session.commit()
+        yield application
+        db.session.remove()
+
+
+@pytest.fixture
+def client(web_app):
+    return web_app.test_client()
+
+
+@pytest.fixture
+def login(client):
+    """
+    login(blueprint, username) -> Authorization header for that user.
+    """
+    def login(blueprint, username):
+        response = client.post(f"/{blueprint}/login", json={"username": username, "password": "password"})
+        return {"Authorization": f"Bearer {response.get_json()['token']}"}
+    return login
@@ -1,6 +1,9 @@
 from app import application
 from models import db
+from migrations import reset, upgrade
 with application.app_context():
     db.drop_all()   # Drop all tables
+    reset()   # Drop the search index too and forget applied migrations
     db.create_all()   # Create all tables according to the models
+    upgrade()   # Add what the models don't describe (search index, triggers)
 print("Database tables created successfully.")
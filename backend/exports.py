@@ -0,0 +1,209 @@
+# exports.py
+# Row-streaming CSV exports.
+#
+# Rows are pulled from the database in batches (yield_per) and every batch is
+# encoded and handed to the caller as soon as it is read, so memory use is
+# bounded by the batch size rather than by the number of rows exported.
+
+import csv
+import os
+import time
+import uuid
+import zlib
+from datetime import datetime
+from io import StringIO
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from config import cache
+from models import db, Campaign
+
+EXPORT_BATCH_SIZE = 1000
+
+# Exportable campaign columns, in default order: key -> (CSV header, column)
+CAMPAIGN_EXPORT_COLUMNS = {
+    "name": ("Name", Campaign.name),
+    "description": ("Description", Campaign.description),
+    "niche": ("Niche", Campaign.niche),
+    "budget": ("Budget", Campaign.budget),
+    "start_date": ("Start Date", Campaign.start_date),
+    "end_date": ("End Date", Campaign.end_date),
+    "goals": ("Goals", Campaign.goals),
+    "visibility": ("Visibility", Campaign.visibility),
+}
+
+
+class ExportError(ValueError):
+    pass
+
+
+def parse_columns(value):
+    """
+    Parse a comma separated ?columns= value; None/empty means every column.
+    """
+    if not value:
+        return list(CAMPAIGN_EXPORT_COLUMNS)
+    columns = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in columns if name not in CAMPAIGN_EXPORT_COLUMNS]
+    if unknown:
+        raise ExportError(f"Unknown export columns: {', '.join(unknown)}")
+    return columns
+
+
+def parse_date(value, name):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise ExportError(f"{name} must be a date in YYYY-MM-DD format")
+
+
+def campaign_export_query(sponsor_id, columns, start=None, end=None):
+    """
+    Select the requested columns of a sponsor's campaigns, optionally limited
+    to campaigns starting on/after `start` and ending on/before `end`.
+    """
+    query = (
+        select(*[CAMPAIGN_EXPORT_COLUMNS[name][1] for name in columns])
+        .where(Campaign.sponsor_id == sponsor_id)
+        .order_by(Campaign.campaign_id)
+    )
+    if start:
+        query = query.where(Campaign.start_date >= start)
+    if end:
+        query = query.where(Campaign.end_date <= end)
+    return query
+
+
+def iter_csv_batches(query, headers, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Execute `query` with a streaming cursor and yield (csv_text, row_count)
+    one batch of rows at a time, starting with the header line (0 rows).
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk
+
+    writer.writerow(headers)
+    yield flush(), 0
+
+    result = db.session.execute(query.execution_options(yield_per=batch_size))
+    for rows in result.partitions():
+        writer.writerows(rows)
+        yield flush(), len(rows)
+
+
+def iter_csv(query, headers, batch_size=EXPORT_BATCH_SIZE):
+    for chunk, count in iter_csv_batches(query, headers, batch_size):
+        yield chunk
+
+
+def gzip_chunks(chunks, encoding="utf-8"):
+    """
+    Gzip a stream of text chunks on the fly. Each chunk is sync-flushed so
+    the client receives it immediately instead of when zlib's window fills.
+    """
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    for chunk in chunks:
+        yield compressor.compress(chunk.encode(encoding)) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+# Export jobs
+#
+# Large exports run in a Celery task (tasks.export_campaign_data). The job's
+# state lives in the cache under export_job:<id> and its output is written
+# batch by batch to <EXPORT_SPOOL_DIR>/<id>.csv.part, renamed to <id>.csv
+# once complete so a download never sees a partial file.
+
+def _job_key(job_id):
+    return f"export_job:{job_id}"
+
+
+def job_file(job_id):
+    return os.path.join(current_app.config["EXPORT_SPOOL_DIR"], f"{job_id}.csv")
+
+
+def create_job(sponsor_id, columns, start=None, end=None):
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "sponsor_id": sponsor_id,
+        "columns": columns,
+        "from": start.isoformat() if start else None,
+        "to": end.isoformat() if end else None,
+        "status": "queued",
+        "total_rows": None,
+        "rows_written": 0,
+        "bytes_written": 0,
+        "error": None,
+        "created_at": time.time(),
+    }
+    cache.set(_job_key(job["job_id"]), job, timeout=current_app.config["EXPORT_JOB_TTL"])
+    return job
+
+
+def get_job(job_id):
+    return cache.get(_job_key(job_id))
+
+
+def update_job(job_id, **changes):
+    job = get_job(job_id) or {"job_id": job_id}
+    job.update(changes)
+    cache.set(_job_key(job_id), job, timeout=current_app.config["EXPORT_JOB_TTL"])
+    return job
+
+
+def run_job(job_id):
+    """
+    Write the job's CSV to the spool directory, reporting progress after every
+    batch. Must be called inside an application context.
+    """
+    job = get_job(job_id)
+    if job is None:
+        raise ExportError(f"Unknown export job {job_id}")
+
+    columns = job["columns"]
+    query = campaign_export_query(
+        job["sponsor_id"], columns, parse_date(job["from"], "from"), parse_date(job["to"], "to")
+    )
+    total = db.session.execute(select(func.count()).select_from(query.subquery())).scalar()
+    update_job(job_id, status="running", total_rows=total)
+
+    path = job_file(job_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = path + ".part"
+    rows_written = bytes_written = 0
+    headers = [CAMPAIGN_EXPORT_COLUMNS[name][0] for name in columns]
+    with open(partial, "w", newline="", encoding="utf-8") as fp:
+        for chunk, count in iter_csv_batches(query, headers):
+            fp.write(chunk)
+            rows_written += count
+            bytes_written += len(chunk.encode("utf-8"))
+            if count:
+                update_job(job_id, rows_written=rows_written, bytes_written=bytes_written)
+    os.replace(partial, path)
+    return update_job(job_id, status="done", rows_written=rows_written, bytes_written=bytes_written)
+
+
+def purge_spool(max_age):
+    """
+    Delete spooled export files older than `max_age` seconds.
+    """
+    spool = current_app.config["EXPORT_SPOOL_DIR"]
+    if not os.path.isdir(spool):
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for name in os.listdir(spool):
+        path = os.path.join(spool, name)
+        if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+            removed += 1
+    return removed
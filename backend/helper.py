@@ -1,8 +1,11 @@
 # helper.py
 # Helper functions for database
 
-from models import User, Campaign, Sponsor, AdRequest, Influencer, Negotiation, db
-from sqlalchemy import case
+from models import User, Campaign, Sponsor, AdRequest, Influencer, Negotiation, UserFlag, CampaignFlag, db
+from sqlalchemy import case, func, select, true
+from config import cache
+from caching import tagged_key
+from serializers import compile_serializer
 from datetime import datetime
 import json
 
@@ -14,10 +17,10 @@ def get_data_by_name(username):
     else:
         return None
 
-# Function to get campaigns related to an influencer along with ad requests and negotiations
-def get_influencer_campaigns(influencer_id):
+# Query behind get_influencer_campaigns, kept separate so the query plan can be inspected
+def influencer_campaigns_query(influencer_id):
     # Query to get all the campaigns, ad_requests, negotiations, and sponsor names for the influencer
-    campaigns = (
+    return (
         db.session.query(
             Campaign.campaign_id,
             Campaign.name.label("campaign_name"),
@@ -54,38 +57,169 @@ def get_influencer_campaigns(influencer_id):
         .outerjoin(Negotiation, Negotiation.ad_request_id == AdRequest.ad_request_id)
         .join(Sponsor, Sponsor.sponsor_id == Campaign.sponsor_id)  # Join with Sponsor
         .filter(AdRequest.influencer_id == influencer_id)
-        .all()
     )
 
+
+# Function to get campaigns related to an influencer along with ad requests and negotiations
+def get_influencer_campaigns(influencer_id):
+    campaigns = influencer_campaigns_query(influencer_id).all()
+
     # Prepare data from the query result
-    data = []
-    for campaign in campaigns:
-        campaign_data = {
-            "campaign_id": campaign.campaign_id,
-            "campaign_name": campaign.campaign_name,
-            "description": campaign.description,
-            "goals": campaign.goals,
-            "niche": campaign.niche,
-            "sponsor_id": campaign.sponsor_id,
-            "sponsor_name": campaign.sponsor_name,  # Add sponsor name
-            "start_date": (
-                campaign.start_date.strftime("%Y/%m/%d")
-                if campaign.start_date
-                else None
-            ),
-            "end_date": (
-                campaign.end_date.strftime("%Y/%m/%d") if campaign.end_date else None
-            ),
-            "ad_request_id": campaign.ad_request_id,
-            "influencer_id": campaign.influencer_id,
-            "messages": campaign.messages,
-            "payment_amount": str(campaign.payment_amount),
-            "requirements": campaign.requirements,
-            "status": campaign.status,
-            "negotiated_amount": str(campaign.negotiated_amount),
-            "negotiation_status": campaign.negotiation_status,
-            "negotiation_id": campaign.negotiation_id,
-        }
-        data.append(campaign_data)
-
-    return data
+    return [influencer_campaign_to_dict(campaign) for campaign in campaigns]
+
+
+# Function to get one of the influencer's ad requests (same shape as a get_influencer_campaigns
+# entry) by primary key, or None if it does not exist or belongs to another influencer
+def get_influencer_ad_request(influencer_id, ad_request_id):
+    campaign = (
+        influencer_campaigns_query(influencer_id)
+        .filter(AdRequest.ad_request_id == ad_request_id)
+        .first()
+    )
+    return influencer_campaign_to_dict(campaign) if campaign else None
+
+
+def _slash_date(value):
+    return value.strftime("%Y/%m/%d") if value else None
+
+
+# Function to convert a row of influencer_campaigns_query into a dict
+# (compiled once; amounts are always str(), so a missing negotiation shows "None")
+influencer_campaign_to_dict = compile_serializer([
+    ("campaign_id", None),
+    ("campaign_name", None),
+    ("description", None),
+    ("goals", None),
+    ("niche", None),
+    ("sponsor_id", None),
+    ("sponsor_name", None),
+    ("start_date", _slash_date),
+    ("end_date", _slash_date),
+    ("ad_request_id", None),
+    ("influencer_id", None),
+    ("messages", None),
+    ("payment_amount", str),
+    ("requirements", None),
+    ("status", None),
+    ("negotiated_amount", str),
+    ("negotiation_status", None),
+    ("negotiation_id", None),
+], name="influencer_campaign_to_dict")
+
+
+AD_REQUEST_STATUSES = ("pending", "accepted", "rejected", "negotiation")
+
+
+# Query for the monthly sponsor report: one row per sponsor with the sponsor's
+# contact details and ad request counts per status, aggregated in SQL
+def sponsor_report_query():
+    return (
+        select(
+            Sponsor.sponsor_id,
+            Sponsor.company_name,
+            User.email,
+            func.count(func.distinct(Campaign.campaign_id)).label("campaigns"),
+            func.count(AdRequest.ad_request_id).label("total_requests"),
+            *[_count_where(AdRequest.status == status).label(f"{status}_requests") for status in AD_REQUEST_STATUSES],
+        )
+        .join(User, User.user_id == Sponsor.user_id)
+        .outerjoin(Campaign, Campaign.sponsor_id == Sponsor.sponsor_id)
+        .outerjoin(AdRequest, AdRequest.campaign_id == Campaign.campaign_id)
+        .group_by(Sponsor.sponsor_id, Sponsor.company_name, User.email)
+        .order_by(Sponsor.sponsor_id)
+    )
+
+# Query for the daily reminder: influencers who have pending ad requests and
+# have not logged in since `today` (or never), in one EXISTS query
+def reminder_candidates_query(today):
+    has_pending = (
+        select(AdRequest.ad_request_id)
+        .where(AdRequest.influencer_id == Influencer.influencer_id, AdRequest.status == "pending")
+        .exists()
+    )
+    return (
+        select(User.user_id, User.username, User.email)
+        .join(Influencer, Influencer.user_id == User.user_id)
+        .where(
+            User.role == "influencer",
+            (User.login_date == None) | (User.login_date < today),
+            has_pending,
+        )
+        .distinct()
+        .order_by(User.user_id)
+    )
+
+# Bump the version whenever a statistic is added, renamed or removed so that
+# stale cached dicts with the old shape are never served.
+PLATFORM_STATS_VERSION = 1
+PLATFORM_STATS_CACHE_KEY = f"platform_stats_v{PLATFORM_STATS_VERSION}"
+
+
+def _count_where(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+# Every platform-wide count, grouped by the table it is computed from.
+# Adding a statistic here adds a column, not a query.
+def _platform_stats_columns():
+    return [
+        (User, {
+            "total_users": func.count(),
+            "admins": _count_where(User.role == "admin"),
+            "sponsors": _count_where(User.role == "sponsor"),
+            "influencers": _count_where(User.role == "influencer"),
+        }),
+        (Sponsor, {
+            "total_sponsors": func.count(),
+            "pending_sponsors": _count_where(Sponsor.is_approved.is_(False)),
+        }),
+        (Influencer, {
+            "total_influencers": func.count(),
+        }),
+        (Campaign, {
+            "campaigns_public": _count_where(Campaign.visibility == "public"),
+            "campaigns_private": _count_where(Campaign.visibility == "private"),
+        }),
+        (AdRequest, {
+            "ad_requests_pending": _count_where(AdRequest.status == "pending"),
+            "ad_requests_rejected": _count_where(AdRequest.status == "rejected"),
+            "ad_requests_negotiation": _count_where(AdRequest.status == "negotiation"),
+            "ad_requests_accepted": _count_where(AdRequest.status == "accepted"),
+        }),
+        (UserFlag, {
+            "flagged_users": func.count(),
+        }),
+        (CampaignFlag, {
+            "flagged_campaigns": func.count(),
+        }),
+    ]
+
+
+# Function to compute all platform statistics in one statement: each table is
+# aggregated once into a single-row derived table and the rows are joined.
+def compute_platform_stats():
+    subqueries = [
+        select(*[expr.label(name) for name, expr in columns.items()])
+        .select_from(model)
+        .subquery()
+        for model, columns in _platform_stats_columns()
+    ]
+    from_clause = subqueries[0]
+    for subquery in subqueries[1:]:
+        from_clause = from_clause.join(subquery, true())
+
+    query = select(*[column for subquery in subqueries for column in subquery.c]).select_from(from_clause)
+    row = db.session.execute(query).mappings().one()
+    return {name: int(value) for name, value in row.items()}
+
+
+# Function to get the (cached) platform statistics shared by the admin endpoints
+def get_platform_stats():
+    # Any write to one of the aggregated tables bumps its tag and so the key
+    tags = [model.__tablename__ for model, columns in _platform_stats_columns()]
+    key = tagged_key(PLATFORM_STATS_CACHE_KEY, tags)
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_platform_stats()
+        cache.set(key, stats)
+    return stats
@@ -2,47 +2,26 @@
 
 from flask import Blueprint, request, jsonify
 from models import db, User, Sponsor, Campaign, AdRequest, Influencer, UserFlag, CampaignFlag, Negotiation
-from functools import wraps
 from flask_cors import cross_origin
-import jwt
-from datetime import datetime, timedelta
 from flask import Response
 
+import auth
+import login_dates
+import realtime
 import helper
 
 from config import cache
+from caching import principal_cache_key
+from transitions import apply_transition, check_transition, TransitionConflict, TransitionError
 
 influencer = Blueprint("influencer_bp", __name__)
-SECRET_KEY = 'your_secret_key'
 from flask_cors import cross_origin
 
 
 
-def token_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        token = request.headers.get('Authorization')
-        if not token:
-            return jsonify({"message": "Token is missing!"}), 403
-        try:
-            token = token.split(" ")[1]  # Get token from "Bearer <token>"
-            data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-            request.user = data
-        except jwt.ExpiredSignatureError:
-            return jsonify({"message": "Token has expired!"}), 403
-        except jwt.InvalidTokenError:
-            return jsonify({"message": "Invalid token!"}), 403
-        return f(*args, **kwargs)
-    return decorated_function
-
-
-def influencer_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if request.user.get('role') != 'influencer':
-            return jsonify({"message": "Unauthorized"}), 403
-        return f(*args, **kwargs)
-    return decorated_function
+token_required = auth.token_required
+influencer_required = auth.role_guard("influencer")
+stream_token_required = auth.token_guard(query_token=True)  # EventSource cannot send headers
 
 
 @influencer.route("/login",methods=["POST"])
@@ -59,14 +38,9 @@ def login():
         
         # print(influencer_data.to_dict())
         
-        token = jwt.encode({
-            'user_id': user.user_id,
-            'username': user.username,
-            'role': user.role,
-            'exp': datetime.utcnow() + timedelta(hours=1)
-        }, SECRET_KEY, algorithm='HS256')
-        user.login_date = datetime.utcnow()
-        db.session.commit()
+        token = auth.issue_token(user, influencer_id=influencer_data.influencer_id if influencer_data else None)
+        login_dates.record_login(user.user_id)
+        db.session.commit()  # Saves the password if check_password rehashed it
         return jsonify({"token": token ,  "role": user.role}), 200
     return jsonify({"message": "Invalid credentials"}), 401
 
@@ -121,22 +95,19 @@ def register():
 
 
 
+# Cache tags for the influencer dashboard: their own ad requests and
+# negotiations, plus the campaign and sponsor details joined into each row
+INFLUENCER_DASHBOARD_TAGS = ["influencer_id:{influencer_id}", "campaigns", "sponsors"]
+
+
 @influencer.route("/dashboard", methods=["GET", "POST"])
 @cross_origin()
 @token_required
 @influencer_required
-@cache.cached(key_prefix='influencer_dashboard')
+@cache.cached(timeout=300, key_prefix=principal_cache_key('influencer_dashboard', tags=INFLUENCER_DASHBOARD_TAGS))
 def dashboard():
     try :
-        user_id = request.user.get('user_id')
-        influencer = Influencer.query.filter_by(user_id=user_id).first()
-
-        # print(influencer)
-        
-        if not influencer:
-            return jsonify({"message": "Influencer not found"}), 404
-        
-        influencer_id = influencer.influencer_id
+        influencer_id = request.principal.influencer_id
 
         data = helper.get_influencer_campaigns(influencer_id)
 
@@ -154,89 +125,27 @@ def dashboard():
 @influencer_required
 def acceptAdRqst(ad_request_id:int):
     try:
-        user_id = request.user.get('user_id')
-        influencer = Influencer.query.filter_by(user_id=user_id).first()
+        influencer_id = request.principal.influencer_id
 
-        if not influencer:
-            return jsonify({"message": "Influencer not found"}), 404
-        
-        influencer_id = influencer.influencer_id
-        ad_request_id = ad_request_id
-
-        data = helper.get_influencer_campaigns(influencer_id)
-        show_info = None
-        
-        for d in data:
-            if d["ad_request_id"] == ad_request_id:
-                show_info = d
-                break
+        show_info = helper.get_influencer_ad_request(influencer_id, ad_request_id)
         if not show_info:
             return jsonify({"message": "Ad request not found"}), 404
-    # Check if Already Accepted !!
-        if (
-            show_info["negotiation_status"] == "accepted"
-            and show_info["status"] == "accepted"
-        ):
-            message ="You have Already Accepted the Ad Request !! "
-            return jsonify({"message": message }), 500
-
-        # Check if Already Rejected !!
-        elif show_info["negotiation_status"] == "rejected":
-            message ="You have Already Rejected the Ad Request !! "
-            return jsonify({"message": message }), 500
-        
-        if request.method == "POST":
 
-            if show_info["negotiation_id"]:
-                nego = Negotiation.query.filter_by(
-                    negotiation_id=show_info["negotiation_id"]
-                ).first()
-                nego.negotiation_status = "accepted"
-                nego.proposed_payment_amount = show_info["payment_amount"]
-
-                try:
-                    db.session.commit()
-
-                except Exception as e:
-                    error_message = str(e).split("\n")[0]
-                    db.session.rollback()
-                    return jsonify({"message": str(error_message)}), 500
-            else:
-                new_nego = Negotiation(
-                    ad_request_id=show_info["ad_request_id"],
-                    influencer_id=show_info["influencer_id"],
-                    negotiation_status="accepted",
-                    proposed_payment_amount=show_info["payment_amount"],
-                )
-
-                try:
-                    db.session.add(new_nego)
-                    db.session.commit()
-                except Exception as e:
-                    error_message = str(e).split("\n")[0]
-                    db.session.rollback()
-                    return jsonify({"message": str(error_message)}), 500
-
-
-            # change ad_request status to accepted !
-            ad_reqst = AdRequest.query.filter_by(
-                ad_request_id=show_info["ad_request_id"]
-            ).first_or_404()
-            ad_reqst.status = "accepted"
-            try:
-                db.session.commit()
-
-            except Exception as e:
-                error_message = str(e).split("\n")[0]
-                db.session.rollback()
-                return jsonify({"message": str(error_message)}), 500
-
-            # #Clear the cache for dashboard data
-            cache.delete('influencer_dashboard')
+        if request.method == "POST":
+            # Accept at the ad request's original payment amount
+            apply_transition(
+                "accept", ad_request_id, show_info["status"], influencer_id, show_info["campaign_id"],
+                negotiation_id=show_info["negotiation_id"], amount=show_info["payment_amount"],
+            )
             return {"message" : "AD_reqest Accepted Successfully!"}
         else:
+            check_transition("accept", show_info["status"])
             return show_info
 
+    except TransitionConflict as e:
+        return jsonify({"message": str(e)}), 409
+    except TransitionError as e:
+        return jsonify({"message": str(e)}), 500
     except Exception as e:
         return jsonify({"message": str(e)}), 500
     
@@ -252,16 +161,9 @@ def acceptAdRqst(ad_request_id:int):
 def reject_adrequest(ad_request_id):
 
     try:
-        user_id = request.user.get('user_id')
-        influencer = Influencer.query.filter_by(user_id=user_id).first()
-
-        if not influencer:
-            return jsonify({"message": "Influencer not found"}), 404
-        
-        influencer_id = influencer.influencer_id
+        influencer_id = request.principal.influencer_id
 
-        data = helper.get_influencer_campaigns(influencer_id)
-        show_info = next((d for d in data if d["ad_request_id"] == ad_request_id), None)
+        show_info = helper.get_influencer_ad_request(influencer_id, ad_request_id)
 
        
 
@@ -269,62 +171,20 @@ def reject_adrequest(ad_request_id):
             return jsonify({"message": "Ad request not found"}), 404
         
 
-        # Check if Already Accepted !!
-        if (
-            show_info["negotiation_status"] == "accepted"
-            and show_info["status"] == "accepted"
-        ):
-            message = "You have Already Accepted the Ad Request !! "
-            return jsonify({"message": message }), 500
-
-        # Check if Already Rejected !!
-        if (
-            show_info["negotiation_status"] == "rejected"
-            and show_info["status"] == "rejected"
-        ):
-            message= "You have Already Rejected the Ad Request !! "
-            return jsonify({"message": message }), 500
-
         if request.method == "POST":
-            # Change Ad_request status
-            old_ad_request = AdRequest.query.filter_by(ad_request_id=ad_request_id).first_or_404()
-            old_ad_request.status = "rejected"
-
-            try:
-                db.session.commit()
-            except Exception as e:
-                db.session.rollback()
-                return jsonify({"message": str(e).split("\n")[0]}), 500
-
-            # Change Negotiation status to Rejected
-            if show_info["negotiation_id"] is not None:
-                old_nego = Negotiation.query.filter_by(negotiation_id=show_info["negotiation_id"]).first_or_404()
-                old_nego.negotiation_status = "rejected"
-                try:
-                    db.session.commit()
-                except Exception as e:
-                    db.session.rollback()
-                    return jsonify({"message": str(e).split("\n")[0]}), 500
-            else:
-                new_nego = Negotiation(
-                    ad_request_id=ad_request_id,
-                    influencer_id=influencer_id,
-                    negotiation_status="rejected",
-                    proposed_payment_amount=show_info["negotiated_amount"],
-                )
-                try:
-                    db.session.add(new_nego)
-                    db.session.commit()
-                except Exception as e:
-                    db.session.rollback()
-                    return jsonify({"message": str(e).split("\n")[0]}), 500
-                
-            # #Clear the cache for dashboard data
-            cache.delete('influencer_dashboard')
+            apply_transition(
+                "reject", ad_request_id, show_info["status"], influencer_id, show_info["campaign_id"],
+                negotiation_id=show_info["negotiation_id"],
+            )
             return {"message" : "AD_reqest Rejected Successfully!"}
         else:
+            check_transition("reject", show_info["status"])
             return jsonify(show_info)
 
+    except TransitionConflict as e:
+        return jsonify({"message": str(e)}), 409
+    except TransitionError as e:
+        return jsonify({"message": str(e)}), 500
     except Exception as e:
         return jsonify({"message": str(e)}), 500
     
@@ -336,70 +196,32 @@ def reject_adrequest(ad_request_id):
 @influencer_required
 def nego_adrequest(ad_request_id):
     try:
-        user_id = request.user.get('user_id')
-        influencer = Influencer.query.filter_by(user_id=user_id).first()
-
-        if not influencer:
-            return jsonify({"message": "Influencer not found"}), 404
-        
-        influencer_id = influencer.influencer_id
+        influencer_id = request.principal.influencer_id
 
-        data = helper.get_influencer_campaigns(influencer_id)
-        show_info = next((d for d in data if d["ad_request_id"] == ad_request_id), None)
+        show_info = helper.get_influencer_ad_request(influencer_id, ad_request_id)
 
         if not show_info:
             return jsonify({"message": "Ad request not found"}), 404
 
-        # Check if Already Accepted
-        if show_info["negotiation_status"] == "accepted" and show_info["status"] == "accepted":
-            return jsonify({"message": "You have already accepted the ad request!"}), 400
-
-        # Check if Already Rejected
-        if show_info["negotiation_status"] == "rejected":
-            return jsonify({"message": "You have already rejected the ad request!"}), 400
-        
         if request.method == "POST":
             new_nego_amount = request.form.get("nego_amount")
             if not new_nego_amount:
                 return jsonify({"message":"Empty Response wont accept !"}) , 500
 
-            # Change Ad_request status
-            old_ad_request = AdRequest.query.filter_by(ad_request_id=show_info["ad_request_id"]).first_or_404()
-            old_ad_request.status = "negotiation"
-
-            try:
-                db.session.commit()
-            except Exception as e:
-                db.session.rollback()
-                return jsonify({"message": str(e).split("\n")[0]}), 500
-
-            # Change Nego_amount and status
-            if show_info["negotiation_id"] is not None:
-                old_nego = Negotiation.query.filter_by(negotiation_id=show_info["negotiation_id"]).first_or_404()
-                old_nego.proposed_payment_amount = new_nego_amount
-                try:
-                    db.session.commit()
-                except Exception as e:
-                    db.session.rollback()
-                    return jsonify({"message": str(e).split("\n")[0]}), 500
-            else:
-                new_nego = Negotiation(
-                    ad_request_id=show_info["ad_request_id"],
-                    influencer_id=show_info["influencer_id"],
-                    negotiation_status="pending",
-                    proposed_payment_amount=new_nego_amount,
-                )
-                try:
-                    db.session.add(new_nego)
-                    db.session.commit()
-                except Exception as e:
-                    db.session.rollback()
-                    return jsonify({"message": str(e).split("\n")[0]}), 500
+            apply_transition(
+                "negotiate", ad_request_id, show_info["status"], influencer_id, show_info["campaign_id"],
+                negotiation_id=show_info["negotiation_id"], amount=new_nego_amount,
+            )
 
             return jsonify({"message": f"UPDATED THE Negotiation ({new_nego_amount})"})
         else:
+            check_transition("negotiate", show_info["status"])
             return jsonify(show_info)
 
+    except TransitionConflict as e:
+        return jsonify({"message": str(e)}), 409
+    except TransitionError as e:
+        return jsonify({"message": str(e)}), 400
     except Exception as e:
         return jsonify({"message": str(e)}), 500
     
@@ -411,13 +233,7 @@ def nego_adrequest(ad_request_id):
 @influencer_required
 def sendAdReqst(campaign_id):
     try:
-        user_id = request.user.get('user_id')
-        influencer = Influencer.query.filter_by(user_id=user_id).first()
-
-        if not influencer:
-            return jsonify({"message": "Influencer not found"}), 404
-
-        influencer_id = influencer.influencer_id
+        influencer_id = request.principal.influencer_id
         new_ad = AdRequest(
             campaign_id=campaign_id,
             influencer_id=influencer_id,
@@ -429,9 +245,6 @@ def sendAdReqst(campaign_id):
         db.session.add(new_ad)
         db.session.commit()
 
-        # #Clear relevant cache
-        cache.delete('influencer_dashboard')
-        
         return jsonify({"message": "New ad request added successfully", "success": True}), 201
     
     except Exception as e:
@@ -445,11 +258,7 @@ def sendAdReqst(campaign_id):
 @influencer_required
 def influProfile():
     try:
-        user_id = request.user.get('user_id')
-        influencer = Influencer.query.filter_by(user_id=user_id).first()
-        # print(influencer)
-        if not influencer:
-            return jsonify({"message": "Influencer not found"}), 404
+        influencer = db.session.get(Influencer, request.principal.influencer_id)
 
         # Handle GET request
     
@@ -559,4 +368,16 @@ def ad_requests_sent():
     except Exception as e:
         return jsonify({"message": str(e)}), 500
 
-'''
\ No newline at end of file
+'''
+
+
+@influencer.route("/events", methods=["GET"])
+@cross_origin()
+@stream_token_required
+@influencer_required
+def dashboard_events():
+    """
+    Server-Sent Events stream of the influencer's dashboard changes (realtime.py).
+    Reload the dashboard on "ready", then apply the delta events.
+    """
+    return realtime.event_stream(realtime.principal_channels(request.principal))
@@ -0,0 +1,154 @@
+# login_dates.py
+# Write-behind buffer for User.login_date.
+#
+# Logins record their timestamp here instead of committing an UPDATE each, and
+# tasks.flush_login_dates writes everything buffered as one batched UPDATE
+# every LOGIN_FLUSH_INTERVAL seconds. With the Redis cache the buffer is a
+# hash shared by every web process (user_id -> ISO timestamp, latest wins).
+# Without Redis, or if it is unreachable, each process buffers in memory and
+# flushes itself once the interval has passed.
+
+import logging
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import case, update
+
+from caching import mark_changed
+from config import cache
+from models import db, User
+
+logger = logging.getLogger(__name__)
+
+BUFFER_KEY = "login_dates"
+FLUSH_CHUNK_SIZE = 500  # user ids per UPDATE, well below SQLite's bound-parameter limit
+
+_local = {}
+_local_lock = threading.Lock()
+_local_flushed_at = [time.time()]
+
+
+def _redis():
+    backend = cache.cache
+    client = getattr(backend, "_write_client", None)
+    return (client, backend.key_prefix + BUFFER_KEY) if client is not None else (None, None)
+
+
+def _record_local(values):
+    """
+    Merge {user_id: datetime} into the in-process buffer, keeping the latest.
+    """
+    with _local_lock:
+        for user_id, when in values.items():
+            if user_id not in _local or _local[user_id] < when:
+                _local[user_id] = when
+
+
+def record_login(user_id, when=None):
+    """
+    Buffer a login of `user_id` at `when` (default: now, UTC).
+    """
+    when = when or datetime.utcnow()
+    client, key = _redis()
+    if client is not None:
+        try:
+            client.hset(key, user_id, when.isoformat())
+            return
+        except Exception:
+            logger.exception("Login date buffer unavailable, buffering in process")
+
+    _record_local({user_id: when})
+    if time.time() - _local_flushed_at[0] >= current_app.config["LOGIN_FLUSH_INTERVAL"]:
+        try:
+            flush()
+        except Exception:
+            logger.exception("Could not flush buffered login dates")
+
+
+def _decode(raw):
+    return {
+        int(user_id): datetime.fromisoformat(value.decode() if isinstance(value, bytes) else value)
+        for user_id, value in raw.items()
+    }
+
+
+def pending():
+    """
+    {user_id: datetime} of every login not yet written to the database.
+    """
+    buffered = {}
+    client, key = _redis()
+    if client is not None:
+        try:
+            buffered = _decode(client.hgetall(key))
+        except Exception:
+            logger.exception("Could not read the login date buffer")
+    with _local_lock:
+        for user_id, when in _local.items():
+            if user_id not in buffered or buffered[user_id] < when:
+                buffered[user_id] = when
+    return buffered
+
+
+def _drain():
+    drained = {}
+    client, key = _redis()
+    if client is not None:
+        pipe = client.pipeline(transaction=True)
+        pipe.hgetall(key)
+        pipe.delete(key)
+        drained = _decode(pipe.execute()[0])
+    with _local_lock:
+        for user_id, when in _local.items():
+            if user_id not in drained or drained[user_id] < when:
+                drained[user_id] = when
+        _local.clear()
+        _local_flushed_at[0] = time.time()
+    return drained
+
+
+def _restore(values):
+    """
+    Put drained values back after a failed flush without overwriting logins
+    recorded in the meantime.
+    """
+    client, key = _redis()
+    if client is not None:
+        try:
+            pipe = client.pipeline(transaction=False)
+            for user_id, when in values.items():
+                pipe.hsetnx(key, user_id, when.isoformat())
+            pipe.execute()
+            return
+        except Exception:
+            logger.exception("Could not restore the login date buffer")
+    _record_local(values)
+
+
+def flush():
+    """
+    Write every buffered login date in one transaction and return how many
+    users were updated. Must be called inside an application context.
+    """
+    buffered = _drain()
+    if not buffered:
+        return 0
+    user_ids = sorted(buffered)
+    try:
+        for start in range(0, len(user_ids), FLUSH_CHUNK_SIZE):
+            chunk = user_ids[start:start + FLUSH_CHUNK_SIZE]
+            db.session.execute(
+                update(User)
+                .where(User.user_id.in_(chunk))
+                .values(login_date=case({user_id: buffered[user_id] for user_id in chunk}, value=User.user_id))
+                .execution_options(synchronize_session=False)
+            )
+        mark_changed(db.session, {"users", *(f"user_id:{user_id}" for user_id in user_ids)})
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        _restore(buffered)
+        raise
+    return len(user_ids)
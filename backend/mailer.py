@@ -0,0 +1,260 @@
+# mailer.py
+# Pooled, rate-limited bulk mail delivery for Celery tasks.
+#
+# Each worker process keeps a small pool of persistent SMTP connections
+# (MAIL_POOL_SIZE) and sends a batch over them from that many threads. A
+# cache-backed counter enforces MAIL_RATE_LIMIT messages per second across all
+# workers sharing the cache. Transient failures (disconnects, socket errors,
+# 4xx replies) are retried with exponential backoff; permanent ones are counted
+# as failed. Sent/failed/retried counters and the last batch's throughput are
+# kept in the cache and exposed by mail_stats().
+
+import logging
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from flask import current_app
+from flask_mail import Message
+
+from config import cache
+
+logger = logging.getLogger(__name__)
+
+MAIL_STATS_COUNTERS = ("sent", "failed", "retried")
+
+
+class SMTPPool:
+    """
+    A bounded pool of open SMTP connections. At most `size` connections are
+    in use at once; idle ones are reused, broken ones are dropped.
+    """
+
+    def __init__(self, host, port, size=4, use_tls=False, use_ssl=False, username=None, password=None, timeout=30):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        connection = smtp_class(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            connection.starttls()
+        if self.username:
+            connection.login(self.username, self.password)
+        return connection
+
+    @staticmethod
+    def _discard(connection):
+        try:
+            connection.quit()
+        except Exception:
+            connection.close()
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = self._connect()
+            try:
+                yield connection
+            except Exception:
+                self._discard(connection)
+                raise
+            self._idle.put(connection)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    The current process's pool for the app's MAIL_* settings.
+    """
+    config = current_app.config
+    # MAIL_SERVER may be written as a URL ("smtp://localhost:1025")
+    host = config["MAIL_SERVER"].split("://", 1)[-1].split(":", 1)[0]
+    settings = (
+        host,
+        config["MAIL_PORT"],
+        config["MAIL_POOL_SIZE"],
+        config.get("MAIL_USE_TLS", False),
+        config.get("MAIL_USE_SSL", False),
+        config.get("MAIL_USERNAME"),
+        config.get("MAIL_PASSWORD"),
+    )
+    with _pools_lock:
+        if settings not in _pools:
+            _pools[settings] = SMTPPool(*settings)
+        return _pools[settings]
+
+
+def is_transient(error):
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPException):
+        return False  # e.g. every recipient refused
+    return isinstance(error, OSError)  # connection refused, timeouts, resets
+
+
+def _count_in_window(key):
+    """
+    Increment a counter that expires shortly after its one-second window.
+    """
+    backend = cache.cache
+    client = getattr(backend, "_write_client", None)
+    if client is not None:
+        pipe = client.pipeline()
+        pipe.incr(backend.key_prefix + key)
+        pipe.expire(backend.key_prefix + key, 2)
+        return pipe.execute()[0]
+    cache.add(key, 0, timeout=2)
+    return backend.inc(key)
+
+
+def wait_for_send_slot(limit):
+    """
+    Block until this message fits in the shared per-second budget.
+    Fails open if the cache is unavailable.
+    """
+    if not limit:
+        return
+    while True:
+        window = int(time.time())
+        key = f"mail_rate:{window}"
+        try:
+            if _count_in_window(key) <= limit:
+                return
+        except Exception:
+            logger.exception("Mail rate limiter unavailable")
+            return
+        time.sleep(max(0.0, window + 1 - time.time()))
+
+
+def _incr(counter, delta=1):
+    if delta:
+        try:
+            cache.cache.inc(f"mail_stats:{counter}", delta)
+        except Exception:
+            logger.exception("Could not record mail %s", counter)
+
+
+def record_failed(count):
+    """
+    Count `count` messages as failed when their batch could not be sent at
+    all (send_batch counts the ones it attempted itself).
+    """
+    _incr("failed", count)
+
+
+def build_message(data):
+    """
+    Build a Flask-Mail Message from a JSON-serialisable dict
+    {to, subject, body, html?, sender?, attachments?: [[filename, content_type, data]]}
+    as passed to tasks.send_mail_batch.
+    """
+    msg = Message(
+        subject=data["subject"],
+        sender=data.get("sender") or current_app.config["MAIL_DEFAULT_SENDER"],
+        recipients=[data["to"]],
+        body=data.get("body"),
+        html=data.get("html"),
+    )
+    for filename, content_type, content in data.get("attachments", []):
+        msg.attach(filename, content_type, content)
+    return msg
+
+
+def send_batch(messages):
+    """
+    Send Flask-Mail messages over the pool, MAIL_POOL_SIZE at a time.
+    Returns (sent, failed). Must be called inside an application context.
+    """
+    config = current_app.config
+    pool = get_pool()
+    rate_limit = config["MAIL_RATE_LIMIT"]
+    max_retries = config["MAIL_MAX_RETRIES"]
+    backoff = config["MAIL_RETRY_BACKOFF"]
+    retried = [0]
+    retried_lock = threading.Lock()
+
+    # Rendering the MIME body needs the app context, so do it before fanning out
+    envelopes = [(msg.sender, list(msg.send_to), msg.as_bytes()) for msg in messages]
+
+    def deliver(envelope):
+        sender, recipients, payload = envelope
+        for attempt in range(max_retries + 1):
+            wait_for_send_slot(rate_limit)
+            try:
+                with pool.connection() as connection:
+                    connection.sendmail(sender, recipients, payload)
+                return True
+            except Exception as error:
+                if not is_transient(error) or attempt == max_retries:
+                    logger.warning("Failed to send mail to %s: %s", recipients, error)
+                    return False
+                with retried_lock:
+                    retried[0] += 1
+                time.sleep(backoff * 2 ** attempt)
+        return False
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        results = list(executor.map(deliver, envelopes))
+    elapsed = time.time() - started
+
+    sent = sum(results)
+    failed = len(results) - sent
+    _incr("sent", sent)
+    _incr("failed", failed)
+    _incr("retried", retried[0])
+    try:
+        cache.set("mail_stats:last_batch", {
+            "sent": sent,
+            "failed": failed,
+            "seconds": round(elapsed, 3),
+            "per_second": round(sent / elapsed, 2) if elapsed else None,
+            "finished_at": time.time(),
+        }, timeout=0)
+    except Exception:
+        logger.exception("Could not record mail batch stats")
+    return sent, failed
+
+
+def mail_stats():
+    """
+    Totals across all workers, the overall failure rate and the throughput
+    of the most recent batch.
+    """
+    keys = [f"mail_stats:{counter}" for counter in MAIL_STATS_COUNTERS] + ["mail_stats:last_batch"]
+    *counts, last_batch = cache.get_many(*keys)
+    stats = {counter: count or 0 for counter, count in zip(MAIL_STATS_COUNTERS, counts)}
+    attempted = stats["sent"] + stats["failed"]
+    stats["failure_rate"] = round(stats["failed"] / attempted, 4) if attempted else 0.0
+    stats["last_batch"] = last_batch
+    return stats
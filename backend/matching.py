@@ -0,0 +1,356 @@
+# matching.py
+# Influencer recommendations for a campaign.
+#
+# The matching features of every influencer (niche, category, reach and the
+# accept rate of their past ad requests, negotiated ones included) are kept in
+# flat arrays in each process, so a campaign is scored against all influencers
+# in one vectorized pass and the best k are picked with argpartition instead
+# of a full sort.
+# The arrays are built on first use and then kept current incrementally:
+# influencers added since the last refresh are appended and influencers whose
+# rows or ad requests changed in this process's commits are reloaded in place.
+# Changes committed by other processes are picked up by a full rebuild every
+# MATCHING_REBUILD_INTERVAL seconds. The rebuild runs the full features query
+# in a background thread and swaps the new arrays in when it is done; requests
+# keep scoring against the current arrays meanwhile.
+#
+#   python matching.py bench    -> time the full rebuild and recommendations over 1M influencers
+
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import and_, func, or_, select
+
+from caching import on_commit
+from models import db, AdRequest, Influencer, Negotiation
+
+logger = logging.getLogger(__name__)
+
+# Weight of each score component; every component is in [0, 1]
+WEIGHTS = {
+    "niche": 3.0,        # campaign niche == influencer niche
+    "category": 1.0,     # campaign niche == influencer category
+    "reach": 2.0,        # reach close to what the budget can pay for
+    "accept_rate": 1.0,  # share of decided ad requests (or their negotiations) accepted, smoothed
+}
+
+# One row per influencer; `active` is False for influencers deleted since the build
+Features = namedtuple("Features", "ids niche category reach accept_rate active")
+DTYPES = ("int64", "int32", "int32", "float64", "float64", "bool")
+
+
+def _normalize(text):
+    return (text or "").strip().lower()
+
+
+FINAL_STATUSES = ("accepted", "rejected")
+
+
+def _outcome_count(outcomes):
+    """
+    The influencer's ad requests whose outcome is in `outcomes`: the request's
+    own status once it is final, else the status of a decided negotiation
+    (a sponsor's edit can move a negotiated request back to pending).
+    """
+    negotiated = (
+        select(Negotiation.negotiation_id)
+        .where(Negotiation.ad_request_id == AdRequest.ad_request_id, Negotiation.negotiation_status.in_(outcomes))
+        .exists()
+    )
+    return (
+        select(func.count())
+        .select_from(AdRequest)
+        .where(
+            AdRequest.influencer_id == Influencer.influencer_id,
+            or_(AdRequest.status.in_(outcomes), and_(AdRequest.status.not_in(FINAL_STATUSES), negotiated)),
+        )
+        .scalar_subquery()
+    )
+
+
+def features_query():
+    """
+    Matching features of every influencer, counted per influencer on the
+    (influencer_id, status) index and the negotiations' ad_request_id index.
+    """
+    return select(
+        Influencer.influencer_id,
+        Influencer.niche,
+        Influencer.category,
+        Influencer.reach,
+        _outcome_count(["accepted"]).label("accepted"),
+        _outcome_count(FINAL_STATUSES).label("decided"),
+    ).order_by(Influencer.influencer_id)
+
+
+class FeatureStore:
+    """
+    The feature arrays of one process. Refreshes swap in new arrays (copy on
+    write), so scoring never needs the lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.vocabulary_lock = threading.Lock()  # the rebuild thread encodes concurrently with requests
+        self.vocabulary = {"": 0}  # normalized niche/category -> code
+        self.positions = {}  # influencer_id -> row in the arrays
+        self.features = None
+        self.max_id = 0
+        self.built_at = 0.0
+        self.dirty_lock = threading.Lock()
+        self.dirty = set()
+        self.rebuilding = False
+        self.merged_during_rebuild = set()  # ids reloaded into the arrays the rebuild will replace
+
+    def code(self, text):
+        with self.vocabulary_lock:
+            return self.vocabulary.setdefault(_normalize(text), len(self.vocabulary))
+
+    def encode(self, row):
+        return (
+            row.influencer_id,
+            self.code(row.niche),
+            self.code(row.category),
+            float(row.reach or 0),
+            (row.accepted + 1) / (row.decided + 2),
+            True,
+        )
+
+    def build(self):
+        """
+        Every influencer's encoded row, read with the full features query.
+        """
+        return [self.encode(row) for row in db.session.execute(features_query())]
+
+    def _columns(self, values):
+        columns = list(zip(*values)) or [()] * len(Features._fields)
+        return Features(*[np.array(column, dtype=dtype) for column, dtype in zip(columns, DTYPES)])
+
+    def load(self, values):
+        """
+        Replace the arrays with `values`, a list of encoded rows.
+        """
+        self.features = self._columns(values)
+        self.positions = {row[0]: position for position, row in enumerate(values)}
+        self.max_id = max(self.positions, default=0)
+        self.built_at = time.time()
+
+    def merge(self, values, gone=()):
+        """
+        Update rows already present, append new ones and deactivate `gone`.
+        """
+        columns = [column.copy() for column in self.features]
+        appended = []
+        for row in values:
+            position = self.positions.get(row[0])
+            if position is None:
+                self.positions[row[0]] = len(columns[0]) + len(appended)
+                appended.append(row)
+            else:
+                for column, value in zip(columns, row):
+                    column[position] = value
+        for influencer_id in gone:
+            position = self.positions.get(influencer_id)
+            if position is not None:
+                columns[-1][position] = False
+        if appended:
+            extra = self._columns(appended)
+            columns = [np.concatenate([column, more]) for column, more in zip(columns, extra)]
+            self.max_id = max(self.max_id, max(row[0] for row in appended))
+        self.features = Features(*columns)
+
+    def refresh(self):
+        """
+        Bring the arrays up to date with new influencers and the ones marked
+        dirty by commits, and start a background rebuild when one is due. Only
+        the very first call, with no arrays to serve yet, builds them in line.
+        """
+        with self.lock:
+            if self.features is None:
+                self.load(self.build())
+                return
+            if not self.rebuilding and time.time() - self.built_at >= current_app.config["MATCHING_REBUILD_INTERVAL"]:
+                self.rebuilding = True
+                self.merged_during_rebuild = set()
+                threading.Thread(
+                    target=self._rebuild, args=(current_app._get_current_object(),),
+                    name="matching-rebuild", daemon=True,
+                ).start()
+            with self.dirty_lock:
+                dirty, self.dirty = self.dirty, set()
+            condition = Influencer.influencer_id > self.max_id
+            if dirty:
+                condition = condition | Influencer.influencer_id.in_(dirty)
+            rows = [self.encode(row) for row in db.session.execute(features_query().where(condition))]
+            if rows or dirty:
+                self.merge(rows, gone=dirty - {row[0] for row in rows})
+                if self.rebuilding:
+                    self.merged_during_rebuild.update(dirty, (row[0] for row in rows))
+
+    def _rebuild(self, app):
+        """
+        Build new arrays in the background and swap them in. On failure the
+        current arrays stay and the next rebuild is due an interval later.
+        """
+        values = None
+        try:
+            with app.app_context():
+                try:
+                    values = self.build()
+                finally:
+                    db.session.remove()
+        except Exception:
+            logger.exception("Rebuilding the matching features failed")
+        with self.lock:
+            if values is not None:
+                self.load(values)
+                # Rows merged into the old arrays meanwhile may be newer than the build
+                self.mark_dirty(self.merged_during_rebuild)
+            else:
+                self.built_at = time.time()
+            self.merged_during_rebuild = set()
+            self.rebuilding = False
+
+    def mark_dirty(self, influencer_ids):
+        with self.dirty_lock:
+            self.dirty.update(influencer_ids)
+
+    def top(self, niche, budget, k, exclude=()):
+        """
+        The k best influencers for a campaign as [(influencer_id, score)],
+        best first (ties by lowest id), leaving out `exclude`d ids.
+        """
+        features, positions = self.features, self.positions
+        niche_code = self.vocabulary.get(_normalize(niche), -1) if _normalize(niche) else -1
+        affordable = budget * 1000.0 / current_app.config["MATCHING_COST_PER_1000_REACH"]
+        # positions may already hold rows a concurrent merge has not swapped in yet
+        excluded = [positions[i] for i in exclude if positions.get(i, len(features.ids)) < len(features.ids)]
+        return _top(features, niche_code, affordable, k, excluded)
+
+
+def _top(features, niche_code, affordable, k, excluded):
+    score = WEIGHTS["niche"] * (features.niche == niche_code)
+    score += WEIGHTS["category"] * (features.category == niche_code)
+    # min(reach, affordable) / max(reach, affordable): 1 at a perfect fit
+    reach = features.reach
+    score += WEIGHTS["reach"] * np.minimum(reach, affordable) / np.maximum(np.maximum(reach, affordable), 1.0)
+    score += WEIGHTS["accept_rate"] * features.accept_rate
+    score[~features.active] = -np.inf
+    score[excluded] = -np.inf
+
+    k = min(k, len(score))
+    if k <= 0:
+        return []
+    top = np.argpartition(-score, k - 1)[:k]
+    top = top[np.lexsort((features.ids[top], -score[top]))]
+    return [
+        (int(influencer_id), float(value))
+        for influencer_id, value in zip(features.ids[top], score[top])
+        if value != -np.inf
+    ]
+
+
+store = FeatureStore()
+
+
+@on_commit
+def _mark_changed_influencers(tags):
+    # Influencer rows and ad requests both carry "influencer_id:<id>" tags
+    changed = {int(tag.split(":", 1)[1]) for tag in tags if tag.startswith("influencer_id:")}
+    if changed:
+        store.mark_dirty(changed)
+
+
+def recommend(campaign, k):
+    """
+    [(influencer_id, score)] of the k influencers best matching `campaign`,
+    leaving out influencers it already sent an ad request to.
+    """
+    store.refresh()
+    requested = db.session.scalars(
+        select(AdRequest.influencer_id).where(AdRequest.campaign_id == campaign.campaign_id)
+    )
+    return store.top(campaign.niche, float(campaign.budget or 0), k, exclude=set(requested))
+
+
+def bench(influencers=1_000_000, k=10, repeat=5, rebuild_influencers=200_000):
+    """
+    Time a full rebuild (the features query over `rebuild_influencers`
+    influencers with two ad requests each, on a temporary SQLite database)
+    and score `influencers` synthetic influencers against a campaign; prints
+    the best time of `repeat` runs of each.
+    """
+    import os
+    import random
+    import tempfile
+    from flask import Flask
+    from config import cache
+
+    niches = ["travel", "tech", "health", "food", "fashion", "gaming", "music", "beauty", "finance", "sports"]
+    statuses = ["pending", "accepted", "rejected", "negotiation"]
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}",
+        CACHE_TYPE="SimpleCache",
+        MATCHING_REBUILD_INTERVAL=600,
+        MATCHING_COST_PER_1000_REACH=20.0,
+    )
+    db.init_app(app)
+    cache.init_app(app)
+    random.seed(1)
+
+    def seed(rows):
+        db.create_all()
+        db.session.execute(Influencer.__table__.insert(), [
+            {"influencer_id": i, "user_id": i, "name": f"influencer{i}", "niche": random.choice(niches),
+             "category": random.choice(niches), "reach": random.randint(100, 5_000_000)}
+            for i in range(1, rows + 1)
+        ])
+        db.session.execute(AdRequest.__table__.insert(), [
+            {"ad_request_id": i, "campaign_id": 1, "influencer_id": (i + 1) // 2, "status": random.choice(statuses)}
+            for i in range(1, 2 * rows + 1)
+        ])
+        db.session.execute(Negotiation.__table__.insert(), [
+            {"ad_request_id": i, "influencer_id": (i + 1) // 2,
+             "negotiation_status": random.choice(["pending", "accepted", "rejected"])}
+            for i in range(1, 2 * rows + 1, 4)
+        ])
+        db.session.commit()
+
+    def build(rows):
+        bench_store = FeatureStore()
+        bench_store.load([
+            (i, bench_store.code(random.choice(niches)), bench_store.code(random.choice(niches)),
+             float(random.randint(100, 5_000_000)), random.random(), True)
+            for i in range(1, rows + 1)
+        ])
+        return bench_store
+
+    def best(run):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+        return min(timings) * 1000
+
+    with app.app_context():
+        seed(rebuild_influencers)
+        rebuild_store = FeatureStore()
+        print(f"{rebuild_influencers} influencers  rebuild: {best(lambda: rebuild_store.load(rebuild_store.build())):.1f} ms")
+        bench_store = build(influencers)
+        print(f"{influencers} influencers  top {k}: "
+              f"{best(lambda: bench_store.top('tech', 50000.0, k, exclude={1, 2, 3})):.1f} ms")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        bench()
+    else:
+        print("usage: python matching.py bench")
@@ -0,0 +1,303 @@
+# migrations.py
+# Versioned, additive schema migrations for the SQLite database.
+#
+# create_db.py drops and recreates every table. This module instead upgrades an
+# existing database in place, recording the applied version in SQLite's
+# `PRAGMA user_version`:
+#
+#   python migrations.py          -> apply pending migrations
+#   python migrations.py check    -> EXPLAIN QUERY PLAN the hot queries and fail
+#                                    if any of them falls back to a table scan
+#                                    (or, for list pages and counts, reads rows
+#                                    its covering index should answer)
+
+import sys
+
+from sqlalchemy import func
+
+from models import db
+
+def fts_statements(table, key, columns, weights):
+    """
+    An external-content FTS5 index <table>_fts over `columns` of `table`,
+    kept in sync by triggers, ranked by bm25 with per-column `weights`, and
+    filled from the existing rows.
+    """
+    fts = f"{table}_fts"
+    cols = ", ".join(columns)
+    new = ", ".join(f"new.{column}" for column in columns)
+    old = ", ".join(f"old.{column}" for column in columns)
+    delete = f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.{key}, {old});"
+    insert = f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.{key}, {new});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{table}', content_rowid='{key}', "
+        f"tokenize='porter unicode61 remove_diacritics 2', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN {delete} {insert} END",
+        f"INSERT INTO {fts}({fts}, rank) VALUES ('rank', 'bm25({', '.join(map(str, weights))})')",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def rollup_trigger(table, event, events, when=None):
+    """
+    A trigger appending `events`, a list of (sponsor_id SQL, metric SQL), to
+    rollup_events on `event` ("INSERT", "UPDATE OF status"...) of `table`.
+    """
+    name = f"{table}_rollup_{event.split()[0].lower()}"
+    condition = f" WHEN {when}" if when else ""
+    inserts = " ".join(
+        f"INSERT INTO rollup_events (sponsor_id, metric) VALUES ({sponsor}, {metric});"
+        for sponsor, metric in events
+    )
+    return f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table}{condition} BEGIN {inserts} END"
+
+
+CAMPAIGN_SPONSOR = "(SELECT sponsor_id FROM campaigns WHERE campaign_id = new.campaign_id)"
+
+
+def change_log_triggers(table, key, columns, update_of=None):
+    """
+    Triggers appending every insert, update (of `update_of`, default any
+    column) and delete on `table` to change_log, with `columns` of the new
+    row (the old one for deletes) as a JSON object.
+    """
+    def append(op, row):
+        data = ", ".join(f"'{column}', {row}.{column}" for column in columns)
+        return (f"INSERT INTO change_log (table_name, row_id, op, data)"
+                f" VALUES ('{table}', {row}.{key}, '{op}', json_object({data}));")
+
+    watched = f" OF {', '.join(update_of)}" if update_of else ""
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {table}_changes_ai AFTER INSERT ON {table} BEGIN {append('insert', 'new')} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_changes_au AFTER UPDATE{watched} ON {table} BEGIN {append('update', 'new')} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_changes_ad AFTER DELETE ON {table} BEGIN {append('delete', 'old')} END",
+    ]
+
+
+# (version, description, statements). Append only - never edit a migration
+# that has already shipped. Index names match the ones SQLAlchemy derives from
+# the models, so fresh databases built by create_all() end up identical.
+MIGRATIONS = [
+    (1, "indexes on hot foreign-key and status columns", [
+        "CREATE INDEX IF NOT EXISTS ix_users_role ON users (role)",
+        "CREATE INDEX IF NOT EXISTS ix_sponsors_user_id ON sponsors (user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_influencers_user_id ON influencers (user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_campaigns_sponsor_id ON campaigns (sponsor_id)",
+        "CREATE INDEX IF NOT EXISTS ix_campaigns_visibility ON campaigns (visibility)",
+        "CREATE INDEX IF NOT EXISTS ix_ad_requests_campaign_id ON ad_requests (campaign_id)",
+        "CREATE INDEX IF NOT EXISTS ix_ad_requests_status ON ad_requests (status)",
+        "CREATE INDEX IF NOT EXISTS ix_ad_requests_influencer_id_status ON ad_requests (influencer_id, status)",
+        "CREATE INDEX IF NOT EXISTS ix_negotiations_ad_request_id ON negotiations (ad_request_id)",
+    ]),
+    (2, "full-text search over campaigns and influencers", [
+        *fts_statements("campaigns", "campaign_id", ["name", "description", "goals", "niche"], weights=[10.0, 2.0, 2.0, 5.0]),
+        *fts_statements("influencers", "influencer_id", ["name", "category", "niche", "description"], weights=[10.0, 5.0, 5.0, 2.0]),
+    ]),
+    (3, "daily rollups for the admin charts", [
+        "CREATE TABLE IF NOT EXISTS rollup_events ("
+        " seq INTEGER PRIMARY KEY AUTOINCREMENT, day DATE NOT NULL DEFAULT (date('now')),"
+        " sponsor_id INTEGER, metric VARCHAR(64) NOT NULL, delta INTEGER NOT NULL DEFAULT 1)",
+        "CREATE TABLE IF NOT EXISTS daily_rollups ("
+        " sponsor_id INTEGER NOT NULL, day DATE NOT NULL, metric VARCHAR(64) NOT NULL, count INTEGER NOT NULL,"
+        " PRIMARY KEY (sponsor_id, day, metric)) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS rollup_watermark (id INTEGER PRIMARY KEY CHECK (id = 1), seq INTEGER NOT NULL)",
+        "INSERT OR IGNORE INTO rollup_watermark (id, seq) VALUES (1, 0)",
+        rollup_trigger("users", "INSERT", [("NULL", "'registrations_' || new.role")]),
+        rollup_trigger("campaigns", "INSERT", [("new.sponsor_id", "'campaigns_created'")]),
+        rollup_trigger("ad_requests", "INSERT", [
+            (CAMPAIGN_SPONSOR, "'ad_requests_created'"),
+            (CAMPAIGN_SPONSOR, "'ad_requests_' || coalesce(new.status, 'pending')"),
+        ]),
+        rollup_trigger("ad_requests", "UPDATE OF status", [(CAMPAIGN_SPONSOR, "'ad_requests_' || new.status")],
+                       when="new.status IS NOT old.status"),
+        rollup_trigger("user_flags", "INSERT", [("NULL", "'flagged_users'")]),
+        rollup_trigger("campaign_flags", "INSERT", [(CAMPAIGN_SPONSOR, "'flagged_campaigns'")]),
+        # Existing rows: registrations and flags on the day they were created,
+        # campaigns and ad requests (which have no timestamps) on the day of the upgrade
+        "INSERT INTO rollup_events (day, sponsor_id, metric)"
+        " SELECT coalesce(date(created_at), date('now')), NULL, 'registrations_' || role FROM users",
+        "INSERT INTO rollup_events (sponsor_id, metric) SELECT sponsor_id, 'campaigns_created' FROM campaigns",
+        "INSERT INTO rollup_events (sponsor_id, metric)"
+        " SELECT c.sponsor_id, 'ad_requests_created' FROM ad_requests a JOIN campaigns c ON c.campaign_id = a.campaign_id",
+        "INSERT INTO rollup_events (sponsor_id, metric)"
+        " SELECT c.sponsor_id, 'ad_requests_' || a.status FROM ad_requests a JOIN campaigns c ON c.campaign_id = a.campaign_id",
+        "INSERT INTO rollup_events (day, sponsor_id, metric)"
+        " SELECT coalesce(date(created_at), date('now')), NULL, 'flagged_users' FROM user_flags",
+        "INSERT INTO rollup_events (day, sponsor_id, metric)"
+        " SELECT coalesce(date(f.created_at), date('now')), c.sponsor_id, 'flagged_campaigns'"
+        " FROM campaign_flags f JOIN campaigns c ON c.campaign_id = f.campaign_id",
+    ]),
+    (4, "change log of the core tables", [
+        "CREATE TABLE IF NOT EXISTS change_log ("
+        " seq INTEGER PRIMARY KEY AUTOINCREMENT, table_name VARCHAR(64) NOT NULL, row_id INTEGER NOT NULL,"
+        " op VARCHAR(6) NOT NULL, data TEXT NOT NULL, changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)",
+        "CREATE TABLE IF NOT EXISTS change_log_checkpoints (consumer VARCHAR(255) PRIMARY KEY, seq INTEGER NOT NULL)",
+        # Password hashes stay out of the log, and login_date (written in bulk
+        # by login_dates.flush) does not count as a change
+        *change_log_triggers("users", "user_id", ["user_id", "username", "email", "role", "created_at"],
+                             update_of=["username", "email", "role"]),
+        *change_log_triggers("sponsors", "sponsor_id", [
+            "sponsor_id", "user_id", "company_name", "industry", "budget", "company_description", "is_approved"]),
+        *change_log_triggers("influencers", "influencer_id", [
+            "influencer_id", "user_id", "name", "category", "niche", "reach", "description"]),
+        *change_log_triggers("campaigns", "campaign_id", [
+            "campaign_id", "sponsor_id", "name", "description", "start_date", "end_date", "budget", "visibility",
+            "goals", "niche"]),
+        *change_log_triggers("ad_requests", "ad_request_id", [
+            "ad_request_id", "campaign_id", "influencer_id", "requirements", "payment_amount", "status", "messages"]),
+        *change_log_triggers("negotiations", "negotiation_id", [
+            "negotiation_id", "ad_request_id", "influencer_id", "proposed_payment_amount", "negotiation_status"]),
+        *change_log_triggers("user_flags", "flag_id", ["flag_id", "flagged_by", "user_id", "reason", "created_at"]),
+        *change_log_triggers("campaign_flags", "flag_id", ["flag_id", "flagged_by", "campaign_id", "reason", "created_at"]),
+    ]),
+    (5, "covering indexes for the list endpoints", [
+        # The default projections of the paginated lists in app.py, keyed by
+        # (filter, id) so a page is one range read of the index, never of the
+        # rows with their description/goals text
+        "CREATE INDEX IF NOT EXISTS ix_campaigns_listing ON campaigns"
+        " (campaign_id, sponsor_id, name, start_date, end_date, budget, visibility, niche)",
+        "CREATE INDEX IF NOT EXISTS ix_campaigns_public_listing ON campaigns"
+        " (visibility, campaign_id, sponsor_id, name, start_date, end_date, budget, niche)",
+        "CREATE INDEX IF NOT EXISTS ix_influencers_listing ON influencers"
+        " (influencer_id, name, category, niche, reach)",
+        "CREATE INDEX IF NOT EXISTS ix_ad_requests_listing ON ad_requests"
+        " (ad_request_id, campaign_id, influencer_id, payment_amount, status)",
+    ]),
+]
+
+# Tables created by migrations that create_all()/drop_all() do not know about
+MIGRATION_TABLES = [
+    "campaigns_fts", "influencers_fts", "rollup_events", "daily_rollups", "rollup_watermark",
+    "change_log", "change_log_checkpoints",
+]
+
+
+def current_version(conn):
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def upgrade():
+    """
+    Apply every migration newer than the database's recorded version.
+    Must be called inside an application context.
+    """
+    applied = []
+    with db.engine.begin() as conn:
+        version = current_version(conn)
+        for number, description, statements in MIGRATIONS:
+            if number <= version:
+                continue
+            for statement in statements:
+                conn.exec_driver_sql(statement)
+            conn.exec_driver_sql(f"PRAGMA user_version = {int(number)}")
+            applied.append((number, description))
+    return applied
+
+
+def reset():
+    """
+    Forget every migration so that upgrade() reapplies them, for use after
+    drop_all(): drops the tables only migrations create and resets the
+    recorded version. Must be called inside an application context.
+    """
+    with db.engine.begin() as conn:
+        for table in MIGRATION_TABLES:
+            conn.exec_driver_sql(f"DROP TABLE IF EXISTS {table}")
+        conn.exec_driver_sql("PRAGMA user_version = 0")
+
+
+def hot_queries():
+    """
+    The queries that run on every dashboard / principal lookup, keyed by a
+    readable name. Built lazily because they need an application context.
+    """
+    import helper
+    from models import User, Sponsor, Influencer, Campaign, AdRequest, Negotiation
+
+    def count(model, *criteria):
+        return db.session.query(func.count()).select_from(model).filter(*criteria)
+
+    def page(key, *columns, criteria=()):
+        # One keyset page of a list endpoint's default projection (app.py)
+        return db.session.query(key, *columns).filter(*criteria, key > 1).order_by(key).limit(21)
+
+    listed_campaign = [Campaign.sponsor_id, Campaign.name, Campaign.start_date, Campaign.end_date,
+                       Campaign.budget, Campaign.visibility, Campaign.niche]
+
+    return {
+        "influencer dashboard join": helper.influencer_campaigns_query(1),
+        "influencer ad request by id": helper.influencer_campaigns_query(1).filter(AdRequest.ad_request_id == 1),
+        "sponsor by user_id": Sponsor.query.filter_by(user_id=1),
+        "influencer by user_id": Influencer.query.filter_by(user_id=1),
+        "campaigns by sponsor_id": Campaign.query.filter_by(sponsor_id=1),
+        "ad requests by campaign_id": AdRequest.query.filter_by(campaign_id=1),
+        "pending ad requests by influencer": AdRequest.query.filter_by(influencer_id=1, status="pending"),
+        "negotiations by ad_request_id": Negotiation.query.filter_by(ad_request_id=1),
+        "campaign count by visibility": count(Campaign, Campaign.visibility == "public"),
+        "ad request count by status": count(AdRequest, AdRequest.status == "pending"),
+        "user count by role": count(User, User.role == "influencer"),
+        "campaigns list page": page(Campaign.campaign_id, *listed_campaign),
+        "public campaigns page": page(Campaign.campaign_id, *listed_campaign, criteria=[Campaign.visibility == "public"]),
+        "creators list page": page(
+            Influencer.influencer_id, Influencer.name, Influencer.category, Influencer.niche, Influencer.reach),
+        "ad requests list page": page(
+            AdRequest.ad_request_id, AdRequest.campaign_id, AdRequest.influencer_id, AdRequest.payment_amount,
+            AdRequest.status),
+    }
+
+
+# Hot queries that must be answered from an index alone, without reading rows
+COVERED_QUERIES = {
+    "campaign count by visibility", "ad request count by status", "user count by role",
+    "campaigns list page", "public campaigns page", "creators list page", "ad requests list page",
+}
+
+
+def explain(query):
+    """
+    Return the EXPLAIN QUERY PLAN detail lines for a SQLAlchemy query.
+    """
+    sql = str(query.statement.compile(
+        dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}
+    ))
+    rows = db.session.execute(db.text(f"EXPLAIN QUERY PLAN {sql}")).fetchall()
+    return [row[-1] for row in rows]
+
+
+def check_query_plans():
+    """
+    Return {query name: offending plan lines} for every hot query that scans a
+    table without using an index, or reads table rows although it is one of
+    the COVERED_QUERIES. An empty dict means all plans are indexed.
+    """
+    failures = {}
+    for name, query in hot_queries().items():
+        scans = [
+            detail for detail in explain(query)
+            if (detail.startswith("SCAN") and "INDEX" not in detail)
+            or (name in COVERED_QUERIES and "COVERING INDEX" not in detail)
+        ]
+        if scans:
+            failures[name] = scans
+    return failures
+
+
+if __name__ == "__main__":
+    from app import application
+
+    with application.app_context():
+        if len(sys.argv) > 1 and sys.argv[1] == "check":
+            upgrade()
+            failures = check_query_plans()
+            for name, scans in failures.items():
+                print(f"FAIL {name}: {'; '.join(scans)}")
+            if failures:
+                sys.exit(1)
+            print(f"All {len(hot_queries())} hot queries use an index.")
+        else:
+            applied = upgrade()
+            for number, description in applied:
+                print(f"Applied migration {number}: {description}")
+            print(f"Database is at version {current_version(db.session.connection())}.")
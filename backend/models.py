@@ -1,11 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, date
 from sqlalchemy.orm import validates
-from flask_bcrypt import Bcrypt
 from flask import flash
 
+import passwords
+from serializers import serialize
+
 db = SQLAlchemy()
-bcrypt = Bcrypt()
 
 
 def initialize_database(app):
@@ -15,6 +16,10 @@ def initialize_database(app):
     """
     with app.app_context():
         db.create_all()  # Creates the tables
+        # Bring databases created before the current schema up to date
+        # (indexes etc.) without dropping any data.
+        from migrations import upgrade
+        upgrade()
 
 
 class User(db.Model):
@@ -24,7 +29,7 @@ class User(db.Model):
     username = db.Column(db.String(255), unique=True, nullable=False)  # unique
     password = db.Column(db.String(255), nullable=False)
     email = db.Column(db.String(255), unique=True, nullable=False)  # unique
-    role = db.Column(db.Enum("admin", "sponsor", "influencer"), nullable=False)
+    role = db.Column(db.Enum("admin", "sponsor", "influencer"), nullable=False, index=True)
     created_at = db.Column(db.TIMESTAMP, default=db.func.current_timestamp())
     login_date = db.Column(db.TIMESTAMP, default=None, onupdate=db.func.current_timestamp())
 
@@ -44,20 +49,28 @@ class User(db.Model):
     )
 
     def set_password(self, password):
-        self.password = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password = passwords.hash_password(password)
 
     def check_password(self, password):
-        return bcrypt.check_password_hash(self.password, password)
+        """
+        Verify `password`; on success, rehash it if it was stored with an
+        outdated cost (the caller commits).
+        """
+        if not passwords.check_password(self.password, password):
+            return False
+        if passwords.needs_rehash(self.password):
+            self.set_password(password)
+        return True
     
     def to_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return serialize(self)
 
 
 class Sponsor(db.Model):
     __tablename__ = "sponsors"
 
     sponsor_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False, index=True)
     company_name = db.Column(db.String(255))
     industry = db.Column(db.String(255))
     budget = db.Column(db.Numeric(10, 2))
@@ -67,14 +80,18 @@ class Sponsor(db.Model):
     campaigns = db.relationship("Campaign", backref="sponsor", lazy=True)
 
     def to_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return serialize(self)
 
 
 class Influencer(db.Model):
     __tablename__ = "influencers"
+    # Covering index for the /api/creators pages (migration 5)
+    __table_args__ = (
+        db.Index("ix_influencers_listing", "influencer_id", "name", "category", "niche", "reach"),
+    )
 
     influencer_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False, index=True)
     name = db.Column(db.String(255))
     category = db.Column(db.String(255))
     niche = db.Column(db.String(255))
@@ -85,20 +102,27 @@ class Influencer(db.Model):
     negotiations = db.relationship("Negotiation", backref="influencer", lazy=True)
 
     def to_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return serialize(self)
 
 
 class Campaign(db.Model):
     __tablename__ = "campaigns"
+    # Covering indexes for the campaign list pages (migration 5)
+    __table_args__ = (
+        db.Index("ix_campaigns_listing", "campaign_id", "sponsor_id", "name", "start_date", "end_date", "budget",
+                 "visibility", "niche"),
+        db.Index("ix_campaigns_public_listing", "visibility", "campaign_id", "sponsor_id", "name", "start_date",
+                 "end_date", "budget", "niche"),
+    )
 
     campaign_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    sponsor_id = db.Column(db.Integer, db.ForeignKey("sponsors.sponsor_id"), nullable=False)
+    sponsor_id = db.Column(db.Integer, db.ForeignKey("sponsors.sponsor_id"), nullable=False, index=True)
     name = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text, nullable=False)
     start_date = db.Column(db.Date)
     end_date = db.Column(db.Date)
     budget = db.Column(db.Numeric(10, 2), nullable=False)
-    visibility = db.Column(db.Enum("public", "private"), default="public")
+    visibility = db.Column(db.Enum("public", "private"), default="public", index=True)
     goals = db.Column(db.Text, nullable=False)
     niche = db.Column(db.String(255), nullable=False)
 
@@ -110,7 +134,7 @@ class Campaign(db.Model):
     )
 
     def to_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return serialize(self)
 
     @validates("end_date")
     def validate_end_date(self, key, end_date):
@@ -122,32 +146,39 @@ class Campaign(db.Model):
 
 class AdRequest(db.Model):
     __tablename__ = "ad_requests"
+    # (influencer_id, status) serves both the influencer dashboard join and
+    # the "pending requests for this influencer" lookups.
+    __table_args__ = (
+        db.Index("ix_ad_requests_influencer_id_status", "influencer_id", "status"),
+        # Covering index for the /api/advert-requests pages (migration 5)
+        db.Index("ix_ad_requests_listing", "ad_request_id", "campaign_id", "influencer_id", "payment_amount", "status"),
+    )
 
     ad_request_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    campaign_id = db.Column(db.Integer, db.ForeignKey("campaigns.campaign_id"), nullable=False)
+    campaign_id = db.Column(db.Integer, db.ForeignKey("campaigns.campaign_id"), nullable=False, index=True)
     influencer_id = db.Column(db.Integer, db.ForeignKey("influencers.influencer_id"), nullable=False)
     requirements = db.Column(db.Text)
     payment_amount = db.Column(db.Numeric(10, 2))
-    status = db.Column(db.Enum("pending", "accepted", "rejected", "negotiation"), default="pending")
+    status = db.Column(db.Enum("pending", "accepted", "rejected", "negotiation"), default="pending", index=True)
     messages = db.Column(db.Text)
 
     negotiations = db.relationship("Negotiation", backref="ad_request", lazy=True, cascade="all, delete-orphan")
 
     def to_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return serialize(self)
 
 
 class Negotiation(db.Model):
     __tablename__ = "negotiations"
 
     negotiation_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    ad_request_id = db.Column(db.Integer, db.ForeignKey("ad_requests.ad_request_id"), nullable=False)
+    ad_request_id = db.Column(db.Integer, db.ForeignKey("ad_requests.ad_request_id"), nullable=False, index=True)
     influencer_id = db.Column(db.Integer, db.ForeignKey("influencers.influencer_id"), nullable=False)
     proposed_payment_amount = db.Column(db.Numeric(10, 2))
     negotiation_status = db.Column(db.Enum("pending", "accepted", "rejected"), default="pending")
 
     def to_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return serialize(self)
 
 
 class UserFlag(db.Model):
@@ -160,7 +191,7 @@ class UserFlag(db.Model):
     created_at = db.Column(db.TIMESTAMP, default=db.func.current_timestamp())
 
     def to_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return serialize(self)
 
 
 class CampaignFlag(db.Model):
@@ -173,7 +204,7 @@ class CampaignFlag(db.Model):
     created_at = db.Column(db.TIMESTAMP, default=db.func.current_timestamp())
 
     def to_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        return serialize(self)
 
 
 def init_db(app):
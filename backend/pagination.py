@@ -0,0 +1,96 @@
+# pagination.py
+# Keyset (cursor) pagination for list endpoints.
+#
+# Pages are taken with `WHERE pk > :last_pk ORDER BY pk LIMIT n`, which is an
+# index range scan, so page 1000 costs the same as page 1. The cursor handed to
+# clients is opaque; the response body keeps its usual shape and the cursor of
+# the next page is returned in the X-Next-Cursor and Link headers.
+
+import base64
+import binascii
+import json
+from urllib.parse import urlencode
+
+from flask import current_app, request
+from sqlalchemy import Select
+
+from models import db
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(value):
+    raw = json.dumps({"after": value}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_value(cursor):
+    """
+    The value `cursor` was encoded from, of any JSON type; callers check its
+    shape. Raises InvalidCursor if it is not a cursor at all.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))["after"]
+    except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+
+
+def decode_cursor(cursor):
+    """
+    The key a keyset cursor points after, which is always an integer primary
+    key. Raises InvalidCursor for anything else.
+    """
+    value = decode_value(cursor)
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise InvalidCursor("Invalid cursor")
+    return value
+
+
+def page_size():
+    """
+    The requested ?limit=, clamped to [1, API_MAX_PAGE_SIZE].
+    """
+    default = current_app.config["API_PAGE_SIZE"]
+    maximum = current_app.config["API_MAX_PAGE_SIZE"]
+    try:
+        size = int(request.args.get("limit", default))
+    except ValueError:
+        size = default
+    return max(1, min(size, maximum))
+
+
+def keyset_page(query, key_column):
+    """
+    Return (rows, next_cursor) for the page of `query` (an ORM query or a
+    Core select) after the request's ?cursor=, ordered by `key_column` (a
+    unique, indexed column - normally the primary key). next_cursor is None
+    on the last page.
+    Raises InvalidCursor for a cursor that was not issued by encode_cursor.
+    """
+    limit = page_size()
+    cursor = request.args.get("cursor")
+    if cursor:
+        query = query.filter(key_column > decode_cursor(cursor))
+
+    # Fetch one extra row to learn whether another page exists
+    query = query.order_by(key_column).limit(limit + 1)
+    rows = db.session.execute(query).all() if isinstance(query, Select) else query.all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(getattr(rows[-1], key_column.key))
+
+
+def with_next_cursor(response, next_cursor):
+    """
+    Attach the next page's cursor to a response (body shape is unchanged).
+    """
+    if next_cursor:
+        args = request.args.to_dict()
+        args["cursor"] = next_cursor
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+    return response
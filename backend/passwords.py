@@ -0,0 +1,203 @@
+# passwords.py
+# Password hashing on a bounded worker pool.
+#
+# bcrypt is deliberately slow (~250ms at cost 12) and releases the GIL while
+# it works. Hashing on the request thread let a burst of logins occupy every
+# worker and every core at once; here at most PASSWORD_HASH_WORKERS hashes run
+# concurrently and at most PASSWORD_HASH_QUEUE wait for a slot, so the cheap
+# reads keep getting CPU. The cost is BCRYPT_LOG_ROUNDS; hashes stored with a
+# different cost are upgraded on the next successful login.
+#
+#   python passwords.py bench    -> mixed login/read throughput on a throwaway app, inline vs pooled
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from flask import current_app, has_app_context
+
+DEFAULT_LOG_ROUNDS = 12
+
+
+class PasswordPoolBusy(RuntimeError):
+    pass
+
+
+class HashPool:
+    """
+    A fixed number of hashing threads plus a bound on queued jobs.
+    workers=0 runs every job inline on the caller's thread.
+    """
+
+    def __init__(self, workers, queue_size, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt") if workers else None
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def run(self, fn, *args):
+        if self._executor is None:
+            return fn(*args)
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PasswordPoolBusy("Too many logins at once, please try again")
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _setting(name, default):
+    return current_app.config.get(name, default) if has_app_context() else default
+
+
+def get_pool():
+    settings = (
+        _setting("PASSWORD_HASH_WORKERS", 0),
+        _setting("PASSWORD_HASH_QUEUE", 0),
+        _setting("PASSWORD_HASH_TIMEOUT", None),
+    )
+    with _pools_lock:
+        if settings not in _pools:
+            _pools[settings] = HashPool(*settings)
+        return _pools[settings]
+
+
+def log_rounds():
+    return _setting("BCRYPT_LOG_ROUNDS", DEFAULT_LOG_ROUNDS)
+
+
+def _encode(value):
+    return value.encode("utf-8") if isinstance(value, str) else value
+
+
+def hash_password(password):
+    """
+    Return the bcrypt hash of `password` (as str) at the configured cost.
+    """
+    salt = bcrypt.gensalt(log_rounds())
+    return get_pool().run(bcrypt.hashpw, _encode(password), salt).decode("utf-8")
+
+
+def check_password(stored_hash, password):
+    try:
+        return get_pool().run(bcrypt.checkpw, _encode(password), _encode(stored_hash))
+    except ValueError:  # not a bcrypt hash
+        return False
+
+
+def needs_rehash(stored_hash):
+    """
+    True if `stored_hash` was made with a cost other than BCRYPT_LOG_ROUNDS.
+    """
+    try:
+        return int(stored_hash.split("$")[2]) != log_rounds()
+    except (IndexError, ValueError):
+        return True
+
+
+def bench(seconds=5.0, logins=8, readers=4, users=200):
+    """
+    On a throwaway app (temporary SQLite database, SimpleCache, `users`
+    seeded users with password "password"), hammer a login endpoint from
+    `logins` threads while `readers` threads poll a read-only endpoint, once
+    with hashing inline and once on the pool.
+    """
+    import os
+    import statistics
+    import tempfile
+    import time
+
+    from flask import Flask, jsonify, request
+
+    from config import AppConfig, cache
+    from models import db, User
+
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}",
+        CACHE_TYPE="SimpleCache",
+        BCRYPT_LOG_ROUNDS=AppConfig.BCRYPT_LOG_ROUNDS,
+        PASSWORD_HASH_QUEUE=AppConfig.PASSWORD_HASH_QUEUE,
+        PASSWORD_HASH_TIMEOUT=AppConfig.PASSWORD_HASH_TIMEOUT,
+    )
+    db.init_app(app)
+    cache.init_app(app)
+    workers = AppConfig.PASSWORD_HASH_WORKERS
+    credentials = {"username": "user1", "password": "password"}
+
+    @app.route("/login", methods=["POST"])
+    def login():
+        user = User.query.filter_by(username=request.json["username"]).first()
+        if user and user.check_password(request.json["password"]):
+            db.session.commit()
+            return jsonify({"success": True})
+        return jsonify({"success": False}), 401
+
+    @app.route("/users")
+    def list_users():
+        return jsonify([user.to_dict() for user in User.query.order_by(User.user_id).limit(50)])
+
+    @app.errorhandler(PasswordPoolBusy)
+    def password_pool_busy(error):
+        return jsonify({"message": str(error)}), 503
+
+    with app.app_context():
+        db.create_all()
+        password = hash_password("password")
+        db.session.add_all([
+            User(username=f"user{i}", email=f"user{i}@example.com", password=password, role="influencer")
+            for i in range(1, users + 1)
+        ])
+        db.session.commit()
+
+    def run(pool_workers):
+        app.config["PASSWORD_HASH_WORKERS"] = pool_workers
+        stop = time.time() + seconds
+        login_count = [0]
+        read_latencies = []
+        lock = threading.Lock()
+
+        def login_loop():
+            client = app.test_client()
+            while time.time() < stop:
+                client.post("/login", json=credentials)
+                with lock:
+                    login_count[0] += 1
+
+        def read_loop():
+            client = app.test_client()
+            while time.time() < stop:
+                started = time.perf_counter()
+                client.get("/users")
+                with lock:
+                    read_latencies.append(time.perf_counter() - started)
+
+        threads = [threading.Thread(target=login_loop) for _ in range(logins)]
+        threads += [threading.Thread(target=read_loop) for _ in range(readers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        read_latencies.sort()
+        return {
+            "logins/s": round(login_count[0] / seconds, 1),
+            "reads/s": round(len(read_latencies) / seconds, 1),
+            "read p50 ms": round(statistics.median(read_latencies) * 1000, 1),
+            "read p95 ms": round(read_latencies[int(len(read_latencies) * 0.95)] * 1000, 1),
+        }
+
+    for label, pool_workers in (("inline", 0), (f"pool ({workers} workers)", workers)):
+        print(f"{label:>20}: {run(pool_workers)}")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        bench()
+    else:
+        print("usage: python passwords.py bench")
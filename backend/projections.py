@@ -0,0 +1,51 @@
+# projections.py
+# Sparse fieldsets for read-only list endpoints.
+#
+# A Projection names the columns an endpoint may return and the ones it returns
+# by default. The request's ?fields=a,b,c picks a subset, which is selected in
+# SQL as plain columns (select(Campaign.name, ...)): rows come back as Core
+# result rows, with no ORM instances, identity map or unloaded Text columns,
+# and are serialized by the compiled per-field serializer.
+
+from flask import request
+from sqlalchemy import select
+
+from serializers import model_serializer
+
+
+class FieldsError(ValueError):
+    pass
+
+
+class Projection:
+    """
+    The columns of `model` an endpoint exposes. `hidden` columns are never
+    returned (e.g. password hashes), `default` is used when ?fields= is absent
+    (all exposed columns if not given), and `required` columns (plus the
+    primary key, which pagination needs) are always selected.
+    """
+
+    def __init__(self, model, default=None, hidden=(), required=()):
+        self.model = model
+        self.allowed = [column.key for column in model.__table__.columns if column.key not in hidden]
+        self.default = list(default) if default else self.allowed
+        self.required = {model.__mapper__.primary_key[0].key, *required}
+
+    def fields(self):
+        """
+        The requested ?fields= (or the default), checked and in table order.
+        Raises FieldsError for unknown or hidden fields.
+        """
+        value = request.args.get("fields")
+        requested = [name.strip() for name in value.split(",") if name.strip()] if value else self.default
+        unknown = [name for name in requested if name not in self.allowed]
+        if unknown:
+            raise FieldsError(f"Unknown fields: {', '.join(unknown)}")
+        wanted = set(requested) | self.required
+        return [name for name in self.allowed if name in wanted]
+
+    def select(self, fields):
+        return select(*[getattr(self.model, name) for name in fields])
+
+    def serializer(self, fields):
+        return model_serializer(self.model, fields)
@@ -0,0 +1,334 @@
+# realtime.py
+# Server-Sent Events push channel for the dashboards.
+#
+# When a transaction that wrote ad requests, negotiations or campaigns
+# commits, one small delta event per changed row is published on the Redis
+# pub/sub channels of the principals concerned: the influencer of the ad
+# request or negotiation and the sponsor of its campaign, and for public
+# campaigns every influencer (a campaign made private only tells them its id).
+# GET /sponsor/events and /influencer/events stream a principal's channels as
+# text/event-stream, so a dashboard fetches its data once (on the "ready"
+# event, sent on every (re)connect) and then applies deltas instead of
+# re-running its full join on a timer; an idle dashboard costs no database
+# reads at all.
+#
+# ORM writes are picked up automatically; bulk UPDATEs bypass the unit of
+# work and declare their rows with queue_rows() (see transitions.py). Without
+# Redis, or if it is unreachable, events only reach the streams served by the
+# publishing process.
+#
+# Each open stream holds a worker thread and a Redis connection, so serve the
+# app with a threaded or async worker class. Streams are closed after
+# SSE_MAX_DURATION seconds and EventSource reconnects by itself.
+
+import json
+import logging
+import queue
+import threading
+import time
+
+from flask import Response, current_app, stream_with_context
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from config import cache
+from models import db, AdRequest, Campaign, Negotiation
+from serializers import model_serializer
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = "events:"
+PUBLIC_CAMPAIGNS = "campaigns:public"
+
+# model -> (event type, columns sent in the delta)
+EVENT_FIELDS = {
+    AdRequest: ("ad_request", ["ad_request_id", "campaign_id", "influencer_id", "status", "payment_amount"]),
+    Negotiation: ("negotiation", [
+        "negotiation_id", "ad_request_id", "influencer_id", "proposed_payment_amount", "negotiation_status"]),
+    Campaign: ("campaign", [
+        "campaign_id", "sponsor_id", "name", "start_date", "end_date", "budget", "visibility", "niche"]),
+}
+# All that influencers are sent about a campaign that was made private
+WITHDRAWN_CAMPAIGN_FIELDS = ("type", "op", "campaign_id", "visibility")
+
+
+def sponsor_channel(sponsor_id):
+    return f"sponsor:{sponsor_id}"
+
+
+def influencer_channel(influencer_id):
+    return f"influencer:{influencer_id}"
+
+
+def principal_channels(principal):
+    """
+    The channels a principal's event stream listens on.
+    """
+    if principal.role == "sponsor":
+        return [sponsor_channel(principal.sponsor_id)]
+    if principal.role == "influencer":
+        return [influencer_channel(principal.influencer_id), PUBLIC_CAMPAIGNS]
+    return []
+
+
+def _sponsors(connection, changes):
+    """
+    {(model, id): sponsor_id} for the ad requests and negotiations in
+    `changes`, looked up through their campaign in at most two queries.
+    """
+    campaign_ids = {row.campaign_id for op, model, row in changes if model is AdRequest}
+    ad_request_ids = {row.ad_request_id for op, model, row in changes if model is Negotiation}
+    sponsors = {}
+    if campaign_ids:
+        for campaign_id, sponsor_id in connection.execute(
+            select(Campaign.campaign_id, Campaign.sponsor_id).where(Campaign.campaign_id.in_(campaign_ids))
+        ):
+            sponsors[(AdRequest, campaign_id)] = sponsor_id
+    if ad_request_ids:
+        for ad_request_id, sponsor_id in connection.execute(
+            select(AdRequest.ad_request_id, Campaign.sponsor_id)
+            .join(Campaign, Campaign.campaign_id == AdRequest.campaign_id)
+            .where(AdRequest.ad_request_id.in_(ad_request_ids))
+        ):
+            sponsors[(Negotiation, ad_request_id)] = sponsor_id
+    return sponsors
+
+
+def _was_public(op, row):
+    """
+    Whether campaign `row` was public before this change: its previous
+    visibility if the flush changed it, else its current one.
+    """
+    if op == "insert":
+        return False
+    state = inspect(row, raiseerr=False)
+    if state is not None:
+        previous = state.attrs.visibility.history.deleted
+        if previous:
+            return previous[0] == "public"
+    return row.visibility == "public"
+
+
+@event.listens_for(Campaign.visibility, "set", active_history=True)
+def _load_previous_visibility(target, value, oldvalue, initiator):
+    # active_history loads the old value even when the attribute was expired
+    # (e.g. by a commit), so _was_public can see it in the history
+    return value
+
+
+def _merge_op(previous, op):
+    """
+    The op of a row changed by several flushes of one transaction, None if
+    it was inserted and deleted again (nothing to announce).
+    """
+    if previous == "insert":
+        return None if op == "delete" else "insert"
+    return op
+
+
+def _queue(session, changes):
+    """
+    Turn `changes`, a list of (op, model, object or row), into events and
+    keep them on the session until it commits, one per row: a row flushed
+    again in the same transaction replaces its earlier event.
+    """
+    sponsors = _sponsors(session.connection(), changes)
+    pending = session.info.setdefault("realtime_events", {})  # (model, id) -> [op, [(channels, event)], was_public]
+    for op, model, row in changes:
+        kind, fields = EVENT_FIELDS[model]
+        data = model_serializer(model, fields)(row)
+        key = (model, data[fields[0]])
+        previous = pending.get(key)
+        if previous is not None:
+            op = _merge_op(previous[0], op)
+            if op is None:
+                del pending[key]
+                continue
+
+        event = {"type": kind, "op": op, **data}
+        extra_events = []
+        if model is Campaign:
+            # Private campaigns only ever reach their sponsor. A campaign made
+            # private in this transaction is withdrawn from influencers with
+            # its id and visibility alone; its details stay with the sponsor.
+            was_public = previous[2] if previous is not None else _was_public(op, row)
+            channels = {sponsor_channel(row.sponsor_id)}
+            if row.visibility == "public":
+                channels.add(PUBLIC_CAMPAIGNS)
+            elif was_public:
+                extra_events.append(([PUBLIC_CAMPAIGNS], {name: event[name] for name in WITHDRAWN_CAMPAIGN_FIELDS}))
+        else:
+            was_public = None
+            channels = {influencer_channel(row.influencer_id)}
+            sponsor_key = (model, row.campaign_id if model is AdRequest else row.ad_request_id)
+            if sponsors.get(sponsor_key) is not None:
+                channels.add(sponsor_channel(sponsors[sponsor_key]))
+            if previous is not None:
+                channels.update(channel for previous_channels, _ in previous[1] for channel in previous_channels)
+        pending[key] = [op, [(sorted(channels), event), *extra_events], was_public]
+
+
+def queue_rows(session, model, ids, op="update"):
+    """
+    Publish the current state of rows `ids` of `model` when `session`
+    commits. Use this for writes that bypass the unit of work, e.g. bulk
+    update() statements.
+    """
+    key = model.__mapper__.primary_key[0]
+    rows = session.execute(select(model.__table__).where(key.in_(ids))).all()
+    _queue(session, [(op, model, row) for row in rows])
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_events(session, flush_context):
+    changes = []
+    for op, objects in (("insert", session.new), ("update", session.dirty), ("delete", session.deleted)):
+        for obj in objects:
+            model = type(obj)
+            if model in EVENT_FIELDS and (op != "update" or session.is_modified(obj)):
+                changes.append((op, model, obj))
+    if changes:
+        _queue(session, changes)
+
+
+def _redis():
+    backend = cache.cache
+    client = getattr(backend, "_write_client", None)
+    return (client, backend.key_prefix + CHANNEL_PREFIX) if client is not None else (None, None)
+
+
+_local_streams = {}  # channel -> set of queue.Queue, for streams served by this process
+_local_lock = threading.Lock()
+
+
+def _publish_local(messages):
+    with _local_lock:
+        for channel, payload in messages:
+            for stream in _local_streams.get(channel, ()):
+                try:
+                    stream.put_nowait((channel, payload))
+                except queue.Full:  # a stalled client loses events, it resyncs on reconnect
+                    pass
+
+
+def publish(events):
+    """
+    Publish [(channels, event)] now, in one pipelined call.
+    """
+    messages = [
+        (channel, json.dumps(data, separators=(",", ":")))
+        for channels, data in events
+        for channel in channels
+    ]
+    client, prefix = _redis()
+    if client is not None:
+        try:
+            pipe = client.pipeline(transaction=False)
+            for channel, payload in messages:
+                pipe.publish(prefix + channel, payload)
+            pipe.execute()
+            return
+        except Exception:
+            logger.exception("Event channel unavailable, delivering in process")
+    _publish_local(messages)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_events(session):
+    pending = session.info.pop("realtime_events", None)
+    if pending:
+        events = [event for op, queued, was_public in pending.values() for event in queued]
+        try:
+            publish(events)
+        except Exception:
+            # A lost event must never fail the request whose data already committed
+            logger.exception("Could not publish %d events", len(events))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_events(session):
+    session.info.pop("realtime_events", None)
+
+
+def _format(event_name, data):
+    return f"event: {event_name}\ndata: {data}\n\n"
+
+
+def _redis_messages(client, channels, deadline, heartbeat):
+    """
+    Yield (channel, payload) from Redis, or None every `heartbeat` seconds
+    without a message, until `deadline`.
+    """
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(*channels)
+        idle_since = time.time()
+        while time.time() < deadline:
+            message = pubsub.get_message(timeout=1.0)
+            if message is not None and message["type"] == "message":
+                idle_since = time.time()
+                channel, payload = message["channel"], message["data"]
+                yield (channel.decode() if isinstance(channel, bytes) else channel,
+                       payload.decode() if isinstance(payload, bytes) else payload)
+            elif time.time() - idle_since >= heartbeat:
+                idle_since = time.time()
+                yield None
+    finally:
+        pubsub.close()
+
+
+def _local_messages(channels, deadline, heartbeat):
+    stream = queue.Queue(maxsize=1000)
+    with _local_lock:
+        for channel in channels:
+            _local_streams.setdefault(channel, set()).add(stream)
+    try:
+        while time.time() < deadline:
+            try:
+                yield stream.get(timeout=min(heartbeat, max(deadline - time.time(), 0.01)))
+            except queue.Empty:
+                yield None
+    finally:
+        with _local_lock:
+            for channel in channels:
+                _local_streams.get(channel, set()).discard(stream)
+
+
+def event_stream(channels):
+    """
+    A text/event-stream response relaying `channels` until SSE_MAX_DURATION.
+    Sends "ready" first (the client should (re)load its data then), a
+    comment every SSE_HEARTBEAT seconds, and each delta as an event named
+    after its type ("ad_request", "negotiation", "campaign").
+    """
+    heartbeat = current_app.config["SSE_HEARTBEAT"]
+    deadline = time.time() + current_app.config["SSE_MAX_DURATION"]
+    db.session.close()  # A stream never queries; give the connection back now
+
+    client, prefix = _redis()
+    if client is not None:
+        try:
+            client.ping()
+        except Exception:
+            logger.exception("Event channel unavailable, streaming in-process events only")
+            client = None
+
+    def generate():
+        yield "retry: 3000\n\n"
+        yield _format("ready", json.dumps({"channels": channels}, separators=(",", ":")))
+        if client is not None:
+            messages = _redis_messages(client, [prefix + channel for channel in channels], deadline, heartbeat)
+        else:
+            messages = _local_messages(channels, deadline, heartbeat)
+        for message in messages:
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+            payload = message[1]
+            yield _format(json.loads(payload)["type"], payload)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,125 @@
+# rollups.py
+# Daily rollups for the admin analytics charts.
+#
+# Triggers (migration 3 in migrations.py) append one rollup_events row per
+# counted change: a registration, a campaign created, an ad request created
+# or moved to another status, a user or campaign flagged. update(), run by the
+# tasks.update_rollups beat job, folds the events past the watermark into
+# daily_rollups (one row per sponsor, day and metric, plus the platform-wide
+# total under sponsor_id 0), advances the watermark and deletes the folded
+# events, so each run costs O(changes). A chart over any date range then
+# reads O(days) rollup rows instead of scanning the base tables. Days are UTC.
+
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+from models import db
+
+PLATFORM = 0  # sponsor_id of the platform-wide rollups
+
+# Every metric a series reports, zero-filled when nothing happened that day.
+# ad_requests_<status> counts the requests that entered that status.
+METRICS = [
+    "registrations_admin",
+    "registrations_sponsor",
+    "registrations_influencer",
+    "campaigns_created",
+    "ad_requests_created",
+    "ad_requests_pending",
+    "ad_requests_negotiation",
+    "ad_requests_accepted",
+    "ad_requests_rejected",
+    "flagged_users",
+    "flagged_campaigns",
+]
+
+DEFAULT_RANGE_DAYS = 30
+MAX_RANGE_DAYS = 3660
+
+
+class RangeError(ValueError):
+    pass
+
+
+FOLD_EVENTS = text("""
+    INSERT INTO daily_rollups (sponsor_id, day, metric, count)
+    SELECT sponsor_id, day, metric, sum(delta) FROM rollup_events
+     WHERE seq > :low AND seq <= :high AND sponsor_id IS NOT NULL
+     GROUP BY sponsor_id, day, metric
+    UNION ALL
+    SELECT 0, day, metric, sum(delta) FROM rollup_events
+     WHERE seq > :low AND seq <= :high
+     GROUP BY day, metric
+    ON CONFLICT (sponsor_id, day, metric) DO UPDATE SET count = count + excluded.count
+""")
+
+
+def update():
+    """
+    Fold every event past the watermark into daily_rollups in one
+    transaction and return how many events were folded. Must be called
+    inside an application context.
+    """
+    try:
+        low = db.session.execute(text("SELECT seq FROM rollup_watermark WHERE id = 1")).scalar()
+        high = db.session.execute(text("SELECT max(seq) FROM rollup_events")).scalar()
+        if high is None or high <= low:
+            db.session.rollback()
+            return 0
+        bounds = {"low": low, "high": high}
+        folded = db.session.execute(
+            text("SELECT count(*) FROM rollup_events WHERE seq > :low AND seq <= :high"), bounds
+        ).scalar()
+        db.session.execute(FOLD_EVENTS, bounds)
+        db.session.execute(text("UPDATE rollup_watermark SET seq = :high WHERE id = 1"), bounds)
+        db.session.execute(text("DELETE FROM rollup_events WHERE seq <= :high"), bounds)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return folded
+
+
+def date_range(args):
+    """
+    The (start, end) dates of ?from=YYYY-MM-DD&to=YYYY-MM-DD, inclusive. `to`
+    defaults to today (UTC) and `from` to DEFAULT_RANGE_DAYS before it.
+    """
+    try:
+        end = date.fromisoformat(args["to"]) if args.get("to") else datetime.utcnow().date()
+        start = date.fromisoformat(args["from"]) if args.get("from") else end - timedelta(days=DEFAULT_RANGE_DAYS - 1)
+    except ValueError:
+        raise RangeError("from and to must be dates (YYYY-MM-DD)")
+    if start > end:
+        raise RangeError("from must not be after to")
+    if (end - start).days >= MAX_RANGE_DAYS:
+        raise RangeError(f"The range may span at most {MAX_RANGE_DAYS} days")
+    return start, end
+
+
+def series(start, end, sponsor_id=PLATFORM):
+    """
+    Daily counts of every metric from `start` to `end` (inclusive) for one
+    sponsor or the whole platform: {"days": [...], "metrics": {name: [...]}}.
+    Events not folded yet are included, so the series is never behind.
+    """
+    bounds = {"start": start.isoformat(), "end": end.isoformat(), "sponsor_id": sponsor_id}
+    rows = db.session.execute(text("""
+        SELECT day, metric, count FROM daily_rollups
+         WHERE sponsor_id = :sponsor_id AND day BETWEEN :start AND :end
+        UNION ALL
+        SELECT day, metric, sum(delta) FROM rollup_events
+         WHERE seq > (SELECT seq FROM rollup_watermark WHERE id = 1)
+           AND day BETWEEN :start AND :end
+           AND (:sponsor_id = 0 OR sponsor_id = :sponsor_id)
+         GROUP BY day, metric
+    """), bounds)
+
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    index = {day.isoformat(): position for position, day in enumerate(days)}
+    metrics = {metric: [0] * len(days) for metric in METRICS}
+    for day, metric, count in rows:
+        if metric in metrics:
+            metrics[metric][index[str(day)]] += count
+    return {"days": list(index), "metrics": metrics}
@@ -0,0 +1,144 @@
+# search.py
+# Ranked full-text search over campaigns and influencers.
+#
+# The FTS5 indexes campaigns_fts / influencers_fts are created and kept in sync
+# with their tables by triggers (migration 2 in migrations.py). A search
+# matches the index, joins the base table for the structured filters and
+# orders by the index's bm25 rank, so cost grows with the number of matches,
+# not the size of the table. Pages are keyset-paginated on (rank, id).
+
+import re
+
+from flask import request
+from sqlalchemy import column, literal_column, or_, and_, select, table
+
+from models import db, Campaign, Influencer
+from pagination import InvalidCursor, decode_cursor, decode_value, encode_cursor, page_size
+from serializers import model_serializer
+
+
+class SearchError(ValueError):
+    pass
+
+
+# type -> (model, primary key, FTS table, {filter parameter: (column, operator, parse)})
+SEARCH_TYPES = {
+    "campaigns": (Campaign, Campaign.campaign_id, "campaigns_fts", {
+        "niche": (Campaign.niche, "eq", str),
+        "min_budget": (Campaign.budget, "ge", float),
+        "max_budget": (Campaign.budget, "le", float),
+    }),
+    "influencers": (Influencer, Influencer.influencer_id, "influencers_fts", {
+        "niche": (Influencer.niche, "eq", str),
+        "category": (Influencer.category, "eq", str),
+        "min_reach": (Influencer.reach, "ge", int),
+        "max_reach": (Influencer.reach, "le", int),
+    }),
+}
+
+# Conditions every search of a type applies whatever the request asks for:
+# search is unauthenticated, so private campaigns are never searchable
+FIXED_CONDITIONS = {"campaigns": [Campaign.visibility == "public"]}
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def match_expression(text):
+    """
+    Turn free text into an FTS5 query: every word must match, the last one as
+    a prefix (search as you type). Words are quoted so FTS5 operators in user
+    input are taken literally.
+    """
+    tokens = [f'"{token}"' for token in TOKEN_PATTERN.findall(text or "")]
+    if tokens:
+        tokens[-1] += "*"
+    return " ".join(tokens)
+
+
+def parse_filters(search_type, args):
+    filters = SEARCH_TYPES[search_type][3]
+    values = {name: args[name] for name in filters if args.get(name)}
+    conditions = list(FIXED_CONDITIONS.get(search_type, []))
+    for name, raw in values.items():
+        col, operator, parse = filters[name]
+        try:
+            value = parse(raw)
+        except ValueError:
+            raise SearchError(f"{name} must be a number")
+        if operator == "eq":
+            conditions.append(col == value)
+        elif operator == "ge":
+            conditions.append(col >= value)
+        else:
+            conditions.append(col <= value)
+    return conditions
+
+
+def search_query(search_type, text, conditions):
+    """
+    The select for one search: matched rows with their rank (best first) if
+    `text` has any words, else every row passing the filters in id order.
+    """
+    model, key, fts_name, _ = SEARCH_TYPES[search_type]
+    columns = [getattr(model, c.key) for c in model.__table__.columns]
+    match = match_expression(text)
+    if not match:
+        return select(*columns).where(*conditions), None
+
+    fts = table(fts_name, column("rowid"), column("rank"))
+    query = (
+        select(*columns, fts.c.rank)
+        .select_from(fts)
+        .join(model, key == fts.c.rowid)
+        .where(literal_column(fts_name).op("MATCH")(match), *conditions)
+    )
+    return query, fts.c.rank
+
+
+def decode_ranked_cursor(cursor):
+    """
+    The (rank, id) a ranked search cursor points after. Raises InvalidCursor
+    for any other shape, e.g. a cursor from a search without ?q=.
+    """
+    after = decode_value(cursor)
+    if not isinstance(after, list) or len(after) != 2:
+        raise InvalidCursor("Invalid cursor")
+    last_rank, last_id = after
+    if not isinstance(last_rank, (int, float)) or isinstance(last_rank, bool):
+        raise InvalidCursor("Invalid cursor")
+    if not isinstance(last_id, int) or isinstance(last_id, bool):
+        raise InvalidCursor("Invalid cursor")
+    return last_rank, last_id
+
+
+def search():
+    """
+    Run the request's search (?type=, ?q=, filters, ?limit=, ?cursor=) and
+    return (rows as dicts, next_cursor).
+    """
+    search_type = request.args.get("type", "campaigns")
+    if search_type not in SEARCH_TYPES:
+        raise SearchError(f"type must be one of {', '.join(SEARCH_TYPES)}")
+    model, key = SEARCH_TYPES[search_type][:2]
+    query, rank = search_query(search_type, request.args.get("q"), parse_filters(search_type, request.args))
+
+    cursor = request.args.get("cursor")
+    if cursor:
+        if rank is None:
+            query = query.where(key > decode_cursor(cursor))
+        else:
+            last_rank, last_id = decode_ranked_cursor(cursor)
+            query = query.where(or_(rank > last_rank, and_(rank == last_rank, key > last_id)))
+    order = [key] if rank is None else [rank, key]
+
+    limit = page_size()
+    rows = db.session.execute(query.order_by(*order).limit(limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        last_id = getattr(last, key.key)
+        next_cursor = encode_cursor(last_id if rank is None else [last.rank, last_id])
+
+    serialize = model_serializer(model)
+    return [serialize(row) for row in rows], next_cursor
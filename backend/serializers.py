@@ -0,0 +1,204 @@
+# serializers.py
+# Precompiled row serializers and a fast JSON provider.
+#
+# Model.to_dict() used to walk __table__.columns and getattr() every column of
+# every row, leaving Decimal and date values for the JSON encoder's fallback
+# hook. Instead, a serializer is compiled once per model (and field list): a
+# generated function that builds the dict with a single literal, converting
+# Decimal and date columns inline. The output is exactly what Flask's encoder
+# produced before (Decimal -> str, date/datetime -> HTTP date).
+#
+# FastJSONProvider encodes responses with orjson.
+#
+#   python serializers.py bench    -> time serializing 10k campaigns, before/after
+
+import decimal
+import json
+from datetime import date
+from functools import lru_cache
+
+import orjson
+from flask import g
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import Date, DateTime, Numeric, inspect
+from werkzeug.http import http_date
+
+
+def decimal_to_str(value):
+    return None if value is None else str(value)
+
+
+# Formatting an HTTP date is by far the slowest step, and list rows share few
+# distinct dates (campaign start/end days), so remember recent results
+@lru_cache(maxsize=4096)
+def date_to_http(value):
+    return None if value is None else http_date(value)
+
+
+def column_converter(column):
+    """
+    The function that turns `column`'s Python value into its JSON value, or
+    None if the value can be used as is.
+    """
+    if isinstance(column.type, Numeric) and column.type.asdecimal:
+        return decimal_to_str
+    if isinstance(column.type, (Date, DateTime)):
+        return date_to_http
+    return None
+
+
+def compile_serializer(fields, name="serialize"):
+    """
+    Compile a function obj -> dict from `fields`, a list of
+    (key, converter or None); each key is read as an attribute of obj, so the
+    function works on ORM instances and on Core result rows alike.
+    """
+    namespace = {}
+    items = []
+    for index, (key, converter) in enumerate(fields):
+        if not key.isidentifier():
+            raise ValueError(f"Cannot compile a serializer for field {key!r}")
+        if converter is None:
+            items.append(f"{key!r}: obj.{key}")
+        else:
+            namespace[f"_convert{index}"] = converter
+            items.append(f"{key!r}: _convert{index}(obj.{key})")
+    source = f"def {name}(obj):\n    return {{{', '.join(items)}}}\n"
+    exec(compile(source, f"<serializer {name}>", "exec"), namespace)
+    return namespace[name]
+
+
+_model_serializers = {}
+
+
+def model_serializer(model, fields=None):
+    """
+    The compiled serializer for `model`'s columns, or only those named in
+    `fields` (in table order). Compiled on first use and cached.
+    """
+    cache_key = (model, tuple(fields) if fields is not None else None)
+    serializer = _model_serializers.get(cache_key)
+    if serializer is None:
+        columns = [
+            column for column in model.__table__.columns
+            if fields is None or column.key in fields
+        ]
+        serializer = compile_serializer(
+            [(column.key, column_converter(column)) for column in columns],
+            name=f"serialize_{model.__tablename__}",
+        )
+        _model_serializers[cache_key] = serializer
+    return serializer
+
+
+def serialize(obj):
+    return model_serializer(type(obj))(obj)
+
+
+def serialize_once(obj):
+    """
+    serialize(obj), memoized for the rest of the request by model and
+    primary key, for related entities repeated across many rows. Only use it
+    for objects that are not modified later in the request.
+    """
+    memo = g.setdefault("_serialized", {})
+    key = (type(obj), inspect(obj).identity)
+    if key not in memo:
+        memo[key] = serialize(obj)
+    return memo[key]
+
+
+def include(included, name, obj):
+    """
+    Add `obj` to a normalized response's `included` map,
+    included[name][str(primary key)], and return its primary key.
+    """
+    identity = inspect(obj).identity
+    key = identity[0] if len(identity) == 1 else "-".join(map(str, identity))
+    included.setdefault(name, {}).setdefault(str(key), serialize_once(obj))
+    return key
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask's JSON provider with orjson doing the encoding. Output matches the
+    default provider: sorted keys, Decimal -> str, dates as HTTP dates.
+    """
+
+    def _orjson_options(self, indent=False):
+        # Dates go through self.default so they keep Flask's HTTP date format
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj, **kwargs):
+        if set(kwargs) - {"separators"}:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._orjson_options()).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=self.default, option=self._orjson_options(indent))
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
+
+
+def bench(rows=10000, repeat=5):
+    """
+    Serialize `rows` campaigns the old way (getattr over __table__.columns,
+    then Flask's json encoder) and the new way (compiled serializer, then
+    FastJSONProvider), and print the best time of `repeat` runs.
+    """
+    import time
+    from flask import Flask
+    from models import Campaign
+
+    campaigns = [
+        Campaign(
+            campaign_id=i, sponsor_id=i % 50, name=f"Campaign {i}", description="x" * 200,
+            start_date=date(2024, 1, 1), end_date=date(2024, 12, 31),
+            budget=decimal.Decimal("12345.67"), visibility="public", goals="Reach", niche="Tech",
+        )
+        for i in range(rows)
+    ]
+    app = Flask(__name__)
+    default_provider = DefaultJSONProvider(app)
+    fast_provider = FastJSONProvider(app)
+
+    def before():
+        data = [{c.name: getattr(obj, c.name) for c in obj.__table__.columns} for obj in campaigns]
+        return default_provider.dumps(data, separators=(",", ":"))
+
+    def after():
+        serializer = model_serializer(Campaign)
+        return fast_provider.dumps([serializer(obj) for obj in campaigns])
+
+    assert json.loads(before()) == json.loads(after())
+
+    def best(fn):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - started)
+        return min(timings) * 1000
+
+    old, new = best(before), best(after)
+    print(f"{rows} campaigns  before: {old:.1f} ms  after: {new:.1f} ms  ({old / new:.1f}x)")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        bench()
+    else:
+        print("usage: python serializers.py bench")
@@ -1,46 +1,27 @@
 # sponsor.py
 # Controller for sponsor login and registration....
 
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, request, jsonify, Response, stream_with_context, send_file, current_app
 from models import db, User, Sponsor, Campaign, AdRequest, Influencer, UserFlag, CampaignFlag, Negotiation
-from functools import wraps
 from flask_cors import cross_origin
-import jwt
-from datetime import datetime, timedelta
-import csv
-from io import StringIO
+from datetime import datetime
+import os
 
 from config import cache
+import auth
+import login_dates
+import realtime
+import exports
+import matching
+from caching import principal_cache_key
+from projections import Projection, FieldsError
+from serializers import include, serialize_once
+from transitions import apply_transition, TransitionConflict, TransitionError
 
 sponsor = Blueprint("sponsor_bp", __name__)
-SECRET_KEY = 'your_secret_key'
-
-
-def token_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        token = request.headers.get('Authorization')
-        if not token:
-            return jsonify({"message": "Token is missing!"}), 403
-        try:
-            token = token.split(" ")[1]  # Get token from "Bearer <token>"
-            data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-            request.user = data
-        except jwt.ExpiredSignatureError:
-            return jsonify({"message": "Token has expired!"}), 403
-        except jwt.InvalidTokenError:
-            return jsonify({"message": "Invalid token!"}), 403
-        return f(*args, **kwargs)
-    return decorated_function
-
-
-def sponsor_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if request.user.get('role') != 'sponsor':
-            return jsonify({"message": "Unauthorized"}), 403
-        return f(*args, **kwargs)
-    return decorated_function
+token_required = auth.token_required
+sponsor_required = auth.role_guard("sponsor")
+stream_token_required = auth.token_guard(query_token=True)  # EventSource cannot send headers
 
 
 @sponsor.route("/login", methods=["POST"])
@@ -57,14 +38,9 @@ def login():
         if sponsor_data and not sponsor_data.is_approved:
             return jsonify({"message": "Sponsor account is not approved yet"}), 403
         
-        token = jwt.encode({
-            'user_id': user.user_id,
-            'username': user.username,
-            'role': user.role,
-            'exp': datetime.utcnow() + timedelta(hours=1)
-        }, SECRET_KEY, algorithm='HS256')
-        user.login_date = datetime.utcnow()
-        db.session.commit()
+        token = auth.issue_token(user, sponsor_id=sponsor_data.sponsor_id if sponsor_data else None)
+        login_dates.record_login(user.user_id)
+        db.session.commit()  # Saves the password if check_password rehashed it
         return jsonify({"token": token, "role": user.role}), 200
     return jsonify({"message": "Invalid credentials"}), 401
 
@@ -105,23 +81,29 @@ def register():
         return jsonify({"message": error_message}), 400
 
 
+# The dashboard renders every campaign column; ?fields=a,b narrows it
+DASHBOARD_FIELDS = Projection(Campaign)
+
+
 @sponsor.route("/dashboard/data", methods=["GET"])
 @cross_origin()
 @token_required
 @sponsor_required
-@cache.cached(timeout=60, key_prefix='sponsor_dashboard_data')
+@cache.cached(timeout=300, key_prefix=principal_cache_key('sponsor_dashboard_data', tags=['sponsor_id:{sponsor_id}']))
 def dashboard_data():
     try:
-        user_id = request.user.get('user_id')
-        sponsor = Sponsor.query.filter_by(user_id=user_id).first()
-
-        if not sponsor:
-            return jsonify({"message": "Sponsor not found"}), 404
-
-        campaigns = Campaign.query.filter_by(sponsor_id=sponsor.sponsor_id).all()
-        campaign_data = [campaign.to_dict() for campaign in campaigns]
+        fields = DASHBOARD_FIELDS.fields()
+        campaigns = db.session.execute(
+            DASHBOARD_FIELDS.select(fields)
+            .where(Campaign.sponsor_id == request.principal.sponsor_id)
+            .order_by(Campaign.campaign_id)
+        )
+        serialize = DASHBOARD_FIELDS.serializer(fields)
+        campaign_data = [serialize(campaign) for campaign in campaigns]
         return jsonify({"campaigns": campaign_data}), 200
 
+    except FieldsError as e:
+        return jsonify({"message": str(e)}), 400
     except Exception as e:
         return jsonify({"message": str(e)}), 500
 
@@ -133,10 +115,7 @@ def dashboard_data():
 def add_campaign():
     data = request.json
     try:
-        user_id = request.user.get('user_id')
-        sponsor_data = Sponsor.query.filter_by(user_id=user_id).first()
-        if not sponsor_data:
-            return jsonify({"message": "Sponsor not found"}), 404
+        sponsor_data = request.principal
 
         new_campaign = Campaign(
             sponsor_id=sponsor_data.sponsor_id,
@@ -152,7 +131,6 @@ def add_campaign():
 
         db.session.add(new_campaign)
         db.session.commit()
-        cache.delete('sponsor_dashboard_data')
         return jsonify({"message": "New campaign added successfully", "success": True}), 201
 
     except Exception as e:
@@ -178,6 +156,37 @@ def get_campaign(campaign_id):
         return jsonify({"message": str(e)}), 500
 
 
+@sponsor.route("/campaign/<int:campaign_id>/recommendations", methods=["GET"])
+@cross_origin()
+@token_required
+@sponsor_required
+def campaign_recommendations(campaign_id):
+    """
+    The influencers best matching one of the sponsor's campaigns (matching.py),
+    best first, as influencer dicts with their score. ?limit= defaults to 10.
+    """
+    try:
+        campaign = Campaign.query.filter_by(campaign_id=campaign_id, sponsor_id=request.principal.sponsor_id).first()
+        if not campaign:
+            return jsonify({"message": "Campaign not found"}), 404
+
+        limit = max(1, min(request.args.get("limit", 10, type=int), current_app.config["API_MAX_PAGE_SIZE"]))
+        ranked = matching.recommend(campaign, limit)
+        influencers = {
+            influencer.influencer_id: influencer
+            for influencer in Influencer.query.filter(Influencer.influencer_id.in_([i for i, score in ranked]))
+        }
+        recommendations = [
+            {**influencers[influencer_id].to_dict(), "score": round(score, 4)}
+            for influencer_id, score in ranked
+            if influencer_id in influencers
+        ]
+        return jsonify({"campaign_id": campaign_id, "recommendations": recommendations}), 200
+
+    except Exception as e:
+        return jsonify({"message": str(e)}), 500
+
+
 @sponsor.route("/editcampaign/<int:campaign_id>", methods=["PUT"])
 @cross_origin()
 @token_required
@@ -185,10 +194,7 @@ def get_campaign(campaign_id):
 def edit_campaign(campaign_id):
     data = request.json
     try:
-        user_id = request.user.get('user_id')
-        sponsor_data = Sponsor.query.filter_by(user_id=user_id).first()
-        if not sponsor_data:
-            return jsonify({"message": "Sponsor not found"}), 404
+        sponsor_data = request.principal
 
         campaign = Campaign.query.get(campaign_id)
         if not campaign:
@@ -217,33 +223,119 @@ def edit_campaign(campaign_id):
 @token_required
 @sponsor_required
 def export_campaigns():
+    """
+    Stream the sponsor's campaigns as CSV, one database batch at a time.
+    Optional query parameters:
+      columns  comma separated subset of exports.CAMPAIGN_EXPORT_COLUMNS
+      from/to  only campaigns starting on/after `from` and ending on/before `to` (YYYY-MM-DD)
+      gzip     1 to receive campaigns.csv.gz compressed on the fly
+    """
     try:
-        user_id = request.user.get('user_id')
-        sponsor_data = Sponsor.query.filter_by(user_id=user_id).first()
-        if not sponsor_data:
-            return jsonify({"message": "Sponsor not found"}), 404
-
-        campaigns = Campaign.query.filter_by(sponsor_id=sponsor_data.sponsor_id).all()
-
-        def generate():
-            data = StringIO()
-            writer = csv.writer(data)
-            writer.writerow(["Name", "Description", "Niche", "Budget", "Start Date", "End Date", "Goals", "Visibility"])
-            for campaign in campaigns:
-                writer.writerow([
-                    campaign.name,
-                    campaign.description,
-                    campaign.niche,
-                    str(campaign.budget),
-                    campaign.start_date.strftime("%Y-%m-%d"),
-                    campaign.end_date.strftime("%Y-%m-%d"),
-                    campaign.goals,
-                    campaign.visibility
-                ])
-            yield data.getvalue()
-            data.seek(0)
-
-        return Response(generate(), mimetype='text/csv', headers={"Content-Disposition": "attachment; filename=campaigns.csv"})
+        sponsor_data = request.principal
+
+        try:
+            columns = exports.parse_columns(request.args.get("columns"))
+            start = exports.parse_date(request.args.get("from"), "from")
+            end = exports.parse_date(request.args.get("to"), "to")
+        except exports.ExportError as e:
+            return jsonify({"message": str(e)}), 400
+
+        query = exports.campaign_export_query(sponsor_data.sponsor_id, columns, start, end)
+        headers = [exports.CAMPAIGN_EXPORT_COLUMNS[name][0] for name in columns]
+        chunks = exports.iter_csv(query, headers)
+
+        if request.args.get("gzip") == "1":
+            return Response(
+                stream_with_context(exports.gzip_chunks(chunks)),
+                mimetype='application/gzip',
+                headers={"Content-Disposition": "attachment; filename=campaigns.csv.gz"},
+            )
+        return Response(stream_with_context(chunks), mimetype='text/csv', headers={"Content-Disposition": "attachment; filename=campaigns.csv"})
+
+    except Exception as e:
+        return jsonify({"message": str(e)}), 500
+
+
+@sponsor.route("/export_jobs", methods=["POST"])
+@cross_origin()
+@token_required
+@sponsor_required
+def create_export_job():
+    """
+    Queue a background CSV export of the sponsor's campaigns. Accepts the same
+    columns/from/to filters as /export_campaigns (query string or JSON body).
+    Poll /export_jobs/<job_id> for progress, then fetch /download.
+    """
+    try:
+        sponsor_data = request.principal
+
+        params = {**request.args.to_dict(), **(request.get_json(silent=True) or {})}
+        try:
+            columns = exports.parse_columns(params.get("columns"))
+            start = exports.parse_date(params.get("from"), "from")
+            end = exports.parse_date(params.get("to"), "to")
+        except exports.ExportError as e:
+            return jsonify({"message": str(e)}), 400
+
+        from tasks import export_campaign_data
+
+        job = exports.create_job(sponsor_data.sponsor_id, columns, start, end)
+        export_campaign_data.delay(job["job_id"])
+        return jsonify({"job_id": job["job_id"], "status": job["status"]}), 202
+
+    except Exception as e:
+        return jsonify({"message": str(e)}), 500
+
+
+def sponsor_export_job(job_id):
+    """
+    Return the export job if it belongs to the requesting sponsor, else None.
+    """
+    job = exports.get_job(job_id)
+    if not job or job.get("sponsor_id") != request.principal.sponsor_id:
+        return None
+    return job
+
+
+@sponsor.route("/export_jobs/<job_id>", methods=["GET"])
+@cross_origin()
+@token_required
+@sponsor_required
+def export_job_status(job_id):
+    try:
+        job = sponsor_export_job(job_id)
+        if not job:
+            return jsonify({"message": "Export job not found"}), 404
+
+        status = {key: job.get(key) for key in ("job_id", "status", "total_rows", "rows_written", "bytes_written", "error")}
+        total = job.get("total_rows")
+        status["progress"] = 1.0 if job.get("status") == "done" else (job.get("rows_written", 0) / total if total else 0.0)
+        return jsonify(status), 200
+
+    except Exception as e:
+        return jsonify({"message": str(e)}), 500
+
+
+@sponsor.route("/export_jobs/<job_id>/download", methods=["GET"])
+@cross_origin()
+@token_required
+@sponsor_required
+def download_export_job(job_id):
+    """
+    Download a finished export. Served with send_file(conditional=True), so
+    clients can resume with HTTP Range requests.
+    """
+    try:
+        job = sponsor_export_job(job_id)
+        if not job:
+            return jsonify({"message": "Export job not found"}), 404
+        if job.get("status") != "done":
+            return jsonify({"message": f"Export job is {job.get('status')}"}), 409
+
+        path = exports.job_file(job_id)
+        if not os.path.exists(path):
+            return jsonify({"message": "Export file has expired"}), 410
+        return send_file(path, mimetype="text/csv", as_attachment=True, download_name="campaigns.csv", conditional=True)
 
     except Exception as e:
         return jsonify({"message": str(e)}), 500
@@ -255,10 +347,7 @@ def export_campaigns():
 @sponsor_required
 def delete_campaign(campaign_id):
     try:
-        user_id = request.user.get('user_id')
-        sponsor_data = Sponsor.query.filter_by(user_id=user_id).first()
-        if not sponsor_data:
-            return jsonify({"message": "Sponsor not found"}), 404
+        sponsor_data = request.principal
 
         campaign = Campaign.query.get(campaign_id)
         if not campaign:
@@ -266,8 +355,6 @@ def delete_campaign(campaign_id):
 
         db.session.delete(campaign)
         db.session.commit()
-        cache.delete(f'sponsor_campaign_data_{campaign_id}')
-        cache.delete('sponsor_dashboard_data')
         return jsonify({"message": "Campaign deleted successfully", "success": True}), 200
 
     except Exception as e:
@@ -281,6 +368,11 @@ def delete_campaign(campaign_id):
 @sponsor_required
 # # @cache.cached(timeout=60, key_prefix='sponsor_adrequest_data')
 def adrequest_campaign(campaign_id):
+    """
+    The campaign's ad requests with their influencer, campaign, sponsor and
+    negotiation. With ?normalized=1 each influencer/campaign/sponsor is sent
+    once in an `included` map keyed by id and rows only hold the ids.
+    """
     try:
         adrequests = (
             db.session.query(AdRequest, Influencer, Campaign, Sponsor, Negotiation)
@@ -292,12 +384,20 @@ def adrequest_campaign(campaign_id):
             .all()
         )
 
+        normalized = request.args.get("normalized") == "1"
+        included = {}
         adrequest_data = []
         for adrequest, influencer, campaign, sponsor, negotiation in adrequests:
             adrequest_info = adrequest.to_dict()
-            adrequest_info['influencer'] = influencer.to_dict()
-            adrequest_info['campaign'] = campaign.to_dict()
-            adrequest_info['sponsor'] = sponsor.to_dict()
+            if normalized:
+                adrequest_info['influencer_id'] = include(included, 'influencers', influencer)
+                adrequest_info['campaign_id'] = include(included, 'campaigns', campaign)
+                adrequest_info['sponsor_id'] = include(included, 'sponsors', sponsor)
+            else:
+                # Every row shares the campaign and sponsor; serialize them once
+                adrequest_info['influencer'] = serialize_once(influencer)
+                adrequest_info['campaign'] = serialize_once(campaign)
+                adrequest_info['sponsor'] = serialize_once(sponsor)
             
             if negotiation:
                 adrequest_info['negotiation'] = {
@@ -314,6 +414,8 @@ def adrequest_campaign(campaign_id):
 
             adrequest_data.append(adrequest_info)
         # print(adrequest_data)
+        if normalized:
+            return jsonify({"adrequests": adrequest_data, "included": included}), 200
         return jsonify({"adrequests": adrequest_data}), 200
 
     except Exception as e:
@@ -329,10 +431,7 @@ def add_adRequest_data():
     data = request.json
     # print(data)
     try:
-        user_id = request.user.get('user_id')
-        sponsor_data = Sponsor.query.filter_by(user_id=user_id).first()
-        if not sponsor_data:
-            return jsonify({"message": "Sponsor not found"}), 404
+        sponsor_data = request.principal
         payment_amount= data['payment_amount']
         print(type(payment_amount))
         payment_amount= float(data['payment_amount'])
@@ -348,10 +447,6 @@ def add_adRequest_data():
         db.session.add(new_ad_req)
         db.session.commit()
 
-
-        # Clear cache for ad request data and dashboard data
-        cache.delete(f'sponsor_adrequest_data_{data["campaign_id"]}')
-        cache.delete('sponsor_dashboard_data')
         return jsonify({"message": "New ad_request added successfully", "success": True}), 201
 
     
@@ -380,10 +475,6 @@ def edit_adRequest_data(ad_request_id):
     
         db.session.commit()
 
-        # Clear cache for ad request data and dashboard data
-        cache.delete(f'sponsor_adrequest_data_{ad_reqst.campaign_id}')
-        cache.delete('sponsor_dashboard_data')
-
         return jsonify({"message": "Ad_reqst updated successfully", "success": True}), 200
     except Exception as e:
         db.session.rollback()
@@ -396,22 +487,27 @@ def edit_adRequest_data(ad_request_id):
 @sponsor_required
 def approve_ad_request(request_id):
     try:
-        user_id = request.user.get('user_id')
-        sponsor_data = Sponsor.query.filter_by(user_id=user_id).first()
-        if not sponsor_data:
-            return jsonify({"message": "Sponsor not found"}), 404
+        sponsor_data = request.principal
 
         # Fetching the ad request based on the request_id
         ad_request = AdRequest.query.get(request_id)
         if not ad_request or ad_request.campaign.sponsor_id != sponsor_data.sponsor_id:
             return jsonify({"message": "Ad request not found or unauthorized"}), 403
 
-        # Approving the ad request
-        ad_request.request_status = 'approved'
-        db.session.commit()
+        # Approving the ad request, together with its negotiation if there is one
+        negotiation = Negotiation.query.filter_by(ad_request_id=request_id).first()
+        apply_transition(
+            "accept", request_id, ad_request.status, ad_request.influencer_id, ad_request.campaign_id,
+            negotiation_id=negotiation.negotiation_id if negotiation else None,
+            create_negotiation=False,
+        )
 
         return jsonify({"message": "Ad request approved successfully"}), 200
 
+    except TransitionConflict as e:
+        return jsonify({"message": str(e)}), 409
+    except TransitionError as e:
+        return jsonify({"message": str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": str(e)}), 500
@@ -423,22 +519,27 @@ def approve_ad_request(request_id):
 @sponsor_required
 def reject_ad_request(request_id):
     try:
-        user_id = request.user.get('user_id')
-        sponsor_data = Sponsor.query.filter_by(user_id=user_id).first()
-        if not sponsor_data:
-            return jsonify({"message": "Sponsor not found"}), 404
+        sponsor_data = request.principal
 
         # Fetching the ad request based on the request_id
         ad_request = AdRequest.query.get(request_id)
         if not ad_request or ad_request.campaign.sponsor_id != sponsor_data.sponsor_id:
             return jsonify({"message": "Ad request not found or unauthorized"}), 403
 
-        # Rejecting the ad request
-        ad_request.request_status = 'rejected'
-        db.session.commit()
+        # Rejecting the ad request, together with its negotiation if there is one
+        negotiation = Negotiation.query.filter_by(ad_request_id=request_id).first()
+        apply_transition(
+            "reject", request_id, ad_request.status, ad_request.influencer_id, ad_request.campaign_id,
+            negotiation_id=negotiation.negotiation_id if negotiation else None,
+            create_negotiation=False,
+        )
 
         return jsonify({"message": "Ad request rejected successfully"}), 200
 
+    except TransitionConflict as e:
+        return jsonify({"message": str(e)}), 409
+    except TransitionError as e:
+        return jsonify({"message": str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": str(e)}), 500
@@ -456,10 +557,6 @@ def delete_adRequest_data(ad_request_id):
         db.session.delete(ad_reqst)
         db.session.commit()
 
-        # Clear cache for ad request data and dashboard data
-        cache.delete('sponsor_adrequest_data')
-        cache.delete('sponsor_dashboard_data')
-
         return jsonify({"message": "Ad request deleted successfully", "success": True}), 200
     except Exception as e:
         db.session.rollback()
@@ -472,10 +569,7 @@ def delete_adRequest_data(ad_request_id):
 @sponsor_required
 def flag_influencer(influencer_id):
     try:
-        user_id = request.user.get('user_id')
-        sponsor_data = Sponsor.query.filter_by(user_id=user_id).first()
-        if not sponsor_data:
-            return jsonify({"message": "Sponsor not found"}), 404
+        sponsor_data = request.principal
 
         influencer = Influencer.query.get(influencer_id)
         if not influencer:
@@ -504,10 +598,7 @@ def flag_influencer(influencer_id):
 @sponsor_required
 def flag_campaign(campaign_id):
     try:
-        user_id = request.user.get('user_id')
-        sponsor_data = Sponsor.query.filter_by(user_id=user_id).first()
-        if not sponsor_data:
-            return jsonify({"message": "Sponsor not found"}), 404
+        sponsor_data = request.principal
 
         campaign = Campaign.query.get(campaign_id)
         if not campaign or campaign.sponsor_id != sponsor_data.sponsor_id:
@@ -536,10 +627,7 @@ def flag_campaign(campaign_id):
 @sponsor_required
 def view_negotiations():
     try:
-        user_id = request.user.get('user_id')
-        sponsor_data = Sponsor.query.filter_by(user_id=user_id).first()
-        if not sponsor_data:
-            return jsonify({"message": "Sponsor not found"}), 404
+        sponsor_data = request.principal
 
         # Fetching all negotiations associated with the sponsor
         negotiations = Negotiation.query.filter_by(sponsor_id=sponsor_data.sponsor_id).all()
@@ -550,3 +638,14 @@ def view_negotiations():
     except Exception as e:
         return jsonify({"message": str(e)}), 500
 
+
+@sponsor.route("/events", methods=["GET"])
+@cross_origin()
+@stream_token_required
+@sponsor_required
+def dashboard_events():
+    """
+    Server-Sent Events stream of the sponsor's dashboard changes (realtime.py).
+    Reload the dashboard on "ready", then apply the delta events.
+    """
+    return realtime.event_stream(realtime.principal_channels(request.principal))
@@ -3,14 +3,22 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from celery import Celery
 from flask import Flask, render_template
-from flask_mail import Mail, Message
+from flask_mail import Mail
 from datetime import datetime, timedelta, timezone
-from models import db, User, AdRequest, Sponsor, Campaign
+from models import db
+from config import AppConfig, cache
+import exports
+import helper
+import login_dates
+import changelog
+import mailer
+import rollups
 import csv
-import os
+from io import StringIO
 
 # Initialize Flask and Celery
 application = Flask(__name__)
+application.config.from_object(AppConfig)
 application.config['CELERY_BROKER_URL'] = 'redis://localhost:6379/0'  # Use Redis as the broker
 application.config['CELERY_RESULT_BACKEND'] = 'redis://localhost:6379/0'
 application.config['MAIL_SERVER'] = 'smtp://localhost:1025'  # Mailhog SMTP server
@@ -24,6 +32,10 @@ application.config['MAIL_DEFAULT_SENDER']='mankojp23@example.com'
 # Initialize Flask-Mail
 mail = Mail(application)
 
+# Tasks query the same database and cache as the web app
+db.init_app(application)
+cache.init_app(application)
+
 # Initialize Celery
 def make_celery(app):
     celery = Celery(
@@ -36,19 +48,50 @@ def make_celery(app):
 
 celery = make_celery(application)
 
-# Function to send email using Flask-Mail (Mailhog for testing)
+# Celery task to send one batch of messages (dicts, see mailer.build_message) over the SMTP pool
+@celery.task
+def send_mail_batch(messages):
+    with application.app_context():
+        try:
+            sent, failed = mailer.send_batch([mailer.build_message(data) for data in messages])
+        except Exception:
+            mailer.logger.exception("Mail batch of %d messages failed", len(messages))
+            mailer.record_failed(len(messages))
+            return
+        mailer.logger.info("Mail batch finished: %d sent, %d failed", sent, failed)
+
+
+# Function to split messages into MAIL_BATCH_SIZE batches that workers send in parallel
+def queue_mail(messages):
+    batch_size = application.config['MAIL_BATCH_SIZE']
+    batch = []
+    batches = 0
+    for message in messages:
+        batch.append(message)
+        if len(batch) == batch_size:
+            send_mail_batch.delay(batch)
+            batch = []
+            batches += 1
+    if batch:
+        send_mail_batch.delay(batch)
+        batches += 1
+    return batches
+
+
+# Function to send a single email right away over the SMTP pool
 def send_mail(to, subject, html):
-    msg = Message(
-        subject=subject,
-        sender=application.config['MAIL_DEFAULT_SENDER'],
-        recipients=[to],
-        body=html
-    )
-    try:
-        mail.send(msg)
-        print(f"Email sent to {to}")
-    except Exception as e:
-        print(f"Error sending email to {to}: {str(e)}")
+    with application.app_context():
+        try:
+            sent, failed = mailer.send_batch([mailer.build_message({"to": to, "subject": subject, "body": html})])
+        except Exception:
+            mailer.logger.exception("Error sending email to %s", to)
+            mailer.record_failed(1)
+            return
+        if sent:
+            mailer.logger.info("Email sent to %s", to)
+        else:
+            # send_batch has logged the SMTP error and counted the failure
+            mailer.logger.error("Error sending email to %s", to)
 
 # Celery task to send daily reminders to influencers
 @celery.task
@@ -56,104 +99,111 @@ def send_daily_reminders():
     with application.app_context():
         current_time = datetime.now(timezone(timedelta(hours=6, minutes=30))).date()
 
-        # Query influencers who haven't logged in today or have never logged in
-        users = User.query.filter(
-            User.role == 'influencer',
-            (User.login_date == None) | (User.login_date < current_time)
-        ).all()
-
-        for user in users:
-            pending_ad_requests = AdRequest.query.filter_by(influencer_id=user.user_id, status='pending').all()
-            if pending_ad_requests:
-                subject = "Daily Reminder: Visit the App"
-                body = f"Dear {user.username}, please visit the app to manage your pending ad requests."
-                send_mail(user.email, subject, body)
+        # Influencers with pending ad requests who haven't logged in today (or ever),
+        # selected by one query and streamed in batches. Logins still in the
+        # write-behind buffer count too.
+        recent_logins = {
+            user_id for user_id, login_date in login_dates.pending().items()
+            if login_date.date() >= current_time
+        }
+        result = db.session.execute(
+            helper.reminder_candidates_query(current_time).execution_options(yield_per=1000)
+        )
+        messages = (
+            {
+                "to": user.email,
+                "subject": "Daily Reminder: Visit the App",
+                "body": f"Dear {user.username}, please visit the app to manage your pending ad requests.",
+            }
+            for user in result
+            if user.user_id not in recent_logins
+        )
+        batches = queue_mail(messages)
+        print(f"Daily reminders queued in {batches} batches")
 
 # Celery task to send monthly reports to sponsors
 @celery.task
 def send_monthly_report():
     with application.app_context():
         try:
-            sponsors = Sponsor.query.all()
-            report_data = []
-
-            for sponsor in sponsors:
-                campaigns = Campaign.query.filter_by(sponsor_id=sponsor.sponsor_id).all()
-                total_requests = 0
-                accepted_requests = 0
-                rejected_requests = 0
-                pending_requests = 0
-
-                for campaign in campaigns:
-                    ad_requests = AdRequest.query.filter_by(campaign_id=campaign.campaign_id).all()
-                    total_requests += len(ad_requests)
-                    for request in ad_requests:
-                        if request.status == 'accepted':
-                            accepted_requests += 1
-                        elif request.status == 'rejected':
-                            rejected_requests += 1
-                        elif request.status == 'pending':
-                            pending_requests += 1
-
-                report_data.append({
-                    'sponsor': sponsor.company,
-                    'total_requests': total_requests,
-                    'accepted_requests': accepted_requests,
-                    'rejected_requests': rejected_requests,
-                    'pending_requests': pending_requests
-                })
-
-            # Generate the monthly report CSV
-            report_file_path = '/path/to/reports/monthly_report.csv'
-            with open(report_file_path, 'w', newline='') as file:
-                writer = csv.DictWriter(file, fieldnames=['sponsor', 'total_requests', 'accepted_requests', 'rejected_requests', 'pending_requests'])
-                writer.writeheader()
-                for data in report_data:
-                    writer.writerow(data)
-
-            # Send the report to each sponsor
-            for sponsor in sponsors:
-                msg = Message(
-                    subject="Monthly Report: Ad Requests Overview",
-                    sender="Influencia@example.com",
-                    recipients=[sponsor.contact_email],
-                    body=f"Dear {sponsor.company},\n\nAttached is your monthly report of ad requests for your campaigns."
-                )
-                try:
-                    with open(report_file_path, 'rb') as fp:
-                        msg.attach('monthly_report.csv', 'text/csv', fp.read())
-                    mail.send(msg)
-                    print(f"Monthly report sent to {sponsor.company}")
-                except Exception as e:
-                    print(f"Error sending email to {sponsor.company}: {str(e)}")
+            fieldnames = ['sponsor', 'campaigns', 'total_requests'] + [f'{status}_requests' for status in helper.AD_REQUEST_STATUSES]
+
+            # One aggregate query, streamed in batches; every sponsor gets only their own numbers
+            result = db.session.execute(helper.sponsor_report_query().execution_options(yield_per=1000))
+
+            def messages():
+                for report in result.mappings():
+                    if not report['email']:
+                        continue
+                    row = {'sponsor': report['company_name'], **{name: report[name] for name in fieldnames[1:]}}
+
+                    attachment = StringIO()
+                    writer = csv.DictWriter(attachment, fieldnames=fieldnames)
+                    writer.writeheader()
+                    writer.writerow(row)
+
+                    yield {
+                        "to": report['email'],
+                        "subject": "Monthly Report: Ad Requests Overview",
+                        "sender": "Influencia@example.com",
+                        "body": f"Dear {report['company_name']},\n\nAttached is your monthly report of ad requests for your campaigns.",
+                        "html": render_template('monthly_report.html', report=row),
+                        "attachments": [['monthly_report.csv', 'text/csv', attachment.getvalue()]],
+                    }
+
+            batches = queue_mail(messages())
+            print(f"Monthly reports queued in {batches} batches")
         except Exception as ex:
             print(f"Error in monthly report task: {str(ex)}")
 
-# Celery task to export campaign data to CSV
+# Celery task to export a sponsor's campaigns to a spooled CSV file (see exports.run_job)
 @celery.task
-def export_campaign_data():
+def export_campaign_data(job_id):
     with application.app_context():
         try:
-            campaigns = Campaign.query.all()
-            campaign_data = []
-
-            for campaign in campaigns:
-                campaign_data.append({
-                    'title': campaign.title,
-                    'description': campaign.campaign_description,
-                    'start': campaign.start.strftime('%Y-%m-%d'),
-                    'end': campaign.end.strftime('%Y-%m-%d'),
-                    'visibility': campaign.visibility,
-                    'budget': campaign.campaign_budget
-                })
-
-            export_file_path = '/path/to/reports/campaign_data.csv'
-            with open(export_file_path, 'w', newline='') as file:
-                writer = csv.DictWriter(file, fieldnames=['title', 'description', 'start', 'end', 'visibility', 'budget'])
-                writer.writeheader()
-                for data in campaign_data:
-                    writer.writerow(data)
-
-            print(f"Campaign data successfully exported to {export_file_path}")
+            job = exports.run_job(job_id)
+            print(f"Export job {job_id} finished: {job['rows_written']} rows")
         except Exception as ex:
-            print(f"Error in exporting campaign data: {str(ex)}")
+            exports.update_job(job_id, status="failed", error=str(ex))
+            print(f"Error in export job {job_id}: {str(ex)}")
+
+
+# Celery task to delete expired export files
+@celery.task
+def purge_export_spool():
+    with application.app_context():
+        removed = exports.purge_spool(application.config['EXPORT_JOB_TTL'])
+        print(f"Removed {removed} expired export files")
+
+
+# Celery task to write buffered login dates in one batch
+@celery.task
+def flush_login_dates():
+    with application.app_context():
+        try:
+            updated = login_dates.flush()
+            print(f"Recorded login dates of {updated} users")
+        except Exception as e:
+            print(f"Error flushing login dates: {str(e)}")
+
+
+# Celery task to fold new analytics events into the daily rollups
+@celery.task
+def update_rollups():
+    with application.app_context():
+        try:
+            folded = rollups.update()
+            print(f"Folded {folded} events into the daily rollups")
+        except Exception as e:
+            print(f"Error updating rollups: {str(e)}")
+
+
+# Celery task to drop change log entries every consumer has processed
+@celery.task
+def prune_change_log():
+    with application.app_context():
+        try:
+            deleted = changelog.prune(application.config['CHANGE_LOG_RETENTION'])
+            print(f"Pruned {deleted} change log entries")
+        except Exception as e:
+            print(f"Error pruning the change log: {str(e)}")
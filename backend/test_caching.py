@@ -0,0 +1,56 @@
+# test_caching.py
+# Stale-while-revalidate entries and tag invalidation.
+#
+#   pytest --maxfail=1 --disable-warnings -q
+
+from caching import acquire_lock, cache_stats, principal_key, release_lock
+from models import db, Campaign
+
+
+def campaign_names(client):
+    response = client.get("/api/available-campaigns")
+    assert response.status_code == 200
+    return [campaign["name"] for campaign in response.get_json()]
+
+
+def rename_campaign(name):
+    db.session.get(Campaign, 1).name = name
+    db.session.commit()
+
+
+def test_write_serves_stale_while_one_worker_refreshes(client):
+    assert campaign_names(client) == ["Campaign 1"]
+    rename_campaign("Renamed")
+
+    # Another worker is refreshing: the entry is still reachable and served stale
+    lock_key = "lock:" + principal_key("available_campaigns", view_args={}, query_args=[])
+    token = acquire_lock(lock_key, 30)
+    assert token is not None
+    assert campaign_names(client) == ["Campaign 1"]
+    release_lock(lock_key, token)
+
+    # The next request takes the lock and refreshes
+    assert campaign_names(client) == ["Renamed"]
+    assert campaign_names(client) == ["Renamed"]
+
+    stats = cache_stats()["public_campaigns"]
+    assert (stats["miss"], stats["stale"], stats["refresh"], stats["hit"]) == (1, 1, 1, 1)
+
+
+def test_write_during_refresh_leaves_the_new_entry_stale(client, monkeypatch):
+    assert campaign_names(client) == ["Campaign 1"]
+
+    # A write that commits while the view is computing must not be hidden by its result
+    import app
+    original = app.keyset_page
+
+    def keyset_page_then_write(*args, **kwargs):
+        page = original(*args, **kwargs)
+        rename_campaign("Renamed")
+        return page
+
+    rename_campaign("Computing")
+    monkeypatch.setattr(app, "keyset_page", keyset_page_then_write)
+    assert campaign_names(client) == ["Computing"]
+    monkeypatch.setattr(app, "keyset_page", original)
+    assert campaign_names(client) == ["Renamed"]
@@ -0,0 +1,133 @@
+# test_mailer.py
+# mailer.send_batch against a local SMTP server (aiosmtpd).
+#
+#   pytest --maxfail=1 --disable-warnings -q
+
+import socket
+import threading
+import time
+
+import pytest
+from aiosmtpd.controller import Controller
+from flask import Flask
+from flask_mail import Mail
+
+import mailer
+from config import cache
+
+
+class Recorder:
+    """
+    SMTP handler that accepts every message, after answering the first
+    `reject_first` deliveries with `reply` (e.g. a 4xx to force retries).
+    """
+
+    def __init__(self, reject_first=0, reply="451 4.3.0 Try again later"):
+        self.reject_first = reject_first
+        self.reply = reply
+        self.received = []
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    async def handle_DATA(self, server, session, envelope):
+        with self.lock:
+            if self.rejected < self.reject_first:
+                self.rejected += 1
+                return self.reply
+            self.received.append((time.time(), envelope.rcpt_tos))
+        return "250 Message accepted for delivery"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp():
+    def start(handler):
+        controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+        controller.start()
+        servers.append(controller)
+        return controller
+
+    servers = []
+    yield start
+    for controller in servers:
+        controller.stop()
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config.update(
+        CACHE_TYPE="SimpleCache",
+        MAIL_DEFAULT_SENDER="noreply@example.com",
+        MAIL_POOL_SIZE=2,
+        MAIL_RATE_LIMIT=0,
+        MAIL_MAX_RETRIES=3,
+        MAIL_RETRY_BACKOFF=0.01,
+    )
+    cache.init_app(app)
+    Mail(app)
+    with app.app_context():
+        yield app
+        mailer.get_pool().close()
+
+
+def use_server(app, controller):
+    app.config.update(MAIL_SERVER=f"smtp://{controller.hostname}:{controller.port}", MAIL_PORT=controller.port)
+
+
+def messages(count):
+    return [
+        mailer.build_message({"to": f"user{i}@example.com", "subject": "Hello", "body": f"Message {i}"})
+        for i in range(count)
+    ]
+
+
+def test_send_batch_delivers_every_message(app, smtp):
+    handler = Recorder()
+    use_server(app, smtp(handler))
+
+    assert mailer.send_batch(messages(10)) == (10, 0)
+
+    assert sorted(rcpt[0] for _, rcpt in handler.received) == sorted(f"user{i}@example.com" for i in range(10))
+    stats = mailer.mail_stats()
+    assert (stats["sent"], stats["failed"], stats["retried"]) == (10, 0, 0)
+    assert stats["last_batch"]["sent"] == 10
+
+
+def test_send_batch_retries_transient_failures(app, smtp):
+    handler = Recorder(reject_first=2)
+    use_server(app, smtp(handler))
+
+    assert mailer.send_batch(messages(3)) == (3, 0)
+
+    assert len(handler.received) == 3
+    assert mailer.mail_stats()["retried"] == 2
+
+
+def test_send_batch_gives_up_on_permanent_failures(app, smtp):
+    handler = Recorder(reject_first=1, reply="550 5.1.1 Mailbox unavailable")
+    use_server(app, smtp(handler))
+
+    assert mailer.send_batch(messages(1)) == (0, 1)
+
+    assert handler.received == []
+    stats = mailer.mail_stats()
+    assert (stats["failed"], stats["retried"], stats["failure_rate"]) == (1, 0, 1.0)
+
+
+def test_send_batch_respects_rate_limit(app, smtp):
+    handler = Recorder()
+    use_server(app, smtp(handler))
+    app.config["MAIL_RATE_LIMIT"] = 5
+
+    started = time.time()
+    assert mailer.send_batch(messages(12)) == (12, 0)
+
+    # 12 messages at 5 per second need three one-second windows
+    assert len(handler.received) == 12
+    assert time.time() - started > 1.0
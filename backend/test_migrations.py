@@ -0,0 +1,59 @@
+# test_migrations.py
+# Migrations build the schema the hot queries are planned against.
+#
+#   pytest --maxfail=1 --disable-warnings -q
+
+import pytest
+from flask import Flask
+
+import migrations
+from models import db
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'migrations.db'}"
+    db.init_app(app)
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+def latest_version():
+    return migrations.MIGRATIONS[-1][0]
+
+
+def test_fresh_database_plans_use_indexes(app):
+    db.create_all()
+    migrations.upgrade()
+
+    assert migrations.current_version(db.session.connection()) == latest_version()
+    assert migrations.check_query_plans() == {}
+
+
+def test_upgrade_adds_indexes_to_existing_database(app):
+    # A database created before the indexes existed: tables only
+    db.create_all()
+    with db.engine.begin() as conn:
+        indexes = conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%'"
+        ).scalars().all()
+        for name in indexes:
+            conn.exec_driver_sql(f"DROP INDEX {name}")
+    assert migrations.check_query_plans() != {}
+    db.session.rollback()  # end the read transaction that still sees the old schema
+
+    applied = migrations.upgrade()
+
+    assert [number for number, description in applied] == [number for number, _, _ in migrations.MIGRATIONS]
+    assert migrations.check_query_plans() == {}
+
+
+def test_upgrade_is_idempotent(app):
+    db.create_all()
+    migrations.upgrade()
+
+    assert migrations.upgrade() == []
+    assert migrations.current_version(db.session.connection()) == latest_version()
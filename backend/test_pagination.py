@@ -0,0 +1,66 @@
+# test_pagination.py
+# Keyset pagination of the list endpoints.
+#
+#   pytest --maxfail=1 --disable-warnings -q
+
+import base64
+import json
+
+import pytest
+
+from pagination import InvalidCursor, decode_cursor, encode_cursor
+
+
+def crafted(value):
+    raw = json.dumps({"after": value}).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+BAD_CURSORS = [crafted([1]), crafted({"a": 1}), crafted("abc"), crafted(True), crafted(1.5), crafted(None), "%%%"]
+
+
+def test_decode_cursor_round_trip():
+    assert decode_cursor(encode_cursor(42)) == 42
+
+
+@pytest.mark.parametrize("cursor", BAD_CURSORS)
+def test_decode_cursor_rejects_non_integer_keys(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+@pytest.mark.parametrize("path", ["/api/available-campaigns", "/api/advert-requests", "/api/creators", "/api/all-users"])
+@pytest.mark.parametrize("cursor", BAD_CURSORS)
+def test_crafted_cursor_is_a_bad_request(client, path, cursor):
+    response = client.get(path, query_string={"cursor": cursor})
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid cursor", "success": False}
+
+
+@pytest.mark.parametrize("cursor", BAD_CURSORS)
+def test_crafted_cursor_is_a_bad_request_for_admin_lists(client, login, cursor):
+    response = client.get("/admin/user_flags", query_string={"cursor": cursor}, headers=login("admin", "admin"))
+
+    assert response.status_code == 400
+
+
+def test_pages_follow_the_next_cursor(client, login):
+    headers = login("sponsor", "sponsor")
+    for number in range(2, 6):
+        response = client.post("/sponsor/addcampaign", headers=headers, json={
+            "name": f"Campaign {number}", "description": "d", "startDate": "2024-01-01", "endDate": "2024-12-31",
+            "budget": 1000, "visibility": "public", "goals": "g", "niche": "tech",
+        })
+        assert response.status_code in (200, 201), response.get_json()
+
+    names, cursor = [], None
+    while True:
+        response = client.get("/api/available-campaigns", query_string={"limit": 2, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        names += [campaign["name"] for campaign in response.get_json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    assert names == [f"Campaign {number}" for number in range(1, 6)]
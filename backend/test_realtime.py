@@ -0,0 +1,59 @@
+# test_realtime.py
+# The events published when campaigns change visibility.
+#
+#   pytest --maxfail=1 --disable-warnings -q
+
+import pytest
+
+import realtime
+from models import db, Campaign
+
+
+@pytest.fixture
+def published(web_app, monkeypatch):
+    """
+    The [(channels, event)] batches published on commit, in order.
+    """
+    batches = []
+    monkeypatch.setattr(realtime, "publish", batches.append)
+    return batches
+
+
+def test_campaign_made_private_is_only_withdrawn_from_influencers(published):
+    campaign = db.session.get(Campaign, 1)
+    campaign.visibility = "private"
+    db.session.flush()
+    campaign.name = "Secret launch"
+    db.session.commit()
+
+    [events] = published
+    channels = {channel: event for event_channels, event in events for channel in event_channels}
+    assert channels[realtime.PUBLIC_CAMPAIGNS] == {
+        "type": "campaign", "op": "update", "campaign_id": 1, "visibility": "private",
+    }
+    assert channels["sponsor:1"]["name"] == "Secret launch"
+
+
+def test_private_campaign_never_reaches_influencers(published):
+    campaign = db.session.get(Campaign, 1)
+    campaign.visibility = "private"
+    db.session.commit()
+    campaign.name = "Secret launch"
+    db.session.commit()
+    campaign.visibility = "public"
+    db.session.flush()
+    campaign.visibility = "private"
+    db.session.commit()
+
+    assert [sorted(channel for channels, _ in events for channel in channels) for events in published] == [
+        ["campaigns:public", "sponsor:1"], ["sponsor:1"], ["sponsor:1"],
+    ]
+
+
+def test_public_campaign_reaches_influencers_in_full(published):
+    db.session.get(Campaign, 1).name = "Launch"
+    db.session.commit()
+
+    [[(channels, event)]] = published
+    assert channels == ["campaigns:public", "sponsor:1"]
+    assert event["name"] == "Launch"
@@ -0,0 +1,93 @@
+# test_search.py
+# Ranked full-text search and its cursors.
+#
+#   pytest --maxfail=1 --disable-warnings -q
+
+from datetime import date
+
+import pytest
+
+from models import db, Campaign
+from pagination import encode_cursor
+
+
+@pytest.fixture
+def campaigns(web_app):
+    """
+    Seven public "summer" campaigns of varying relevance and a private one.
+    """
+    def campaign(name, description, visibility="public"):
+        return Campaign(
+            sponsor_id=1, name=name, description=description, start_date=date(2024, 6, 1),
+            end_date=date(2024, 8, 31), budget=1000, visibility=visibility, goals="Reach", niche="travel",
+        )
+
+    rows = [
+        campaign("Summer sale", "summer summer deals"),
+        campaign("Summer trip", "a trip"),
+        campaign("Beach week", "summer on the beach"),
+        campaign("Summer tour", "summer tour of the coast"),
+        campaign("Winter sale", "not in summer"),
+        campaign("Summer camp", "camp"),
+        campaign("Road trip", "summer road trip"),
+        campaign("Summer secret", "summer summer summer", visibility="private"),
+    ]
+    db.session.add_all(rows)
+    db.session.commit()
+    return {row.name: row.campaign_id for row in rows}
+
+
+def search_pages(client, **args):
+    """
+    Follow X-Next-Cursor through every page; returns the pages' names.
+    """
+    pages, cursor = [], None
+    while True:
+        response = client.get("/api/search", query_string={**args, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200, response.get_json()
+        pages.append([row["name"] for row in response.get_json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return pages
+
+
+def test_ranked_search_pages_through_every_match_once(client, campaigns):
+    everything = search_pages(client, type="campaigns", q="summer", limit=50)[0]
+    pages = search_pages(client, type="campaigns", q="summer", limit=2)
+
+    assert len(everything) == 7
+    assert "Summer secret" not in everything
+    assert [len(page) for page in pages] == [2, 2, 2, 1]
+    assert [name for page in pages for name in page] == everything
+
+
+def test_unranked_search_pages_in_id_order(client, campaigns):
+    pages = search_pages(client, type="campaigns", niche="travel", limit=3)
+
+    names = [name for page in pages for name in page]
+    assert names == sorted(names, key=campaigns.get)
+    assert "Summer secret" not in names
+
+
+def test_private_campaigns_are_never_searched(client, campaigns):
+    response = client.get("/api/search", query_string={"type": "campaigns", "q": "secret", "visibility": "private"})
+
+    assert response.status_code == 200
+    assert response.get_json() == []
+
+
+@pytest.mark.parametrize("args", [
+    {"q": "summer", "cursor": encode_cursor(3)},
+    {"q": "summer", "cursor": encode_cursor([-1.5])},
+    {"q": "summer", "cursor": encode_cursor(["a", 3])},
+    {"q": "summer", "cursor": encode_cursor([-1.5, "3"])},
+    {"q": "summer", "cursor": encode_cursor([True, 3])},
+    {"cursor": encode_cursor([-1.5, 3])},
+    {"cursor": encode_cursor("3")},
+    {"cursor": "not a cursor"},
+])
+def test_cursor_of_the_wrong_shape_is_a_bad_request(client, campaigns, args):
+    response = client.get("/api/search", query_string={"type": "campaigns", **args})
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid cursor", "success": False}
@@ -0,0 +1,99 @@
+# test_transitions.py
+# apply_transition: conditional status changes, negotiations and cache tags.
+#
+#   pytest --maxfail=1 --disable-warnings -q
+
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from caching import tag_versions
+from models import db, AdRequest, Negotiation
+from transitions import TransitionConflict, TransitionError, apply_transition
+
+TAGS = ["ad_request_id:1", "influencer_id:1", "campaign_id:1", "ad_requests", "negotiations"]
+
+
+@pytest.fixture
+def commits(web_app):
+    """
+    The number of commits made by the test so far, as a one-item list.
+    """
+    count = [0]
+
+    def counted(session):
+        count[0] += 1
+
+    event.listen(Session, "after_commit", counted)
+    yield count
+    event.remove(Session, "after_commit", counted)
+
+
+def statuses(ad_request_id):
+    db.session.expire_all()
+    return (
+        db.session.get(AdRequest, ad_request_id).status,
+        [(n.negotiation_status, n.proposed_payment_amount)
+         for n in Negotiation.query.filter_by(ad_request_id=ad_request_id).order_by(Negotiation.negotiation_id)],
+    )
+
+
+def test_stale_expected_status_writes_nothing(commits):
+    before, versions = statuses(1), tag_versions(TAGS)
+
+    with pytest.raises(TransitionConflict):
+        apply_transition("accept", 1, "negotiation", 1, 1, negotiation_id=1, amount=Decimal("500.00"))
+
+    assert statuses(1) == before
+    assert tag_versions(TAGS) == versions
+    assert commits[0] == 0
+
+
+def test_final_status_cannot_transition(commits):
+    apply_transition("reject", 1, "pending", 1, 1, negotiation_id=1)
+
+    with pytest.raises(TransitionError):
+        apply_transition("accept", 1, "rejected", 1, 1, negotiation_id=1)
+
+    assert statuses(1)[0] == "rejected"
+    assert commits[0] == 1
+
+
+@pytest.mark.parametrize("action, amount, expected", [
+    ("accept", Decimal("1000.00"), ("accepted", [("accepted", Decimal("1000.00"))])),
+    ("reject", None, ("rejected", [("rejected", Decimal("1000.00"))])),
+    ("negotiate", Decimal("750.00"), ("negotiation", [("pending", Decimal("750.00"))])),
+])
+def test_transition_updates_the_negotiation_in_one_commit(commits, action, amount, expected):
+    db.session.get(Negotiation, 1).proposed_payment_amount = Decimal("1000.00")
+    db.session.commit()
+    commits[0] = 0
+    versions = tag_versions(TAGS)
+
+    assert apply_transition(action, 1, "pending", 1, 1, negotiation_id=1, amount=amount) == expected[0]
+
+    assert statuses(1) == expected
+    assert commits[0] == 1
+    assert all(after > before for before, after in zip(versions, tag_versions(TAGS)))
+
+
+def test_transition_creates_the_missing_negotiation_in_one_commit(commits):
+    ad_request = AdRequest(campaign_id=1, influencer_id=1, payment_amount=Decimal("300.00"), status="pending")
+    db.session.add(ad_request)
+    db.session.commit()
+    commits[0] = 0
+
+    apply_transition("negotiate", ad_request.ad_request_id, "pending", 1, 1, amount=Decimal("400.00"))
+
+    assert statuses(ad_request.ad_request_id) == ("negotiation", [("pending", Decimal("400.00"))])
+    assert commits[0] == 1
+
+
+def test_negotiate_again_updates_the_same_negotiation(commits):
+    apply_transition("negotiate", 1, "pending", 1, 1, negotiation_id=1, amount=Decimal("750.00"))
+    apply_transition("negotiate", 1, "negotiation", 1, 1, negotiation_id=1, amount=Decimal("800.00"))
+
+    assert statuses(1) == ("negotiation", [("pending", Decimal("800.00"))])
+    assert commits[0] == 2
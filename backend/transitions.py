@@ -0,0 +1,99 @@
+# transitions.py
+# Ad request / negotiation state machine.
+#
+# Every status change of an ad request goes through apply_transition, which
+# applies it in a single transaction with a single commit: a conditional
+#   UPDATE ad_requests SET status = :to WHERE ad_request_id = :id AND status = :expected
+# (so two concurrent clicks cannot both succeed), plus the matching update or
+# insert of the Negotiation row.
+
+from sqlalchemy import update
+
+import realtime
+from caching import mark_changed
+from models import db, AdRequest, Negotiation
+
+# action -> the ad request statuses it may start from, the status it leads to
+# and the status the request's negotiation takes. accepted and rejected are
+# final.
+TRANSITIONS = {
+    "accept": {"from": ("pending", "negotiation"), "to": "accepted", "negotiation_status": "accepted"},
+    "reject": {"from": ("pending", "negotiation"), "to": "rejected", "negotiation_status": "rejected"},
+    "negotiate": {"from": ("pending", "negotiation"), "to": "negotiation", "negotiation_status": "pending"},
+}
+
+# Shown when an action is attempted on a request that is already final
+FINAL_STATUS_MESSAGES = {
+    "accepted": "You have Already Accepted the Ad Request !! ",
+    "rejected": "You have Already Rejected the Ad Request !! ",
+}
+
+
+class TransitionError(ValueError):
+    pass
+
+
+class TransitionConflict(TransitionError):
+    pass
+
+
+def check_transition(action, status):
+    """
+    Raise TransitionError unless `action` is allowed from `status`.
+    """
+    rule = TRANSITIONS.get(action)
+    if rule is None:
+        raise TransitionError(f"Unknown action {action}")
+    if status not in rule["from"]:
+        raise TransitionError(FINAL_STATUS_MESSAGES.get(status, f"Cannot {action} an ad request that is {status}"))
+    return rule
+
+
+def apply_transition(action, ad_request_id, expected_status, influencer_id, campaign_id,
+                     negotiation_id=None, amount=None, create_negotiation=True):
+    """
+    Move ad request `ad_request_id` from `expected_status` (the status the
+    caller read) according to `action`, and update its negotiation - the
+    existing row `negotiation_id`, or a new one if `create_negotiation`.
+    `amount`, when given, becomes the negotiation's proposed payment amount.
+
+    Raises TransitionError if the action is not allowed from
+    `expected_status`, and TransitionConflict if the row no longer has that
+    status. Nothing is written in either case.
+    """
+    rule = check_transition(action, expected_status)
+    try:
+        result = db.session.execute(
+            update(AdRequest)
+            .where(AdRequest.ad_request_id == ad_request_id, AdRequest.status == expected_status)
+            .values(status=rule["to"])
+        )
+        if result.rowcount != 1:
+            raise TransitionConflict("The ad request was changed in the meantime, please reload and try again")
+
+        values = {"negotiation_status": rule["negotiation_status"]}
+        if amount is not None:
+            values["proposed_payment_amount"] = amount
+        if negotiation_id is not None:
+            db.session.execute(
+                update(Negotiation).where(Negotiation.negotiation_id == negotiation_id).values(**values)
+            )
+        elif create_negotiation:
+            db.session.add(Negotiation(ad_request_id=ad_request_id, influencer_id=influencer_id, **values))
+
+        # The bulk UPDATEs bypass the unit of work, so declare their cache tags
+        # and dashboard events
+        realtime.queue_rows(db.session, AdRequest, [ad_request_id])
+        if negotiation_id is not None:
+            realtime.queue_rows(db.session, Negotiation, [negotiation_id])
+        mark_changed(db.session, {
+            "ad_requests", "negotiations",
+            f"ad_request_id:{ad_request_id}",
+            f"influencer_id:{influencer_id}",
+            f"campaign_id:{campaign_id}",
+        })
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return rule["to"]